@@ -29,14 +29,20 @@ from Training.model import my_ac2art_model
 
 import numpy as np
 import librosa
-from Preprocessing.tools_preprocessing import get_delta_features
+from Preprocessing.tools_preprocessing import add_context_frames, load_wav, get_acoustic_features
 import argparse
 
 root_folder = os.path.dirname(os.getcwd())
 
 
-def preprocess_my_wav_files(wav_folder, mfcc_folder, Nmax=0):
+def preprocess_my_wav_files(wav_folder, mfcc_folder, Nmax=0, store_context=False, wav_cache_dir=None,
+                            batch_size=64):
     """
+    :param wav_cache_dir: directory of the cache of the wav resampled at 16kHz (see load_wav), None to not use a cache
+    :param batch_size: number of wav files whose acoustic features are calculated at once (see get_acoustic_features),
+    the files are sorted by size so that the wav of a batch have similar lengths
+    :param store_context: if True save the mfcc with their context frames (K,429), otherwise (K,39) and the context
+    frames are added when the mfcc are loaded for the predictions
     Read all the wav files in "my_wav_files_for_inversion" and preprocess them the extract their acoustic features,
     so that it can be used as input of the my_ac2art model.
     Save the mfcc in "my_mfcc_files_for_inversion" , with the same filename as the corresponding wav.
@@ -57,29 +63,29 @@ def preprocess_my_wav_files(wav_folder, mfcc_folder, Nmax=0):
     wav_files = os.listdir(path_wav)
     if Nmax > 0:
         wav_files = wav_files[:Nmax]
-    for filename in wav_files:
-        if not filename.endswith('.wav'):
-            continue
-        filename = filename[:-4]  #remove extension
-        wav, sr = librosa.load(os.path.join(path_wav,filename+".wav"), sr=sampling_rate_wav_wanted)  # chargement de données
-        wav = 0.5 * wav / np.max(wav)
-        mfcc = librosa.feature.mfcc(y=wav, sr=sr, n_mfcc=n_coeff, n_fft=frame_length, hop_length=hop_length).T
-        dyna_features = get_delta_features(mfcc)
-        dyna_features_2 = get_delta_features(dyna_features)
-        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
-        padding = np.zeros((window, mfcc.shape[1]))
-        frames = np.concatenate([padding, mfcc, padding])
-        full_window = 1 + 2 * window
-        mfcc = np.concatenate([frames[j:j + len(mfcc)] for j in range(full_window)], axis=1)  # add context
-        # normalize
-        mfcc =( mfcc - mfcc.mean(axis = 0, keepdims=True) )/ mfcc.std(axis = 0, keepdims=True)
-        np.save(os.path.join(root_folder, "Predictions_arti",mfcc_folder, filename), mfcc)
+    filenames = [filename[:-4] for filename in wav_files if filename.endswith('.wav')]  #remove extension
+    filenames = sorted(filenames, key=lambda filename: os.path.getsize(os.path.join(path_wav, filename + ".wav")))
+    for start in range(0, len(filenames), batch_size):
+        batch = filenames[start:start + batch_size]
+        wavs = []
+        for filename in batch:
+            wav = load_wav(os.path.join(path_wav,filename+".wav"), sampling_rate_wav_wanted, cache_dir=wav_cache_dir)
+            wavs.append(0.5 * wav / np.max(wav))
+        all_mfcc = get_acoustic_features(wavs, sampling_rate_wav_wanted, n_mfcc=n_coeff, n_fft=frame_length,
+                                         hop_length=hop_length)
+        for filename, mfcc in zip(batch, all_mfcc):
+            # normalize
+            mfcc =( mfcc - mfcc.mean(axis = 0, keepdims=True) )/ mfcc.std(axis = 0, keepdims=True)
+            if store_context:
+                mfcc = np.ascontiguousarray(add_context_frames(mfcc, window))
+            np.save(os.path.join(root_folder, "Predictions_arti",mfcc_folder, filename), mfcc)
 
 
 def predictions_arti(model_name,mfcc_folder="my_mfcc_files_for_inversion",
-                     ema_folder="my_articulatory_prediction", output_dim = 18):
+                     ema_folder="my_articulatory_prediction", output_dim = 18, precision="float64"):
     """
     :param model_name: name of model we want to use for the articulatory predictions
+    :param precision: "float64" or "float32", type of the model and of its inputs (see my_ac2art_model)
     with the weights in model_name, this script perform articulatory predictions corresponding to the wav files
     it takes as input the mfcc features already calculated
     the arti predictions are saved my "my_articulatory_prediction" as np array (K,18)
@@ -99,8 +105,7 @@ def predictions_arti(model_name,mfcc_folder="my_mfcc_files_for_inversion",
     batch_norma = False  # future work : read from model name if true or false
     model = my_ac2art_model(hidden_dim=hidden_dim, input_dim=input_dim, output_dim=output_dim,
                             batch_size=batch_size, cuda_avail=False, name_file=model_name,
-                            filter_type=filter_type, batch_norma=batch_norma)
-    model = model.double()
+                            filter_type=filter_type, batch_norma=batch_norma, precision=precision)
     file_weights = os.path.join(root_folder,"Training","saved_models", model_name + ".txt")
     loaded_state = torch.load(file_weights, map_location="cpu")
     model.load_state_dict(loaded_state)
@@ -109,7 +114,9 @@ def predictions_arti(model_name,mfcc_folder="my_mfcc_files_for_inversion",
 
     for mfcc_file in all_my_mfcc_files :
         mfcc = np.load(os.path.join(root_folder,"Predictions_arti",mfcc_folder,mfcc_file))
-        mfcc_torch = torch.from_numpy(mfcc).view(1, -1, input_dim)
+        if mfcc.shape[1] == 39:
+            mfcc = add_context_frames(mfcc, window=5)
+        mfcc_torch = torch.from_numpy(mfcc).to(model.dtype).view(1, -1, input_dim)
         ema_torch = model(mfcc_torch)
         ema = ema_torch.detach().numpy().reshape((-1, output_dim))
         np.save(os.path.join(root_folder,"Predictions_arti",ema_folder,model_name,mfcc_file),ema)
@@ -130,13 +137,18 @@ if __name__ == '__main__':
     parser.add_argument('model_name', type=str, help='the name of your model')
     parser.add_argument('--already_prepro', type=bool, default=False,
                         help='put to True if preprocessin already done for the wav files')
+    parser.add_argument('--wav_cache_dir', type=str, default=None,
+                        help='directory where the wav resampled at 16kHz are cached, by default no cache')
+    parser.add_argument('--precision', type=str, default="float64", choices=["float64", "float32"],
+                        help='type of the model, float32 is faster and needs half the memory')
 
     args = parser.parse_args()
     if not(args.already_prepro):
         print("preprocessing...")
-        preprocess_my_wav_files(wav_folder = args.wav_folder, mfcc_folder = args.mfcc_folder, Nmax=0)
+        preprocess_my_wav_files(wav_folder = args.wav_folder, mfcc_folder = args.mfcc_folder, Nmax=0,
+                                wav_cache_dir=args.wav_cache_dir)
     predictions_arti(model_name = args.model_name, mfcc_folder=args.mfcc_folder,
-                     ema_folder=args.output_folder, output_dim = args.output_dim)
+                     ema_folder=args.output_folder, output_dim = args.output_dim, precision=args.precision)
 
 
 #example name model "F01_spec_loss_0_filter_fix_bn_False_0"
\ No newline at end of file
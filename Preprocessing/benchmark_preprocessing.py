@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Micro-benchmarks of some preprocessing functions.
+    Each benchmark compares the current implementation with the previous one (kept here as reference) on
+    synthetic data, prints the speed up and the max difference between the two outputs.
+    To run all the benchmarks be in the folder "Preprocessing" and type :
+    python benchmark_preprocessing.py
+    or only one of them :
+    python benchmark_preprocessing.py --which smooth_data
+    python benchmark_preprocessing.py --which delta_features
+    python benchmark_preprocessing.py --which moving_average
+    python benchmark_preprocessing.py --which est_reader
+    python benchmark_preprocessing.py --which resample_wav
+    python benchmark_preprocessing.py --which load_wav
+    python benchmark_preprocessing.py --which mfcc
+    python benchmark_preprocessing.py --which synchro
+    python benchmark_preprocessing.py --which shards
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import argparse
+import tempfile
+import timeit
+import numpy as np
+import scipy.io.wavfile
+import librosa
+from Preprocessing.tools_preprocessing import low_pass_filter_weight, low_pass_filter, get_delta_features, \
+    rolling_mean, read_est_file, resample_wav, load_wav, get_mfcc, resample_trajectories
+from Preprocessing.shards import shard_streams, pack_stream, read_shard, load_sentence
+
+
+def random_trajectories(n_points, n_channels=18, seed=0):
+    """
+    :param n_points: number of points of the trajectories
+    :param n_channels: number of trajectories
+    :return: nparray (n_points, n_channels) of random walks, looks like ema trajectories
+    """
+    rng = np.random.RandomState(seed)
+    return np.cumsum(rng.randn(n_points, n_channels), axis=0)
+
+
+def print_result(name, time_ref, time_new, diff):
+    """
+    print one line of result : times of the reference and of the new implementation, speed up and max difference
+    """
+    print("{:<30} reference {:9.1f} us | new {:9.1f} us | speed up x{:5.1f} | max diff {:.1e}".format(
+        name, time_ref * 1e6, time_new * 1e6, time_ref / time_new, diff))
+
+
+def timing(function, number=20, repeat=5):
+    """
+    :return: the best time over repeat of the mean time over number calls of the function
+    """
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def smooth_data_reference(ema, cutoff, sr, pad=30):
+    """
+    previous implementation of Speaker.smooth_data : one padding and one convolution per channel
+    """
+    weights = low_pass_filter_weight(cut_off=cutoff, sampling_rate=sr)
+    my_ema_filtered = np.concatenate([np.expand_dims(np.pad(ema[:, k], (pad, pad), "symmetric"), 1)
+                                      for k in range(ema.shape[1])], axis=1)
+    my_ema_filtered = np.concatenate([np.expand_dims(np.convolve(channel, weights, mode='same'), 1)
+                                      for channel in my_ema_filtered.T], axis=1)
+    return my_ema_filtered[pad:-pad, :]
+
+
+def benchmark_smooth_data(sampling_rate=500, cutoff=10, durations=(1, 3, 10, 30)):
+    """
+    :param sampling_rate: sampling rate of the ema (500Hz for mocha)
+    :param cutoff: cutoff frequency of the low pass filter
+    :param durations: durations in second of the trajectories to smooth
+    compare Speaker.smooth_data (low_pass_filter) with the previous implementation
+    """
+    print("smooth_data, (K,18) trajectories at {}Hz".format(sampling_rate))
+    for duration in durations:
+        ema = random_trajectories(int(duration * sampling_rate))
+        time_ref = timing(lambda: smooth_data_reference(ema, cutoff, sampling_rate))
+        time_new = timing(lambda: low_pass_filter(ema, cut_off=cutoff, sampling_rate=sampling_rate))
+        diff = np.max(np.abs(smooth_data_reference(ema, cutoff, sampling_rate) -
+                             low_pass_filter(ema, cut_off=cutoff, sampling_rate=sampling_rate)))
+        print_result("{}s ({} points)".format(duration, len(ema)), time_ref, time_new, diff)
+
+
+def get_delta_features_reference(array, window=5):
+    """
+    previous implementation of get_delta_features : padded copies of the past and future frames for each lag
+    """
+    all_diff = []
+    for lag in range(1, window + 1):
+        padding = np.ones((lag, array.shape[1]))
+        past = np.concatenate([padding * array[0], array[:-lag]])
+        future = np.concatenate([array[lag:], padding * array[-1]])
+        all_diff.append(future - past)
+    tempo = np.array([all_diff[lag] * lag for lag in range(window)])
+    norm = 2 * np.sum([i ** 2 for i in range(1, window + 1)])
+    delta_features = np.sum(tempo, axis=0) / norm
+    return delta_features
+
+
+def benchmark_delta_features(n_frames=(100, 300, 1000, 3000), batch_size=32):
+    """
+    :param n_frames: numbers of frames of the mfcc (100 frames per second)
+    :param batch_size: number of utterances of the batch given at once to get_delta_features
+    compare get_delta_features (delta and deltadelta, as in Speaker.from_wav_to_mfcc) with the previous implementation,
+    one utterance at a time and for a batch of utterances
+    """
+    print("get_delta_features, (K,13) mfcc, delta and deltadelta")
+    for K in n_frames:
+        mfcc = random_trajectories(K, n_channels=13)
+        time_ref = timing(lambda: get_delta_features_reference(get_delta_features_reference(mfcc)))
+        time_new = timing(lambda: get_delta_features(get_delta_features(mfcc)))
+        diff = np.max(np.abs(get_delta_features_reference(get_delta_features_reference(mfcc)) -
+                             get_delta_features(get_delta_features(mfcc))))
+        print_result("{} frames".format(K), time_ref, time_new, diff)
+    K = n_frames[1]
+    lengths = np.random.RandomState(0).randint(K // 2, K + 1, batch_size)
+    mfccs = [random_trajectories(length, n_channels=13, seed=i) for i, length in enumerate(lengths)]
+    batch = np.zeros((batch_size, max(lengths), 13))
+    for i, mfcc in enumerate(mfccs):
+        batch[i, :len(mfcc)] = mfcc
+    time_ref = timing(lambda: [get_delta_features_reference(mfcc) for mfcc in mfccs])
+    time_new = timing(lambda: get_delta_features(batch, lengths=lengths))
+    delta_batch = get_delta_features(batch, lengths=lengths)
+    diff = max(np.max(np.abs(get_delta_features_reference(mfcc) - delta_batch[i, :len(mfcc)]))
+               for i, mfcc in enumerate(mfccs))
+    print_result("batch of {} ({}-{} frames)".format(batch_size, K // 2, K), time_ref, time_new, diff)
+
+
+def moving_average_reference(all_mean_ema, pad=30):
+    """
+    previous implementation of the moving average in Speaker.calculate_norm_values : one padding per column and
+    one np.mean per sentence
+    """
+    all_mean_ema = np.concatenate([np.expand_dims(np.pad(all_mean_ema[:, k], (pad, pad), "symmetric"), 1)
+                                   for k in range(all_mean_ema.shape[1])], axis=1)
+    return np.array([np.mean(all_mean_ema[k - pad:k + pad], axis=0) for k in range(pad, len(all_mean_ema) - pad)])
+
+
+def benchmark_moving_average(n_sentences=(500, 5000, 50000)):
+    """
+    :param n_sentences: numbers of sentences of the speaker
+    compare the moving average of the mean ema of the sentences (rolling_mean) with the previous implementation
+    """
+    print("moving average of the (n_sentences,18) mean ema")
+    for n in n_sentences:
+        all_mean_ema = random_trajectories(n)
+        number = max(1, 5000 // n)
+        time_ref = timing(lambda: moving_average_reference(all_mean_ema), number=number, repeat=3)
+        time_new = timing(lambda: rolling_mean(all_mean_ema), number=number, repeat=3)
+        diff = np.max(np.abs(moving_average_reference(all_mean_ema) - rolling_mean(all_mean_ema)))
+        print_result("{} sentences".format(n), time_ref, time_new, diff)
+
+
+def read_est_file_reference(path, channels, n_columns=20):
+    """
+    previous implementation of Speaker_mocha.read_ema_file : header parsed line by line, all the channels read
+    """
+    with open(path, 'rb') as ema_annotation:
+        column_names = [0] * n_columns
+        for line in ema_annotation:
+            line = line.decode('latin-1').strip("\n")
+            if line == 'EST_Header_End':
+                break
+            elif line.startswith('NumFrames'):
+                n_frames = int(line.rsplit(' ', 1)[-1])
+            elif line.startswith('Channel_'):
+                col_id, col_name = line.split(' ', 1)
+                column_names[int(col_id.split('_', 1)[-1])] = col_name.replace(" ", "")
+        ema_data = np.fromfile(ema_annotation, "float32").reshape(n_frames, -1)
+        cols_index = [column_names.index(col) for col in channels]
+        return ema_data[:, cols_index]
+
+
+def write_est_file(path, channel_names, n_frames):
+    """
+    write a fake EST file (binary float32 track) with the channels channel_names and 2 more columns
+    """
+    with open(path, "wb") as f:
+        f.write(b"EST_File Track\nDataType binary\nByteOrder 01\n")
+        f.write(("NumFrames %d\n" % n_frames).encode())
+        for k, name in enumerate(channel_names):
+            f.write(("Channel_%d %s\n" % (k, name)).encode())
+        f.write(b"EST_Header_End\n")
+        f.write(random_trajectories(n_frames, len(channel_names) + 2).astype("float32").tobytes())
+
+
+def benchmark_est_reader(durations=(3, 30, 300), sampling_rate=500):
+    """
+    :param durations: durations in second of the recordings
+    :param sampling_rate: sampling rate of the ema (500Hz for mocha)
+    compare read_est_file with the previous reader of mocha, on a file with the 20 channels of mocha
+    """
+    channel_names = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y', 'ul_x', 'ul_y', 'll_x', 'll_y',
+                     'v_x', 'v_y', 'bn_x', 'bn_y', 'a1', 'a2', 'a3', 'a4']
+    channels = channel_names[:14]
+    print("EST reader, 20 channels at {}Hz, 14 read".format(sampling_rate))
+    with tempfile.TemporaryDirectory() as folder:
+        for duration in durations:
+            path = os.path.join(folder, "{}.ema".format(duration))
+            write_est_file(path, channel_names, int(duration * sampling_rate))
+            time_ref = timing(lambda: read_est_file_reference(path, channels))
+            time_new = timing(lambda: read_est_file(path, channels))
+            diff = np.max(np.abs(read_est_file_reference(path, channels) - read_est_file(path, channels)))
+            print_result("{}s ({} frames)".format(duration, int(duration * sampling_rate)), time_ref, time_new, diff)
+
+
+def resample_wav_reference(path, wav_data, sampling_rate, new_sampling_rate):
+    """
+    previous implementation of the wav of Speaker_Haskins.read_ema_and_wav : the wav is written then read again and
+    resampled by librosa.load
+    """
+    scipy.io.wavfile.write(path, sampling_rate, wav_data)
+    wav, sr = librosa.load(path, sr=new_sampling_rate)
+    return wav
+
+
+def benchmark_resample_wav(durations=(1, 3, 10), sampling_rate=44100, new_sampling_rate=16000):
+    """
+    :param durations: durations in second of the wav
+    :param sampling_rate: sampling rate of the wav (44100Hz for Haskins)
+    :param new_sampling_rate: sampling rate wanted for the mfcc
+    compare resample_wav (in memory) with the previous write/load of the wav of Haskins. Both resample with librosa,
+    the max diff should be 0.
+    """
+    print("resampling of the wav {}Hz => {}Hz".format(sampling_rate, new_sampling_rate))
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "wav.wav")
+        for duration in durations:
+            t = np.arange(int(duration * sampling_rate)) / sampling_rate
+            wav_data = np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 3 * t)) / 2
+            time_ref = timing(lambda: resample_wav_reference(path, wav_data, sampling_rate, new_sampling_rate),
+                              number=5)
+            time_new = timing(lambda: resample_wav(wav_data, sampling_rate, new_sampling_rate), number=5)
+            diff = np.max(np.abs(resample_wav_reference(path, wav_data, sampling_rate, new_sampling_rate) -
+                                 resample_wav(wav_data, sampling_rate, new_sampling_rate)))
+            print_result("{}s ({} points)".format(duration, len(wav_data)), time_ref, time_new, diff)
+
+
+def benchmark_load_wav(sampling_rates=(16000, 20000, 44100), duration=10, new_sampling_rate=16000):
+    """
+    :param sampling_rates: sampling rates of the wav files (mocha and MNGU0 16000Hz, usc 20000Hz, Haskins 44100Hz)
+    :param duration: duration in second of the wav files
+    :param new_sampling_rate: sampling rate wanted for the mfcc
+    compare load_wav (without and with the cache of the resampled wav) with librosa.load, on 16 bits PCM wav files.
+    Both resample with librosa, the max diff should be 0.
+    """
+    print("loading of a {}s wav at {}Hz".format(duration, new_sampling_rate))
+    with tempfile.TemporaryDirectory() as folder:
+        for sampling_rate in sampling_rates:
+            path = os.path.join(folder, "{}.wav".format(sampling_rate))
+            t = np.arange(int(duration * sampling_rate)) / sampling_rate
+            wav_data = np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 3 * t)) / 2
+            scipy.io.wavfile.write(path, sampling_rate, (wav_data * 20000).astype(np.int16))
+            cache_dir = os.path.join(folder, "cache")
+            time_ref = timing(lambda: librosa.load(path, sr=new_sampling_rate), number=5)
+            time_new = timing(lambda: load_wav(path, new_sampling_rate), number=5)
+            load_wav(path, new_sampling_rate, cache_dir=cache_dir)
+            time_cache = timing(lambda: load_wav(path, new_sampling_rate, cache_dir=cache_dir), number=5)
+            diff = np.max(np.abs(librosa.load(path, sr=new_sampling_rate)[0] - load_wav(path, new_sampling_rate)))
+            print_result("{}Hz".format(sampling_rate), time_ref, time_new, diff)
+            print_result("{}Hz, in the cache".format(sampling_rate), time_ref, time_cache, diff)
+
+
+def mfcc_reference(wav, sampling_rate=16000, n_mfcc=13, n_fft=400, hop_length=160):
+    """
+    previous implementation of the mfcc : librosa.feature.mfcc one wav at a time. The steps are written explicitly
+    with the "reflect" padding of the frames of librosa 0.6.3 (the default padding of the newer versions is "constant")
+    """
+    spectrogram = np.abs(librosa.stft(wav, n_fft=n_fft, hop_length=hop_length, pad_mode="reflect")) ** 2
+    mel_spectrogram = librosa.feature.melspectrogram(S=spectrogram, sr=sampling_rate)
+    return librosa.feature.mfcc(S=librosa.power_to_db(mel_spectrogram), n_mfcc=n_mfcc).T
+
+
+def benchmark_mfcc(n_wavs=(1, 64, 512), durations=(0.5, 5), sampling_rate=16000):
+    """
+    :param n_wavs: numbers of wav whose mfcc are calculated
+    :param durations: min and max duration in second of the wav
+    :param sampling_rate: sampling rate of the wav
+    compare get_mfcc (filters computed once, wav sorted by length and done by batches) with librosa.feature.mfcc on
+    each wav. The max diff is relative to the max of the mfcc (float32 computations).
+    """
+    print("mfcc of wav of {}s to {}s at {}Hz".format(durations[0], durations[1], sampling_rate))
+    rng = np.random.RandomState(0)
+    for n in n_wavs:
+        wavs = []
+        for length in rng.randint(durations[0] * sampling_rate, durations[1] * sampling_rate, n):
+            t = np.arange(length) / sampling_rate
+            wav = np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 3 * t)) / 2 + 0.01 * rng.randn(length)
+            wavs.append(wav.astype(np.float32))
+        number = max(1, 64 // n)
+        time_ref = timing(lambda: [mfcc_reference(wav) for wav in wavs], number=number, repeat=3)
+        time_new = timing(lambda: get_mfcc(wavs, sampling_rate, 13, 400, 160), number=number, repeat=3)
+        diff = max(np.max(np.abs(mfcc_reference(wav) - mfcc)) / np.max(np.abs(mfcc_reference(wav)))
+                   for wav, mfcc in zip(wavs, get_mfcc(wavs, sampling_rate, 13, 400, 160)))
+        print_result("{} wav".format(n), time_ref, time_new, diff)
+
+
+def benchmark_synchro(sampling_rate=500, n_points=(1500, 1499, 4000, 4001, 15013), hop_time=0.01, cutoff=10):
+    """
+    :param sampling_rate: sampling rate of the ema (500Hz for mocha)
+    :param n_points: numbers of points of the ema trajectories (1499 and 15013 are prime numbers)
+    :param hop_time: time between two frames mfcc
+    :param cutoff: the trajectories are smoothed with this cutoff (as in Speaker.smooth_data)
+    compare the synchronization methods "polyphase" and "linear" of resample_trajectories (Speaker.synchro_ema_mfcc)
+    with the resampling by fft. The max diff is relative to the max amplitude of the trajectories, without the 10
+    first and last frames : the fft considers the trajectories as periodic, so its first frames are mixed with the
+    last ones and the difference there is much larger.
+    """
+    print("synchronization of (K,18) trajectories at {}Hz with the mfcc frames".format(sampling_rate))
+    up, down = int(round(1 / hop_time)), sampling_rate
+    for K in n_points:
+        ema = low_pass_filter(random_trajectories(K), cut_off=cutoff, sampling_rate=sampling_rate)
+        n_frames = int(np.ceil(K * up / down))
+        time_ref = timing(lambda: resample_trajectories(ema, n_frames, method="fft"))
+        reference = resample_trajectories(ema, n_frames, method="fft")
+        for method in ["polyphase", "linear"]:
+            time_new = timing(lambda: resample_trajectories(ema, n_frames, method=method, up=up, down=down))
+            diff = np.max(np.abs(resample_trajectories(ema, n_frames, method=method, up=up, down=down) -
+                                 reference)[10:-10]) / np.max(np.abs(reference))
+            print_result("{} points, {}".format(K, method), time_ref, time_new, diff)
+
+
+def benchmark_shards(n_sentences=(100, 1000, 5000), lengths=(100, 600), n_mfcc=39, n_ema=18):
+    """
+    :param n_sentences: numbers of sentences of the speaker
+    :param lengths: min and max number of frames of the sentences
+    :param n_mfcc: number of features of the mfcc frames
+    :param n_ema: number of trajectories
+    compare the time to load an epoch (all the sentences of a speaker in a random order, as load_np_ema_and_mfcc)
+    from one npy file per sentence and from the shards (see shards.py). The files are in the page cache, the
+    difference with files read from the disk is larger.
+    """
+    print("epoch load of sentences of {} to {} frames, (K,{}) mfcc and (K,{}) ema".format(
+        lengths[0], lengths[1], n_mfcc, n_ema))
+    rng = np.random.RandomState(0)
+    for n in n_sentences:
+        with tempfile.TemporaryDirectory() as path_speaker:
+            names = ["sentence_{}".format(k) for k in range(n)]
+            for stream, n_features in zip(shard_streams, [n_mfcc, n_ema]):
+                os.makedirs(os.path.join(path_speaker, stream))
+                for name, length in zip(names, rng.randint(lengths[0], lengths[1], n)):
+                    np.save(os.path.join(path_speaker, stream, name), rng.randn(length, n_features))
+            order = [names[k] for k in rng.permutation(n)]
+
+            def epoch_per_file():
+                return [[np.load(os.path.join(path_speaker, stream, name + ".npy")) for stream in shard_streams]
+                        for name in order]
+
+            def epoch_shards():
+                return [[load_sentence(path_speaker, stream, name) for stream in shard_streams] for name in order]
+
+            time_ref = timing(epoch_per_file, number=1, repeat=3)
+            for stream in shard_streams:
+                pack_stream(path_speaker, stream)
+            read_shard.cache_clear()
+            time_new = timing(epoch_shards, number=1, repeat=3)
+            diff = max(np.max(np.abs(a - b)) for sentence_a, sentence_b in zip(epoch_per_file(), epoch_shards())
+                       for a, b in zip(sentence_a, sentence_b))
+            read_shard.cache_clear()  # the shards are deleted with the directory
+        print_result("{} sentences".format(n), time_ref, time_new, diff)
+
+
+benchmarks = {"smooth_data": benchmark_smooth_data,
+              "delta_features": benchmark_delta_features,
+              "moving_average": benchmark_moving_average,
+              "est_reader": benchmark_est_reader,
+              "resample_wav": benchmark_resample_wav,
+              "load_wav": benchmark_load_wav,
+              "mfcc": benchmark_mfcc,
+              "synchro": benchmark_synchro,
+              "shards": benchmark_shards}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='micro-benchmarks of the preprocessing functions')
+    parser.add_argument('--which', type=str, default="all",
+                        help='name of the benchmark to run, one of {} or all'.format(list(benchmarks.keys())))
+    args = parser.parse_args()
+    for name, benchmark in benchmarks.items():
+        if args.which in ["all", name]:
+            benchmark()
+            print()
@@ -13,13 +13,63 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 
 import os
+import shutil
+import tempfile
+import glob
+import pickle
+import time
+import hashlib
+import json
+import uuid
 import numpy as np
 import scipy.signal
 import scipy.interpolate
-from Preprocessing.tools_preprocessing import low_pass_filter_weight
-import csv
+import librosa
+from Preprocessing.tools_preprocessing import low_pass_filter, get_fileset_names, get_delta_features, \
+    add_context_frames, rolling_mean, fill_missing_values, load_wav, get_acoustic_features, resample_trajectories, \
+    save_atomic, get_file_digest, get_wav_cache_key
+from Preprocessing.running_stats import NormStats
+from Preprocessing.speaker_registry import get_speaker_info, get_sampling_parameters
+from Preprocessing.shards import shard_streams, remove_shard, create_shard, write_to_shard, write_shard_index
+from Preprocessing.instrumentation import StageProfile, stage_of, profiled
+from Preprocessing.manifest import make_manifest, write_manifest, remove_manifest
 
 root_folder = os.path.dirname(os.getcwd())
+cache_version = 7  # to change when the first pass of the preprocessing changes, so that the cache is not used
+worker_contexts = {}  # in each process of the pool : path of a worker context => speaker, see get_worker_context
+
+
+def get_worker_context(path):
+    """
+    :param path: path of a worker context (see Speaker.write_worker_context)
+    :return: the speaker of the context, read only once per process. The contexts of the passes that are over (their
+    file is deleted) are forgotten.
+    """
+    if path not in worker_contexts:
+        for old_path in [p for p in worker_contexts if not os.path.exists(p)]:
+            del worker_contexts[old_path]
+        with open(path, "rb") as f:
+            worker_contexts[path] = pickle.load(f)
+    return worker_contexts[path]
+
+
+def first_pass_job(job):
+    """
+    :param job: path of the worker context of the speaker, utterance index, its record and its cache key
+    :return: see Speaker.utterance_norm_stats
+    """
+    path_context, i, record, key = job
+    return get_worker_context(path_context).utterance_norm_stats((i, record, key))
+
+
+def second_pass_job(job):
+    """
+    :param job: path of the worker context of the speaker and utterance index
+    :return: see Speaker.utterance_normalization
+    """
+    path_context, i = job
+    return get_worker_context(path_context).utterance_normalization(i)
+
 
 class Speaker():
     """
@@ -27,9 +77,32 @@ class Speaker():
     They have some specific attributes that are defined by the parent class (Corpus)
     This class is used in each preprocessing script
     """
-    def __init__(self,speaker):
+    def __init__(self,speaker, store_context=False, keep_intermediate=False, staging_dir=None, cache_dir=None,
+                 synchro_method="fft", shards=False, precision="float64", resume=False, instrument=False):
         """
         :param name:  name of the speaker
+        :param store_context: whether to save the mfcc with the 10 context frames (K,429) as in the first version of
+        the preprocessing. By default only the (K,39) frames are saved, and the context is added at load time.
+        :param keep_intermediate: whether to also save the ema trajectories without the last smoothing in
+        Preprocessed_data/speaker/ema (not used by the training), and for usc the sentences cut from the recordings
+        (see Speaker_usc.get_data_per_sentence)
+        :param staging_dir: directory where the first pass is kept until the norm values are known, by default the
+        temporary directory of the system (should be a local disk)
+        :param cache_dir: directory of the cache of the first pass (one sub directory per speaker), None to not use
+        a cache. The utterances whose raw files and preprocessing parameters did not change are not preprocessed
+        again, only the norm values and the normalization are calculated again. The wav resampled at
+        sampling_rate_wav_wanted are also cached (sub directory "wav" of the speaker, see load_wav). After a run on all
+        the utterances, what the utterances no longer use is deleted (see prune_cache).
+        :param synchro_method: how the ema are resampled to have 1 position per frame mfcc : "fft" (as in the first
+        version of the preprocessing), "polyphase" or "linear" (see resample_trajectories)
+        :param shards: whether to save the mfcc and ema_final of all the sentences in one packed array per stream
+        (Preprocessed_data/speaker/mfcc.npy and ema_final.npy, see shards.py) instead of one npy file per sentence
+        :param precision: type of the final data, "float64" or "float32" (half the size on the disk and in memory,
+        the first pass and the norm values are always in float64)
+        :param resume: whether to start again from the checkpoint of an interrupted run (needs a cache, see
+        save_checkpoint) instead of deleting the previous preprocessing
+        :param instrument: whether to record the wall time, bytes read and written and peak RSS of each stage of the
+        preprocessing, per utterance (see instrumentation.py). The records are in self.profiles at the end.
         """
         self.speaker = speaker
         self.speakers = None
@@ -42,6 +115,25 @@ class Speaker():
         self.frame_length = int(self.frame_time * self.sampling_rate_wav_wanted)
         self.window = 5
         self.n_coeff = 13
+        self.max_spline_gap = 0.1  # in seconds, longer gaps in the ema are filled linearly
+        self.store_context = store_context
+        self.synchro_method = synchro_method
+        self.shards = shards
+        self.precision = precision
+        self.resume = resume
+        self.instrument = instrument
+        self.profile = None  # StageProfile of the utterance being preprocessed, see start_profile
+        self.profiles = []  # records of the profiles of the utterances and of the speaker
+        self.checkpoint_interval = 60  # in seconds, time between two checkpoints (see save_checkpoint)
+        self.shard_index = None  # stream => index of the shard being written, see create_shards
+        self.keep_intermediate = keep_intermediate
+        self.staging_dir = staging_dir
+        self.staging_path = None
+        self.cache_dir = cache_dir
+        self.cache_keys = {}
+        self.raw_digests = {}  # path of a raw file => [size, modification time, sha1], see get_raw_digest
+        self.wav_cache_dir = os.path.join(cache_dir, speaker, "wav") if cache_dir is not None else None
+        self.utterance_records = {}  # utterances kept in memory by the corpus, see get_utterance_record
         self.sampling_rate_ema = None
         self.sampling_rate_wav = None
         self.speakers = None
@@ -50,11 +142,11 @@ class Speaker():
         self.speakers_with_velum = ["fsew0", "msak0", "faet0", "ffes0", "falh0"]
         self.init_corpus_param()
         self.EMA_files = None
+        self.N_max = 0
         if self.speaker in self.speakers_with_velum:
             self.articulators = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y',
                                  'ul_x', 'ul_y', 'll_x', 'll_y', 'v_x', 'v_y']
-        self.list_EMA_traj = []
-        self.list_MFCC_frames = []
+        self.norm_stats = NormStats()
 
         self.std_ema = None
         self.moving_average_ema = None
@@ -62,101 +154,113 @@ class Speaker():
         self.std_mfcc = None
         self.mean_mfcc = None
 
+    def __getstate__(self):
+        """
+        the speaker is sent to the workers once per pass (see write_worker_context), without the utterances kept in
+        memory : each worker only gets the record of its utterance with the task (see get_utterance_record), and
+        without the profiles
+        """
+        state = self.__dict__.copy()
+        state["utterance_records"] = {}
+        state["profiles"] = []
+        state["raw_digests"] = {}
+        return state
+
     def get_corpus_name(self):
         """
-        define the corpus the speaker comes from
+        define the corpus the speaker comes from (see speaker_registry)
         """
-        if self.speaker == "MNGU0":
-            corpus = "MNGU0"
-        elif self.speaker in ["F1", "F5", "M1", "M3"]:
-            corpus ="usc"
-        elif self.speaker in   ["F01", "F02", "F03", "F04", "M01", "M02", "M03", "M04"] :
-            corpus = "Haskins"
-        elif self.speaker in  ["fsew0", "msak0", "faet0", "ffes0", "maps0", "mjjn0", "falh0"]:
-            corpus = "mocha"
-        else:
-            raise NameError("vous navez pas choisi un des speasker")
-        self.corpus = corpus
+        self.corpus = get_speaker_info(self.speaker)["corpus"]
 
     def init_corpus_param(self):
         """
-        Initialize some parameters depending on the corpus
+        Initialize some parameters depending on the corpus (see speaker_registry)
         """
-        if self.corpus == "mocha":
-            self.sampling_rate_wav = 16000
-            self.sampling_rate_ema = 500
-            self.cutoff = 10
+        sampling_parameters = get_sampling_parameters(self.corpus)
+        self.sampling_rate_wav = sampling_parameters["sampling_rate_wav"]
+        self.sampling_rate_ema = sampling_parameters["sampling_rate_ema"]
+        self.cutoff = sampling_parameters["cutoff"]
 
-        elif self.corpus == "MNGU0":
-            self.sampling_rate_wav = 16000
-            self.sampling_rate_ema = 200
-            self.cutoff = 10
-
-        elif self.corpus == "usc":
-            self.sampling_rate_wav = 20000
-            self.sampling_rate_ema = 100
-            self.cutoff = 10
-
-        elif self.corpus == "Haskins":
-            self.sampling_rate_wav = 44100
-            self.sampling_rate_ema = 100
-            self.cutoff = 20
+    @profiled("interpolate")
+    def interpolate_missing_values(self, ema, i, channels):
+        """
+        :param ema: ema trajectories of the utterance, with NaN where the sensor was lost
+        :param i: utterance index
+        :param channels: names of the trajectories
+        :return: the trajectories where the missing values are interpolated channel per channel
+        (see fill_missing_values), prints the number of values filled per channel
+        """
+        ema, n_filled = fill_missing_values(ema, max_spline_gap=int(self.max_spline_gap * self.sampling_rate_ema))
+        if n_filled.sum() != 0:
+            print("{} {} : missing values filled {}".format(self.speaker, self.get_utterance_name(i), {
+                channel: int(n) for channel, n in zip(channels, n_filled) if n != 0}))
+        return ema
+
+    @profiled("read_wav")
+    def read_wav(self, path_wav):
+        """
+        :param path_wav: path of the wav file
+        :return: the wav at sampling_rate_wav_wanted, cached in wav_cache_dir (see load_wav)
+        """
+        return load_wav(path_wav, self.sampling_rate_wav_wanted, cache_dir=self.wav_cache_dir)
 
+    @profiled("smooth")
     def smooth_data(self, ema, sr=0):
         """
         :param ema: one ema trajectory
         :param sr: sampling rate of the ema trajectory
         :return:  the smoothed ema trajectory
         """
-        pad = 30
         if sr == 0:
             sr = self.sampling_rate_ema
-        cutoff = self.cutoff
-        weights = low_pass_filter_weight(cut_off=cutoff,sampling_rate= sr)
-
-        my_ema_filtered = np.concatenate([np.expand_dims(np.pad(ema[:, k], (pad, pad), "symmetric"), 1)
-                                          for k in range(ema.shape[1])], axis=1)
-
-        my_ema_filtered = np.concatenate([np.expand_dims(np.convolve(channel, weights, mode='same'), 1)
-                                          for channel in my_ema_filtered.T], axis=1)
-        my_ema_filtered = my_ema_filtered[pad:-pad, :]
+        my_ema_filtered = low_pass_filter(ema, cut_off=self.cutoff, sampling_rate=sr, pad=30)
         return my_ema_filtered
 
+    @profiled("mfcc")
+    def from_wav_to_mfcc(self, wav):
+        """
+        :param wav: list of intensity points of the wav file (sampled at sampling_rate_wav_wanted)
+        :return: the acoustic features (K,39); where K in the # of frames.
+        calculations of the mfcc (same as librosa, see get_acoustic_features) , + Delta and DeltaDelta
+        # of acoustic features per frame: 13 ==> 13*3 = 39. The 10 context frames (==> 39*11 = 429) are added
+        only if store_context, otherwise they are added when the features are loaded (see add_context_frames)
+        parameters for mfcc calculation are defined in class_corpus
+        """
+        mfcc, = get_acoustic_features([wav], self.sampling_rate_wav_wanted, n_mfcc=self.n_coeff,
+                                      n_fft=self.frame_length, hop_length=self.hop_length)
+        if self.store_context:
+            mfcc = np.ascontiguousarray(add_context_frames(mfcc, self.window))  # add context
+        return mfcc
+
     def calculate_norm_values(self):
         """
-        based on all the EMA trajectories and frames MFCC calculate the norm values :
+        based on the statistics of all the EMA trajectories and frames MFCC (self.norm_stats) calculate the
+        norm values :
         - mean of ema and mfcc
         - std of ema and mfcc
         - moving average for ema on 60 sentences
         then save those norm values
         """
-        list_EMA_traj = self.list_EMA_traj
-        list_MFCC_frames = self.list_MFCC_frames
+        norm_stats = self.norm_stats
 
         pad = 30
-        all_mean_ema = np.array([np.mean(traj, axis=0) for traj in list_EMA_traj]) # (18, n_sentences)
-        np.save(os.path.join("norm_values", "all_mean_ema_" + self.speaker), all_mean_ema)
+        all_mean_ema = norm_stats.per_sentence(norm_stats.mean_ema_per_sentence)  # (n_sentences, 18)
+        save_atomic(os.path.join("norm_values", "all_mean_ema_" + self.speaker + ".npy"), all_mean_ema)
         #    weights_moving_average = low_pass_filter_weight(cut_off=10, sampling_rate=self.sampling_rate_ema)
-        all_mean_ema = np.concatenate([np.expand_dims(np.pad(all_mean_ema[:, k], (pad, pad), "symmetric"), 1)
-                                       for k in range(all_mean_ema.shape[1])], axis=1)
+        moving_average = rolling_mean(all_mean_ema, pad=pad)
 
-        moving_average = np.array(
-            [np.mean(all_mean_ema[k - pad:k + pad], axis=0) for k in range(pad, len(all_mean_ema) - pad)])
-
-        all_EMA_concat = np.concatenate([traj for traj in list_EMA_traj], axis=0)
-        std_ema = np.std(all_EMA_concat, axis=0)
+        std_ema = norm_stats.ema_frames.std
         std_ema[std_ema < 1e-3] = 1
 
-        mean_ema = np.mean(np.array([np.mean(traj, axis=0) for traj in list_EMA_traj]),
-                           axis=0)
-        std_mfcc = np.mean(np.array([np.std(frame, axis=0) for frame in list_MFCC_frames]), axis=0)
-        mean_mfcc = np.mean(np.array([np.mean(frame, axis=0) for frame in list_MFCC_frames]), axis=0)
+        mean_ema = np.mean(norm_stats.per_sentence(norm_stats.mean_ema_per_sentence), axis=0)
+        std_mfcc = np.mean(norm_stats.per_sentence(norm_stats.std_mfcc_per_sentence), axis=0)
+        mean_mfcc = np.mean(norm_stats.per_sentence(norm_stats.mean_mfcc_per_sentence), axis=0)
 
-        np.save(os.path.join("norm_values", "moving_average_ema_" + self.speaker), moving_average)
-        np.save(os.path.join("norm_values", "std_ema_" + self.speaker), std_ema)
-        np.save(os.path.join("norm_values", "mean_ema_" + self.speaker), mean_ema)
-        np.save(os.path.join("norm_values", "std_mfcc_" + self.speaker), std_mfcc)
-        np.save(os.path.join("norm_values", "mean_mfcc_" + self.speaker), mean_mfcc)
+        save_atomic(os.path.join("norm_values", "moving_average_ema_" + self.speaker + ".npy"), moving_average)
+        save_atomic(os.path.join("norm_values", "std_ema_" + self.speaker + ".npy"), std_ema)
+        save_atomic(os.path.join("norm_values", "mean_ema_" + self.speaker + ".npy"), mean_ema)
+        save_atomic(os.path.join("norm_values", "std_mfcc_" + self.speaker + ".npy"), std_mfcc)
+        save_atomic(os.path.join("norm_values", "mean_mfcc_" + self.speaker + ".npy"), mean_mfcc)
 
         self.std_ema = std_ema
         self.moving_average_ema = moving_average
@@ -164,6 +268,15 @@ class Speaker():
         self.mean_mfcc = mean_mfcc
         self.std_mfcc = std_mfcc
 
+    def get_arti_to_consider(self):
+        """
+        the csv articulators_per_speaker contains for each speaker a list of 18 0/1 , element i is 1 if the arti i is
+        available (read once, see speaker_registry).
+        :return: the list of 18 "0"/"1" of this speaker.
+        """
+        return get_speaker_info(self.speaker)["arti_to_consider"]
+
+    @profiled("vocal_tract")
     def add_vocal_tract(self , my_ema):
         """
         calculate 4 'vocal tract' and reorganize the data into a 18 trajectories in a precised order
@@ -210,19 +323,9 @@ class Speaker():
 
         def arti_not_available():
             """
-            reads a csv that contains for each speaker a list of 18 0/1 , element i is 1 if the arti i is available.
             :return: index of articulations that are not available for this speaker. Based on the local csv file
             """
-            arti_per_speaker = os.path.join(root_folder, "Preprocessing", "articulators_per_speaker.csv")
-            csv.register_dialect('myDialect', delimiter=';')
-            with open(arti_per_speaker, 'r') as csvFile:
-                reader = csv.reader(csvFile, dialect="myDialect")
-                next(reader)
-                for row in reader:
-                    if row[0] == self.speaker: # we look for our speaker
-                        arti_to_consider = row[1:19]  # 1 if available
-            arti_not_avail = [k for k, n in enumerate(arti_to_consider) if n == "0"] # 1 of NOT available
-            return arti_not_avail
+            return get_speaker_info(self.speaker)["idx_to_ignore"]
 
         lip_aperture = add_lip_aperture(my_ema)
         lip_protrusion = add_lip_protrusion(my_ema)
@@ -245,6 +348,7 @@ class Speaker():
         my_ema[:, idx_to_ignore] = 0
         return my_ema
 
+    @profiled("normalize")
     def normalize_sentence(self,i,my_ema_filtered,my_mfcc):
         """
         :param i: index of the ema traj (to get the moving average)
@@ -256,14 +360,542 @@ class Speaker():
         my_mfcc = (my_mfcc - self.mean_mfcc) / self.std_mfcc
         return my_ema_VT,my_mfcc
 
+    @profiled("synchro")
     def synchro_ema_mfcc(self,my_ema, my_mfcc):
         """
         :param my_ema: ema traj
         :param my_mfcc: corresponding mfcc frames
         :return: ema and mfcc synchronized
-        the ema traj is downsampled to have 1 position for 1 frame mfcc
+        the ema traj is downsampled to have 1 position for 1 frame mfcc, with the method synchro_method
+        (see resample_trajectories)
         """
-        my_ema = scipy.signal.resample(my_ema, num=len(my_mfcc))
+        my_ema = resample_trajectories(my_ema, len(my_mfcc), method=self.synchro_method,
+                                       up=int(round(1 / self.hop_time)), down=self.sampling_rate_ema)
         return my_ema, my_mfcc
 
+    def get_raw_files(self, i):
+        """
+        defined by each corpus
+        :param i: utterance index
+        :return: list of the paths of the raw files the first pass on this utterance reads
+        """
+        raise NotImplementedError
+
+    def get_utterance_name(self, i):
+        """
+        :param i: utterance index
+        :return: name of the utterance (name of the files in Preprocessed_data)
+        """
+        return self.EMA_files[i]
 
+    def get_utterance_record(self, i):
+        """
+        :param i: utterance index
+        :return: the data of the utterance kept in memory by get_utterances (for instance the sentences cut from the
+        recordings of usc), None if the utterance is read from its raw files
+        """
+        return self.utterance_records.get(i)
+
+    def get_preprocessing_parameters(self):
+        """
+        :return: dictionary of the parameters of the speaker that change the result of the first pass
+        """
+        return {"cache_version": cache_version, "speaker": self.speaker,
+                "sampling_rate_wav_wanted": self.sampling_rate_wav_wanted,
+                "sampling_rate_wav": self.sampling_rate_wav, "sampling_rate_ema": self.sampling_rate_ema,
+                "cutoff": self.cutoff, "n_coeff": self.n_coeff, "window": self.window,
+                "max_spline_gap": self.max_spline_gap, "synchro_method": self.synchro_method,
+                "hop_length": self.hop_length, "frame_length": self.frame_length,
+                "store_context": self.store_context, "keep_intermediate": self.keep_intermediate,
+                "articulators": self.articulators, "arti_to_consider": self.get_arti_to_consider()}
+
+    def get_raw_digests_file(self):
+        """
+        :return: path of the sha1 of the raw files of the speaker, in its directory of the cache
+        """
+        return os.path.join(self.cache_dir, self.speaker, "raw_digests.json")
+
+    def read_raw_digests(self):
+        """
+        reads the sha1 of the raw files saved by the previous run (see write_raw_digests)
+        """
+        self.raw_digests = {}
+        if os.path.exists(self.get_raw_digests_file()):
+            with open(self.get_raw_digests_file(), "r") as f:
+                self.raw_digests = json.load(f)
+
+    def write_raw_digests(self):
+        """
+        saves the sha1 of the raw files, so that the next run does not read the raw files that did not change
+        """
+        path = self.get_raw_digests_file()
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.raw_digests, f)
+        os.replace(path + ".tmp", path)
+
+    def get_raw_digest(self, path):
+        """
+        :param path: path of a raw file
+        :return: the sha1 of the content of the file. The file is read only if its size or its modification time
+        changed since its sha1 was computed (in this run or in the previous one, see read_raw_digests), so that the
+        raw files are not read to compute the cache keys and a recording cut in several utterances is read once.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.raw_digests.get(path)
+        if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            entry = [stat.st_size, stat.st_mtime_ns, get_file_digest(path)]
+            self.raw_digests[path] = entry
+        return entry[2]
+
+    def get_cache_key(self, i):
+        """
+        :param i: utterance index
+        :return: the sha1 of the raw files of the utterance (see get_raw_digest), of its name (several utterances can
+        be cut from the same raw files) and of the preprocessing parameters
+        """
+        key = hashlib.sha1(json.dumps(self.get_preprocessing_parameters(), sort_keys=True).encode())
+        key.update(self.get_utterance_name(i).encode())
+        for path in self.get_raw_files(i):
+            key.update(os.path.basename(path).encode())
+            key.update(self.get_raw_digest(path).encode())
+        return key.hexdigest()
+
+    def get_cache_keys(self, utterances):
+        """
+        :param utterances: list of utterance indexes
+        :return: dictionary utterance index => cache key (see get_cache_key), the sha1 of the raw files are saved for
+        the next run
+        """
+        keys = {i: self.get_cache_key(i) for i in utterances}
+        self.write_raw_digests()
+        return keys
+
+    def prune_cache(self, utterances, raw_files):
+        """
+        :param utterances: list of the utterance indexes of the run, all the utterances of the speaker
+        :param raw_files: set of the absolute paths of the raw files of the utterances (see get_raw_files, the records
+        of usc are not kept after the first pass)
+        deletes from the cache of the speaker the first pass that no utterance of the run uses (raw files or
+        preprocessing parameters changed, utterance removed), the resampled wav of the wav files the run does not
+        read, and the sha1 of the raw files not read by the run
+        """
+        keys = set(self.cache_keys[i] for i in utterances)
+        for f in glob.glob(os.path.join(self.cache_dir, self.speaker, "*.npz")):
+            if os.path.basename(f)[:-len(".npz")] not in keys:
+                os.remove(f)
+        self.raw_digests = {path: entry for path, entry in self.raw_digests.items() if path in raw_files}
+        self.write_raw_digests()
+        wav_keys = set(get_wav_cache_key(entry[2], self.sampling_rate_wav_wanted)
+                       for path, entry in self.raw_digests.items() if path.endswith(".wav"))
+        for f in glob.glob(os.path.join(self.wav_cache_dir, "*.npy")):
+            if os.path.basename(f)[:-len(".npy")] not in wav_keys:
+                os.remove(f)
+
+    def get_staged_file(self, i):
+        """
+        :param i: utterance index
+        :return: the path of the file where the first pass on the utterance is kept : in the cache if there is one,
+        otherwise in the staging directory
+        """
+        if self.cache_dir is not None:
+            return os.path.join(self.cache_dir, self.speaker, self.cache_keys[i] + ".npz")
+        return os.path.join(self.staging_path, str(i) + ".npz")
+
+    @profiled("write_staged")
+    def stage_utterance(self, i, **arrays):
+        """
+        :param i: utterance index
+        :param arrays: arrays of the first pass to keep until the second pass, by name
+        save the arrays in the staging directory (or in the cache) of the speaker
+        """
+        path = self.get_staged_file(i)
+        with open(path + ".tmp", "wb") as f:  # so that an interrupted run does not leave an incomplete file
+            np.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+    @profiled("read_staged")
+    def load_staged_utterance(self, i, *names):
+        """
+        :param i: utterance index
+        :param names: names of the arrays saved by stage_utterance
+        :return: list of the arrays
+        """
+        with np.load(self.get_staged_file(i)) as staged:
+            return [staged[name] for name in names]
+
+    @profiled("write_final")
+    def save_utterance(self, filename, **arrays):
+        """
+        :param filename: name of the utterance
+        :param arrays: final arrays by name of the folder in Preprocessed_data/speaker (ema_final, mfcc, ema), written
+        in the shard of the stream instead if the shards are being written (see create_shards), in the type precision
+        """
+        for folder, array in arrays.items():
+            array = array.astype(self.precision, copy=False)
+            if self.shard_index is not None and folder in self.shard_index:
+                write_to_shard(self.path_files_treated, folder, self.shard_index[folder][filename][0], array)
+            else:
+                save_atomic(os.path.join(self.path_files_treated, folder, filename + ".npy"), array)
+
+    def create_shards(self, utterances, keep_existing=False):
+        """
+        :param utterances: list of the utterance indexes
+        :param keep_existing: whether to keep the shards of an interrupted run (the sentences already written are not
+        written again)
+        creates the packed arrays of mfcc and ema_final (not filled), the lengths and number of features of the
+        sentences are known after the first pass (self.norm_stats). The second pass then writes each sentence at its
+        place (see save_utterance), the indexes are written once all the sentences are written.
+        """
+        names = [self.get_utterance_name(i) for i in utterances]
+        lengths = [self.norm_stats.n_frames_per_sentence[i] for i in utterances]
+        n_features = {"mfcc": len(self.norm_stats.mean_mfcc_per_sentence[utterances[0]]),
+                      "ema_final": len(self.norm_stats.mean_ema_per_sentence[utterances[0]])}
+        self.shard_index = {stream: create_shard(self.path_files_treated, stream, names, lengths, n_features[stream],
+                                                 dtype=self.precision, keep_existing=keep_existing)
+                            for stream in shard_streams}
+
+    def save_manifest(self, utterances, norm_stats):
+        """
+        :param utterances: list of the utterance indexes
+        :param norm_stats: NormStats of all the utterances (number of frames of each sentence)
+        writes the manifest of the speaker (see manifest.py), with the first frame of each sentence in the shards if
+        they are written
+        """
+        names = [self.get_utterance_name(i) for i in utterances]
+        lengths = [norm_stats.n_frames_per_sentence[i] for i in utterances]
+        offsets = None
+        if self.shard_index is not None:
+            offsets = [self.shard_index["ema_final"][name][0] for name in names]
+        write_manifest(self.path_files_treated, make_manifest(self.speaker, names, lengths, offsets))
+
+    def get_utterances(self):
+        """
+        :return: list of the utterance indexes to preprocess (wrt the list "EMA_files"), N_max first if N_max != 0
+        """
+        N = len(self.EMA_files)
+        if self.N_max != 0:
+            N = min(int(self.N_max), N)
+        return list(range(N))
+
+    def preprocess_utterance(self, i):
+        """
+        first pass on one utterance, defined by each corpus. What is needed for the second pass is kept with
+        stage_utterance
+        :param i: utterance index
+        :return: the smoothed ema trajectory and the mfcc frames, used to calculate the norm values
+        """
+        raise NotImplementedError
+
+    def profile_stage(self, name):
+        """
+        :param name: name of the stage
+        :return: context manager of a stage of the profile of the utterance (does nothing if not instrument), for the
+        parts of a method that are not a method of the speaker
+        """
+        return stage_of(self.profile, name)
+
+    def start_profile(self, i, pass_name):
+        """
+        :param i: utterance index
+        :param pass_name: "first_pass" or "second_pass"
+        starts the profile of the utterance if instrument (see instrumentation.py)
+        """
+        if self.instrument:
+            self.profile = StageProfile(self.speaker, self.get_utterance_name(i), pass_name)
+
+    def stop_profile(self):
+        """
+        :return: the record of the profile of the utterance, None if not instrument
+        """
+        if self.profile is None:
+            return None
+        record = self.profile.finish()
+        self.profile = None
+        return record
+
+    def utterance_norm_stats(self, job):
+        """
+        first pass on one utterance (see preprocess_utterance), not done again if the utterance is in the cache
+        :param job: utterance index, its record (see get_utterance_record) and its cache key (None without cache,
+        computed by the speaker before the first pass, see get_cache_keys)
+        :return: the NormStats of the utterance (only the statistics are sent back by the workers), the cache key of
+        the utterance, whether it was in the cache and the record of its profile (None if not instrument)
+        """
+        i, record, key = job
+        if record is not None:
+            self.utterance_records[i] = record
+        self.start_profile(i, "first_pass")
+        in_cache = False
+        if self.cache_dir is not None:
+            self.cache_keys[i] = key
+            in_cache = os.path.exists(self.get_staged_file(i))
+        if in_cache:
+            ema_VT_smooth, mfcc = self.load_staged_utterance(i, "ema_final", "mfcc")
+        else:
+            ema_VT_smooth, mfcc = self.preprocess_utterance(i)
+        with self.profile_stage("norm_stats"):
+            utterance_stats = NormStats.from_utterance(i, ema_VT_smooth, mfcc)
+        self.utterance_records.pop(i, None)  # the speaker stays in the worker for the next utterances
+        return utterance_stats, key, in_cache, self.stop_profile()
+
+    def normalize_utterance(self, i):
+        """
+        second pass on one utterance (normalization once the norm values are known), defined by each corpus. Loads
+        the first pass with load_staged_utterance and saves the final data with save_utterance
+        :param i: utterance index
+        """
+        raise NotImplementedError
+
+    def utterance_normalization(self, i):
+        """
+        second pass on one utterance (see normalize_utterance)
+        :param i: utterance index
+        :return: the record of its profile (None if not instrument)
+        """
+        self.start_profile(i, "second_pass")
+        self.normalize_utterance(i)
+        return self.stop_profile()
+
+    def dry_run_report(self):
+        """
+        :return: the number of utterances, and the list of the names of the utterances that are not in the cache,
+        ie that the first pass would preprocess. Nothing is preprocessed and the previous preprocessing is not deleted.
+        """
+        utterances = self.get_utterances()
+        if self.cache_dir is not None:
+            if not os.path.exists(os.path.join(self.cache_dir, self.speaker)):
+                os.makedirs(os.path.join(self.cache_dir, self.speaker))
+            self.read_raw_digests()
+            self.cache_keys = self.get_cache_keys(utterances)
+        to_rebuild = []
+        for i in utterances:
+            if self.cache_dir is None or not os.path.exists(self.get_staged_file(i)):
+                to_rebuild.append(self.get_utterance_name(i))
+        return len(utterances), to_rebuild
+
+    def get_checkpoint_file(self):
+        """
+        :return: path of the checkpoint of the speaker, in its directory of the cache
+        """
+        return os.path.join(self.cache_dir, self.speaker, "checkpoint.pkl")
+
+    def save_checkpoint(self, utterances, norm_stats, done):
+        """
+        :param utterances: list of the utterance indexes preprocessed
+        :param norm_stats: NormStats of the utterances done by the first pass
+        :param done: set of the utterances done by the second pass (their final data are complete)
+        saves the progress of the preprocessing (only with a cache, where the first pass of the utterances is kept) :
+        the names of the utterances, the cache keys of the utterances done by the first pass and their statistics,
+        and the utterances done by the second pass
+        """
+        if self.cache_dir is None:
+            return
+        checkpoint = {"cache_version": cache_version, "options": self.get_checkpoint_options(),
+                      "names": [self.get_utterance_name(i) for i in utterances],
+                      "keys": {i: self.cache_keys[i] for i in norm_stats.n_frames_per_sentence},
+                      "norm_stats": norm_stats, "done": sorted(done)}
+        path = self.get_checkpoint_file()
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(checkpoint, f)
+        os.replace(path + ".tmp", path)
+
+    def get_checkpoint_options(self):
+        """
+        :return: the options that change the final data but not the first pass (not in the cache keys)
+        """
+        return {"shards": self.shards, "precision": self.precision}
+
+    def read_checkpoint(self):
+        """
+        :return: the checkpoint saved by an interrupted run (see save_checkpoint), None if there is none
+        """
+        if self.cache_dir is None or not os.path.exists(self.get_checkpoint_file()):
+            return None
+        with open(self.get_checkpoint_file(), "rb") as f:
+            return pickle.load(f)
+
+    def is_checkpoint_valid(self, checkpoint, utterances):
+        """
+        :param checkpoint: checkpoint read by read_checkpoint
+        :param utterances: list of the utterance indexes to preprocess
+        :return: whether the run can start again from the checkpoint : same utterances and options, and the raw files
+        and preprocessing parameters of the utterances done by the first pass did not change
+        """
+        if checkpoint["cache_version"] != cache_version or checkpoint["options"] != self.get_checkpoint_options():
+            return False
+        if checkpoint["names"] != [self.get_utterance_name(i) for i in utterances]:
+            return False
+        return all(self.get_cache_key(i) == key for i, key in checkpoint["keys"].items())
+
+    def remove_checkpoint(self):
+        """
+        delete the checkpoint once the preprocessing of the speaker is complete
+        """
+        if self.cache_dir is not None and os.path.exists(self.get_checkpoint_file()):
+            os.remove(self.get_checkpoint_file())
+
+    def remove_final_data(self):
+        """
+        delete the final data of a previous run (npy files of the sentences, shards and manifest)
+        """
+        for folder in ["ema", "mfcc", "ema_final"]:
+            for f in glob.glob(os.path.join(self.path_files_treated, folder, "*.npy")):
+                os.remove(f)
+        for stream in shard_streams:
+            remove_shard(self.path_files_treated, stream)
+        remove_manifest(self.path_files_treated)
+
+    def remove_temporary_files(self):
+        """
+        delete the temporary files left by an interrupted run (see save_atomic)
+        """
+        for f in glob.glob(os.path.join(self.path_files_treated, "*", "*.tmp")):
+            os.remove(f)
+        for f in glob.glob(os.path.join(self.path_files_treated, "*.tmp")):
+            os.remove(f)
+
+    def write_worker_context(self):
+        """
+        :return: path of a file where the speaker is written once for the processes of the pool (see first_pass_job
+        and second_pass_job), so that the tasks only carry the utterance index, its record and its cache key. It is
+        written before each pass (the second pass needs the norm values and the shard index), read once by each
+        process, and deleted at the end of the pass.
+        """
+        path = os.path.join(self.staging_dir or tempfile.gettempdir(),
+                            "context_{}_{}.pkl".format(self.speaker, uuid.uuid4().hex))
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    def Preprocessing_general_speaker(self, pool=None):
+        """
+        :param pool: multiprocessing pool the utterances are sent to, None to treat them one after the other
+        Go through the sentences (in parallel if a pool is given).
+            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
+        smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
+        frame mfcc, add its statistics to the norm stats of this speaker
+            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta) ,
+        add their statistics to the norm stats of this speaker.
+        Then calculate the normvalues based on the norm stats of this speaker, once ALL the utterances
+        are done. Only the running statistics are kept in memory, not the ema/mfcc data.
+        Finally : normalization and last smoothing of the trajectories.
+        The first pass is kept in a staging directory (local disk) until the second pass, so that the final data
+        are written only once. With a cache (cache_dir) the first pass is kept in the cache instead, and the
+        utterances already in the cache are not preprocessed again.
+        Final data are in Preprocessed_data/speaker/ema_final.npy and  mfcc.npy
+        (packed in one array per stream with shards, see shards.py), with the manifest of the sentences (see
+        manifest.py)
+        With a cache, the progress is saved in a checkpoint (see save_checkpoint), and the final data are written
+        in temporary files renamed once complete. With resume, a run that was interrupted starts again from its
+        checkpoint instead of deleting the previous preprocessing.
+        With instrument, the profiles of the utterances (both passes) and of the speaker itself (time waiting for
+        the passes, norm values, shards...) are kept in self.profiles (see instrumentation.py).
+        """
+        speaker_profile = StageProfile(self.speaker, "", "speaker", reset_rss=False) if self.instrument else None
+        checkpoint = self.read_checkpoint() if self.resume else None
+        if checkpoint is None:
+            self.create_missing_dir()
+            for stream in shard_streams:
+                remove_shard(self.path_files_treated, stream)
+            remove_manifest(self.path_files_treated)
+        with stage_of(speaker_profile, "get_utterances"):
+            utterances = self.get_utterances()
+        if self.cache_dir is not None:
+            self.read_raw_digests()
+            raw_files = set(os.path.abspath(path) for i in utterances for path in self.get_raw_files(i))
+        self.norm_stats = NormStats()
+        self.cache_keys = {}
+        self.profiles = []
+        done = set()  # utterances done by the second pass
+        if checkpoint is not None and not self.is_checkpoint_valid(checkpoint, utterances):
+            print("{} : the checkpoint does not match the utterances, all of them are preprocessed".format(self.speaker))
+            self.remove_final_data()
+            checkpoint = None
+        if checkpoint is not None:
+            self.norm_stats = checkpoint["norm_stats"]
+            self.cache_keys.update(checkpoint["keys"])
+            done.update(checkpoint["done"])
+            self.remove_temporary_files()
+            print("{} : resumed, {} utterances done by the first pass, {} by the second pass".format(
+                self.speaker, len(checkpoint["keys"]), len(done)))
+        keys = {}
+        if self.cache_dir is None:
+            self.staging_path = tempfile.mkdtemp(prefix="staging_" + self.speaker + "_", dir=self.staging_dir)
+        else:
+            if not os.path.exists(os.path.join(self.cache_dir, self.speaker)):
+                os.makedirs(os.path.join(self.cache_dir, self.speaker))
+            with stage_of(speaker_profile, "cache_keys"):
+                keys = self.get_cache_keys([i for i in utterances if i not in self.cache_keys])
+        worker_context = None
+        try:
+            to_preprocess = [i for i in utterances if i not in self.cache_keys]
+            if pool is None:
+                jobs = ((i, self.get_utterance_record(i), keys.get(i)) for i in to_preprocess)
+                first_pass = map(self.utterance_norm_stats, jobs)
+            else:
+                worker_context = self.write_worker_context()
+                jobs = ((worker_context, i, self.get_utterance_record(i), keys.get(i)) for i in to_preprocess)
+                first_pass = pool.imap(first_pass_job, jobs)
+            n_in_cache = 0
+            last_checkpoint = time.time()
+            with stage_of(speaker_profile, "first_pass"):  # the statistics are merged as soon as they are done
+                for i, (utterance_stats, key, in_cache, record) in zip(to_preprocess, first_pass):
+                    self.norm_stats.merge(utterance_stats)
+                    self.cache_keys[i] = key
+                    n_in_cache += in_cache
+                    if record is not None:
+                        self.profiles.append(record)
+                    if time.time() - last_checkpoint > self.checkpoint_interval:
+                        self.save_checkpoint(utterances, self.norm_stats, done)
+                        last_checkpoint = time.time()
+            if worker_context is not None:
+                os.remove(worker_context)
+                worker_context = None
+            self.utterance_records = {}
+            if self.cache_dir is not None:
+                print("{} : {} utterances, {} in the cache".format(self.speaker, len(utterances), n_in_cache))
+            with stage_of(speaker_profile, "checkpoint"):
+                self.save_checkpoint(utterances, self.norm_stats, done)
+            with stage_of(speaker_profile, "norm_values"):
+                self.calculate_norm_values()
+            if self.shards and len(utterances) > 0:
+                with stage_of(speaker_profile, "create_shards"):
+                    self.create_shards(utterances, keep_existing=len(done) > 0)
+
+            norm_stats = self.norm_stats
+            self.norm_stats = NormStats()  # not needed anymore, and the speaker is sent to the workers
+            to_normalize = [i for i in utterances if i not in done]
+            if pool is None:
+                second_pass = map(self.utterance_normalization, to_normalize)
+            else:
+                worker_context = self.write_worker_context()
+                second_pass = pool.imap(second_pass_job, ((worker_context, i) for i in to_normalize), chunksize=16)
+            with stage_of(speaker_profile, "second_pass"):
+                for i, record in zip(to_normalize, second_pass):
+                    done.add(i)
+                    if record is not None:
+                        self.profiles.append(record)
+                    if time.time() - last_checkpoint > self.checkpoint_interval:
+                        self.save_checkpoint(utterances, norm_stats, done)
+                        last_checkpoint = time.time()
+            if self.shard_index is not None:
+                for stream in shard_streams:
+                    write_shard_index(self.path_files_treated, stream, self.shard_index[stream])
+            self.save_manifest(utterances, norm_stats)
+        finally:
+            if worker_context is not None:
+                os.remove(worker_context)
+            self.shard_index = None
+            if self.staging_path is not None:
+                shutil.rmtree(self.staging_path)
+                self.staging_path = None
+
+        #  split_sentences(self.speaker)   #possibility to cut to long sentences
+        with stage_of(speaker_profile, "fileset"):
+            get_fileset_names(self.speaker)
+        self.remove_checkpoint()
+        if self.cache_dir is not None and self.N_max == 0:
+            self.prune_cache(utterances, raw_files)
+        if speaker_profile is not None:
+            self.profiles.append(speaker_profile.finish())
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Instrumentation of the preprocessing (argument --profile of main_preprocessing.py) : for each utterance and each
+    pass, the wall time, the bytes read and written and the peak RSS of each stage of the preprocessing (reading of the
+    ema, interpolation of the missing values, smoothing, mfcc, synchronization, writes...).
+    The stages are the methods of the Speaker decorated with profiled (or the blocks in Speaker.profile_stage). The
+    times are exclusive : the time of a stage called inside another one is not counted twice. The time that is not in
+    a stage is in "other".
+    The bytes read and written are those of the thread (/proc/thread-self/io, rchar and wchar : they include the
+    reads from the page cache), the peak RSS is the high-water mark of the process since the beginning of the
+    utterance (/proc/self/status). Without /proc (not Linux) the bytes are 0 and the peak RSS is the peak of the
+    process since its start.
+    At the end of the run the records are written in a csv (one row per utterance and pass) and a json summary (per
+    speaker : totals per stage and percentiles of the time per utterance), and a table is printed.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import csv
+import json
+import time
+import functools
+import contextlib
+import numpy as np
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+def read_io_counters():
+    """
+    :return: number of bytes read and written by the current thread since its start, (0, 0) without /proc
+    """
+    try:
+        with open("/proc/thread-self/io", "r") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except OSError:
+        return 0, 0
+
+
+def reset_peak_rss():
+    """
+    reset the high-water mark of the RSS of the process (Linux only), so that get_peak_rss gives the peak since now
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss():
+    """
+    :return: the peak RSS of the process in bytes (since the last reset_peak_rss on Linux)
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageProfile():
+    """
+    Wall time, bytes read and bytes written per stage of one utterance (or of the work of the speaker itself)
+    """
+    def __init__(self, speaker, utterance, pass_name, reset_rss=True):
+        """
+        :param speaker: name of the speaker
+        :param utterance: name of the utterance ("" for the work of the speaker itself)
+        :param pass_name: "first_pass", "second_pass" or "speaker"
+        :param reset_rss: whether to reset the peak RSS of the process (not for the threads of the speakers, which
+        share their process)
+        """
+        self.speaker = speaker
+        self.utterance = utterance
+        self.pass_name = pass_name
+        self.stages = {}  # stage => [seconds, bytes read, bytes written]
+        self.stack = []
+        if reset_rss:
+            reset_peak_rss()
+        self.start = (time.perf_counter(),) + read_io_counters()
+        self.mark = self.start
+
+    def add_since_mark(self, stage):
+        """
+        :param stage: name of the stage the time and the bytes since the last mark are added to
+        """
+        now = (time.perf_counter(),) + read_io_counters()
+        values = self.stages.setdefault(stage, [0., 0, 0])
+        for k in range(3):
+            values[k] += now[k] - self.mark[k]
+        self.mark = now
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        :param name: name of the stage
+        context manager around a stage, the time of the stage where it is called is paused
+        """
+        self.add_since_mark(self.stack[-1] if self.stack else "other")
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.add_since_mark(self.stack.pop())
+
+    def finish(self):
+        """
+        :return: the record of the profile : dictionary with "speaker", "utterance", "pass", total "seconds",
+        "bytes_read", "bytes_written", "peak_rss", and "stages" (stage => seconds, bytes_read, bytes_written)
+        """
+        self.add_since_mark("other")
+        stages = {stage: {"seconds": values[0], "bytes_read": values[1], "bytes_written": values[2]}
+                  for stage, values in self.stages.items()}
+        return {"speaker": self.speaker, "utterance": self.utterance, "pass": self.pass_name,
+                "seconds": self.mark[0] - self.start[0], "bytes_read": self.mark[1] - self.start[1],
+                "bytes_written": self.mark[2] - self.start[2], "peak_rss": get_peak_rss(), "stages": stages}
+
+
+def stage_of(profile, name):
+    """
+    :param profile: StageProfile, or None when the preprocessing is not instrumented
+    :param name: name of the stage
+    :return: context manager of the stage (does nothing without profile)
+    """
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.stage(name)
+
+
+def profiled(stage):
+    """
+    :param stage: name of the stage
+    :return: decorator of a method of the Speaker, the calls are a stage of the profile of the speaker (self.profile)
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def profiled_method(self, *args, **kwargs):
+            if self.profile is None:
+                return method(self, *args, **kwargs)
+            with self.profile.stage(stage):
+                return method(self, *args, **kwargs)
+        return profiled_method
+    return decorator
+
+
+def percentiles(values):
+    """
+    :param values: list of numbers
+    :return: dictionary with the median ("p50"), the percentiles 90 and 99 and the max
+    """
+    if len(values) == 0:
+        return {"p50": 0., "p90": 0., "p99": 0., "max": 0.}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(np.max(values))}
+
+
+def summarize(records, n_slowest=5):
+    """
+    :param records: list of the records of the profiles (see StageProfile.finish)
+    :param n_slowest: number of slowest utterances kept per speaker
+    :return: dictionary speaker => summary : number of utterances, total seconds, bytes read and written, peak RSS,
+    percentiles of the time per utterance (both passes), slowest utterances, and totals per stage
+    """
+    summary = {}
+    for speaker in sorted(set(record["speaker"] for record in records)):
+        records_speaker = [record for record in records if record["speaker"] == speaker]
+        seconds_per_utterance = {}
+        for record in records_speaker:
+            if record["pass"] != "speaker":
+                seconds_per_utterance[record["utterance"]] = \
+                    seconds_per_utterance.get(record["utterance"], 0.) + record["seconds"]
+        stages = {}
+        for record in records_speaker:
+            for stage, values in record["stages"].items():
+                name = stage if record["pass"] != "speaker" else "speaker/" + stage
+                total = stages.setdefault(name, {"seconds": 0., "bytes_read": 0, "bytes_written": 0})
+                for k in total:
+                    total[k] += values[k]
+        slowest = sorted(seconds_per_utterance.items(), key=lambda item: -item[1])[:n_slowest]
+        utterance_records = [record for record in records_speaker if record["pass"] != "speaker"]
+        summary[speaker] = {
+            "n_utterances": len(seconds_per_utterance),
+            "seconds": sum(record["seconds"] for record in records_speaker if record["pass"] == "speaker"),
+            "utterance_seconds": sum(seconds_per_utterance.values()),
+            "bytes_read": sum(record["bytes_read"] for record in utterance_records),
+            "bytes_written": sum(record["bytes_written"] for record in utterance_records),
+            "peak_rss": max([record["peak_rss"] for record in records_speaker] + [0]),
+            "seconds_per_utterance": percentiles(list(seconds_per_utterance.values())),
+            "slowest": [{"utterance": name, "seconds": seconds} for name, seconds in slowest],
+            "stages": stages}
+    return summary
+
+
+def write_summary(records, path_dir):
+    """
+    :param records: list of the records of the profiles (see StageProfile.finish)
+    :param path_dir: directory where profile_utterances.csv (one row per record, seconds per stage) and
+    profile_summary.json (see summarize) are written
+    :return: the summary
+    """
+    if not os.path.exists(path_dir):
+        os.makedirs(path_dir)
+    stages = sorted(set(stage for record in records for stage in record["stages"]))
+    with open(os.path.join(path_dir, "profile_utterances.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["speaker", "utterance", "pass", "seconds", "bytes_read", "bytes_written", "peak_rss"] +
+                        stages)
+        for record in records:
+            writer.writerow([record["speaker"], record["utterance"], record["pass"], record["seconds"],
+                             record["bytes_read"], record["bytes_written"], record["peak_rss"]] +
+                            [record["stages"][stage]["seconds"] if stage in record["stages"] else 0.
+                             for stage in stages])
+    summary = summarize(records)
+    with open(os.path.join(path_dir, "profile_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def print_summary(summary):
+    """
+    :param summary: summary of the run (see summarize)
+    print one line per speaker (time per utterance percentiles, bytes, peak RSS, slowest utterance), then the share
+    of the time of the utterances per stage
+    """
+    print("{:<8} {:>6} {:>9} {:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>9}  {}".format(
+        "speaker", "utt", "wall (s)", "p50 (s)", "p90 (s)", "p99 (s)", "max (s)", "read (MB)", "write (MB)",
+        "RSS (MB)", "slowest"))
+    for speaker, values in summary.items():
+        per_utterance = values["seconds_per_utterance"]
+        slowest = values["slowest"][0]["utterance"] if values["slowest"] else ""
+        print("{:<8} {:>6} {:9.1f} {:8.3f} {:8.3f} {:8.3f} {:8.3f} {:10.1f} {:10.1f} {:9.0f}  {}".format(
+            speaker, values["n_utterances"], values["seconds"], per_utterance["p50"], per_utterance["p90"],
+            per_utterance["p99"], per_utterance["max"], values["bytes_read"] / 1e6, values["bytes_written"] / 1e6,
+            values["peak_rss"] / 1e6, slowest))
+    stages = sorted(set(stage for values in summary.values() for stage in values["stages"]
+                        if not stage.startswith("speaker/")))
+    print()
+    print("share of the time of the utterances per stage (%)")
+    print("{:<8} ".format("speaker") + " ".join("{:>12}".format(stage[:12]) for stage in stages))
+    for speaker, values in summary.items():
+        total = max(values["utterance_seconds"], 1e-12)
+        print("{:<8} ".format(speaker) + " ".join(
+            "{:12.1f}".format(100 * values["stages"][stage]["seconds"] / total if stage in values["stages"] else 0.)
+            for stage in stages))
@@ -5,37 +5,82 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 from os.path import dirname
 
-from Preprocessing.preprocessing_haskins import Preprocessing_general_haskins
-from Preprocessing.preprocessing_mngu0 import Preprocessing_general_mngu0
-from Preprocessing.preprocessing_usc_timit import Preprocessing_general_usc
-from Preprocessing.preprocessing_mocha import Preprocessing_general_mocha
+from Preprocessing.preprocessing_haskins import Speaker_Haskins
+from Preprocessing.preprocessing_mngu0 import Speaker_MNGU0
+from Preprocessing.preprocessing_usc_timit import Speaker_usc
+from Preprocessing.preprocessing_mocha import Speaker_mocha
+from Preprocessing.tools_preprocessing import get_speakers_per_corpus
+from Preprocessing.instrumentation import write_summary, print_summary
 import argparse
-from multiprocessing import Process
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 
 
-def Preprocessing_general_per_corpus(corp, max, path_to_corpus):
+def get_speaker(corp, sp, max, path_to_corpus, **kwargs):
+    """
+    :param corp: corpus of the speaker
+    :param sp: name of the speaker
+    :param max: max of files to preprocess (useful for test), 0 to treat all files
+    :param kwargs: options of the preprocessing (see the Speaker class)
+    :return: the Speaker instance (child class corresponding to the corpus) for this speaker
     """
-    :param corp: corpus we want to do the preprocess
-    :param max:  max of files to preprocess (useful for test), 0 to treat all files
-    perform the preprocess for the asked corpus
-     """
     if corp == "MNGU0":
-        Preprocessing_general_mngu0(max, path_to_raw=path_to_corpus)
+        speaker = Speaker_MNGU0(path_to_raw=path_to_corpus, N_max=max, **kwargs)
     elif corp == "usc":
-        Preprocessing_general_usc(max, path_to_raw=path_to_corpus)
+        speaker = Speaker_usc(sp, path_to_raw=path_to_corpus, N_max=max, **kwargs)
     elif corp == "Haskins":
-        Preprocessing_general_haskins(max, path_to_raw=path_to_corpus)
+        speaker = Speaker_Haskins(sp, path_to_raw=path_to_corpus, N_max=max, **kwargs)
     elif corp == "mocha":
-        Preprocessing_general_mocha(max, path_to_raw=path_to_corpus)
+        speaker = Speaker_mocha(sp, path_to_raw=path_to_corpus, N_max=max, **kwargs)
+    else:
+        raise NameError("vous navez pas choisi un des corpus")
+    return speaker
+
+
+def Preprocessing_general_per_speaker(corp, sp, max, path_to_corpus, pool, options):
+    """
+    :param corp: corpus of the speaker
+    :param sp: name of the speaker
+    :param max: max of files to preprocess (useful for test), 0 to treat all files
+    :param pool: multiprocessing pool shared by all the speakers, the utterances of the speaker are sent to it
+    :param options: dictionary of the options of the preprocessing (see the Speaker class)
+    :return: the records of the profiles of the speaker (empty if the preprocessing is not instrumented)
+    perform the preprocess for the asked speaker. The norm values are calculated in this thread once all the
+    utterances of the speaker are done.
+    """
+    print("In progress {} {}".format(corp, sp))
+    speaker = get_speaker(corp, sp, max, path_to_corpus, **options)
+    speaker.Preprocessing_general_speaker(pool=pool)
+    print("Done {} {}".format(corp, sp))
+    return speaker.profiles
+
+
+def dry_run_report(speakers, max, path_to_corpus, options):
+    """
+    :param speakers: list of (corpus, speaker)
+    :param max: max of files to preprocess (useful for test), 0 to treat all files
+    :param options: dictionary of the options of the preprocessing (see the Speaker class)
+    print for each speaker the utterances that would be preprocessed again (not in the cache). The norm values and
+    the normalization are always done again for all the utterances.
+    """
+    n_total, n_to_rebuild = 0, 0
+    for corp, sp in speakers:
+        speaker = get_speaker(corp, sp, max, path_to_corpus, **options)
+        n_utterances, to_rebuild = speaker.dry_run_report()
+        print("{} {} : {} utterances, {} to preprocess".format(corp, sp, n_utterances, len(to_rebuild)))
+        for name in to_rebuild:
+            print("    " + name)
+        n_total += n_utterances
+        n_to_rebuild += len(to_rebuild)
+    print("total : {} utterances, {} to preprocess".format(n_total, n_to_rebuild))
 
 
 if __name__ == '__main__':
     """
     from the cmd to launch preprocess for all the corpuses,
-    parallel computing, 1 processor per corpus 
+    parallel computing : the speakers are launched at the same time (1 thread per speaker, at most n_jobs at once) and
+    their utterances are sent to one process pool sized to the machine
     """
-    procs = []
-
     parser = argparse.ArgumentParser(description='preprocessing of all the corpuses with parallelization')
     parser.add_argument('--N_max',  type=int, default=0,
                         help='by default ')
@@ -43,6 +88,36 @@ if __name__ == '__main__':
                         help='corpus to preprocess')
     parser.add_argument('--path_to_raw_data', type=str,
                         help='path to the directory where all the folders with the raw data of each corpus are')
+    parser.add_argument('--n_jobs', type=int, default=cpu_count(),
+                        help='number of processes of the pool the utterances are sent to, by default # of cpu')
+    parser.add_argument('--store_context', action='store_true',
+                        help='save the mfcc with the 10 context frames (K,429) instead of (K,39)')
+    parser.add_argument('--keep_intermediate', action='store_true',
+                        help='also save the ema trajectories without the last smoothing in the folder "ema", and '
+                             'the sentences cut from the recordings of usc in mat_cut and wav_cut')
+    parser.add_argument('--staging_dir', type=str, default=None,
+                        help='directory where the first pass is kept until the norm values are known, by default '
+                             'the temporary directory of the system (should be on a local disk)')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='directory of the cache of the first pass (the utterances that did not change are not '
+                             'preprocessed again), by default no cache')
+    parser.add_argument('--synchro_method', type=str, default="fft", choices=["fft", "polyphase", "linear"],
+                        help='how the ema are resampled to have 1 position per frame mfcc, by default with the fft '
+                             'of the whole trajectories (as the first version)')
+    parser.add_argument('--shards', action='store_true',
+                        help='save the mfcc and ema_final of each speaker in one packed array per stream (with an '
+                             'index of the sentences) instead of one npy file per sentence, see shards.py')
+    parser.add_argument('--precision', type=str, default="float64", choices=["float64", "float32"],
+                        help='type of the final data, float32 takes half the size on the disk and in memory')
+    parser.add_argument('--resume', action='store_true',
+                        help='start again an interrupted preprocessing from the checkpoints saved in the cache, '
+                             'instead of deleting the previous preprocessing')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='directory where the wall time, bytes read and written and peak RSS of each stage of the '
+                             'preprocessing are written, per utterance (profile_utterances.csv) and per speaker '
+                             '(profile_summary.json), see instrumentation.py')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='only print the utterances that are not in the cache and would be preprocessed')
 
     root_folder = os.path.dirname(os.getcwd())
 
@@ -57,11 +132,26 @@ if __name__ == '__main__':
         corpus = args.corpus[1:-1].split(",")
     else:
         corpus = args.corpus
-    for co in corpus:
-        proc = Process(target=Preprocessing_general_per_corpus, args=(co, args.N_max, args.path_to_raw_data))
-        procs.append(proc)
-        proc.start()
-
-    for proc in procs:
-        proc.join()
 
+    cache_dir = args.cache_dir
+    if cache_dir is None and args.resume:
+        parser.error("--resume needs a cache (--cache_dir), where the first pass and the checkpoints are kept")
+    options = {"store_context": args.store_context, "keep_intermediate": args.keep_intermediate,
+               "staging_dir": args.staging_dir, "cache_dir": cache_dir, "synchro_method": args.synchro_method,
+               "shards": args.shards, "precision": args.precision,
+               "resume": args.resume, "instrument": args.profile is not None}
+    speakers = [(co, sp) for co in corpus for sp in get_speakers_per_corpus(co)]
+    if args.dry_run:
+        dry_run_report(speakers, args.N_max, args.path_to_raw_data, options)
+        sys.exit()
+    pool = Pool(processes=args.n_jobs)
+    speakers_pool = ThreadPool(processes=max(1, min(len(speakers), args.n_jobs)))
+    profiles = speakers_pool.starmap(Preprocessing_general_per_speaker,
+                                     [(co, sp, args.N_max, args.path_to_raw_data, pool, options) for co, sp in speakers])
+    speakers_pool.close()
+    speakers_pool.join()
+    pool.close()
+    pool.join()
+    if args.profile is not None:
+        summary = write_summary([record for records in profiles for record in records], args.profile)
+        print_summary(summary)
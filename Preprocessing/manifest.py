@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Manifest of the preprocessed sentences : for each sentence its speaker, corpus, category, number of frames and
+    first frame in the shards (None if the speaker is saved with one npy file per sentence).
+    It is written by the preprocessing in Preprocessed_data/speaker/manifest.json, and read once per process by the
+    training to know the speaker of a sentence without looking for the name of the speaker in the name of the file.
+    For the speakers preprocessed before the manifest, it is built from the preprocessed data when it is read. To write
+    it for these speakers :
+    python manifest.py --speakers ["F01","fsew0"]
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import argparse
+import json
+from functools import lru_cache
+from Preprocessing.speaker_registry import get_speakers_info, get_speaker_info
+from Preprocessing.shards import get_shard_paths, read_npy_header, get_sentence_names
+
+
+def get_manifest_path(path_speaker):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker (Preprocessed_data/speaker)
+    :return: path of the manifest of the speaker
+    """
+    return os.path.join(path_speaker, "manifest.json")
+
+
+def make_manifest(speaker, names, lengths, offsets=None):
+    """
+    :param speaker: name of the speaker
+    :param names: names of the sentences
+    :param lengths: number of frames of each sentence
+    :param offsets: first frame of each sentence in the shards, None if the sentences are not packed
+    :return: dictionary name => {"speaker", "corpus", "category", "length", "offset"}
+    """
+    speaker_info = get_speaker_info(speaker)
+    if offsets is None:
+        offsets = [None] * len(names)
+    return {name: {"speaker": speaker, "corpus": speaker_info["corpus"], "category": speaker_info["category"],
+                   "length": int(length), "offset": None if offset is None else int(offset)}
+            for name, length, offset in zip(names, lengths, offsets)}
+
+
+def write_manifest(path_speaker, manifest):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param manifest: manifest of the speaker (see make_manifest)
+    """
+    path = get_manifest_path(path_speaker)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def remove_manifest(path_speaker):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    """
+    if os.path.exists(get_manifest_path(path_speaker)):
+        os.remove(get_manifest_path(path_speaker))
+
+
+def build_manifest(path_speaker, speaker):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param speaker: name of the speaker
+    :return: the manifest of the speaker built from its preprocessed data (index of the shard of ema_final if it is
+    packed, otherwise the headers of the npy files)
+    """
+    path_shard, path_index = get_shard_paths(path_speaker, "ema_final")
+    if os.path.exists(path_index):
+        with open(path_index, "r") as f:
+            index = json.load(f)
+        names = list(index)
+        return make_manifest(speaker, names, [index[name][1] for name in names], [index[name][0] for name in names])
+    names = get_sentence_names(path_speaker)
+    lengths = [read_npy_header(os.path.join(path_speaker, "ema_final", name + ".npy"))[0][0] for name in names]
+    return make_manifest(speaker, names, lengths)
+
+
+def read_speaker_manifest(path_speaker, speaker):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param speaker: name of the speaker
+    :return: the manifest of the speaker, built from its preprocessed data if it was not written
+    """
+    if os.path.exists(get_manifest_path(path_speaker)):
+        with open(get_manifest_path(path_speaker), "r") as f:
+            return json.load(f)
+    return build_manifest(path_speaker, speaker)
+
+
+@lru_cache(maxsize=None)
+def get_manifest():
+    """
+    :return: the manifest of all the speakers preprocessed (in Preprocessed_data), name of the sentence =>
+    {"speaker", "corpus", "category", "length", "offset"}. Read only once per process.
+    """
+    path_preprocessed = os.path.join(parentdir, "Preprocessed_data")
+    manifest = {}
+    for speaker in get_speakers_info():
+        path_speaker = os.path.join(path_preprocessed, speaker)
+        if os.path.isdir(os.path.join(path_speaker, "ema_final")):
+            manifest.update(read_speaker_manifest(path_speaker, speaker))
+    return manifest
+
+
+def get_sentence_info(name):
+    """
+    :param name: name of a preprocessed sentence
+    :return: its speaker, corpus, category, number of frames and first frame in the shards (see get_manifest)
+    """
+    return get_manifest()[name]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes the manifest of the speakers already preprocessed')
+    parser.add_argument('--speakers', type=str, default="all",
+                        help='list of the speakers, by default all the speakers in Preprocessed_data')
+    args = parser.parse_args()
+
+    path_preprocessed = os.path.join(parentdir, "Preprocessed_data")
+    if args.speakers == "all":
+        speakers = [sp for sp in get_speakers_info() if os.path.isdir(os.path.join(path_preprocessed, sp, "ema_final"))]
+    else:
+        speakers = args.speakers[1:-1].replace("'", "").replace('"', '').replace(' ', '').split(",")
+    for sp in speakers:
+        path_speaker = os.path.join(path_preprocessed, sp)
+        manifest = build_manifest(path_speaker, sp)
+        write_manifest(path_speaker, manifest)
+        print("{} : {} sentences in the manifest".format(sp, len(manifest)))
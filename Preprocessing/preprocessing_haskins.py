@@ -8,9 +8,10 @@
     There are 8 speakers, the rawfiles for the speaker X need to be in "Raw_data/Haskins/X".
     For one sentence the acoustic & arti data are in a matlab file "data".
     The extraction&preprocessing are done for one speaker after the other.
-    For one sentence of speaker X the script saves 3 files in "Preprocessed_data/X"  : mfcc (K,429), ema (K,18),
+    For one sentence of speaker X the script saves 3 files in "Preprocessed_data/X"  : mfcc (K,39), ema (K,18),
     ema_final (K,18) [same as ema but normalized]; where K depends on the duration of the recording
-    The script write a .wav file in "Raw_data/Haskins/X/wav".
+    The wav is taken from the matlab file and resampled in memory, it is written in "Raw_data/Haskins/X/wav" only with
+    keep_intermediate.
     The script also saves for each the "norm values" [see class_corpus, calculate_norm_values()]
 """
 import os,sys,inspect
@@ -27,8 +28,9 @@ import numpy as np
 import scipy.signal
 import scipy.interpolate
 import librosa
-from Preprocessing.tools_preprocessing import get_speakers_per_corpus
+from Preprocessing.tools_preprocessing import get_speakers_per_corpus, resample_wav, write_wav
 from Preprocessing.class_corpus import Speaker
+from Preprocessing.instrumentation import profiled
 import glob
 
 root_path = dirname(dirname(os.path.realpath(__file__)))
@@ -54,12 +56,13 @@ class Speaker_Haskins(Speaker):
     class for 1 speaker of Haskins, child of the Speaker class (in class_corpus.py),
     then inherits of some preprocessing scripts and attributes
     """
-    def __init__(self, sp, path_to_raw, N_max=0):
+    def __init__(self, sp, path_to_raw, N_max=0, **kwargs):
         """
         :param sp:  name of the speaker
         :param N_max:  # max of files we want to preprocess (0 is for All files), variable useful for test
+        :param kwargs: options of the preprocessing (see the Speaker class)
         """
-        super().__init__(sp)  # gets the attributes of the Speaker class
+        super().__init__(sp, **kwargs)  # gets the attributes of the Speaker class
         self.root_path = path_to_raw
         self.path_files_treated = os.path.join(root_path, "Preprocessed_data", self.speaker)
         self.path_files_brutes = os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "data")
@@ -78,8 +81,9 @@ class Speaker_Haskins(Speaker):
         if not os.path.exists(os.path.join(self.path_files_treated, "ema_final")):
             os.makedirs(os.path.join(self.path_files_treated, "ema_final"))
 
-        # We are going tp create the wav files form the matlab format files given for haskins
-        if not os.path.exists(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "wav")):
+        # With keep_intermediate the wav files are created from the matlab format files given for haskins
+        if self.keep_intermediate and not os.path.exists(
+                os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "wav")):
             os.makedirs(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "wav"))
 
         files = glob.glob(os.path.join(self.path_files_treated, "ema", "*"))
@@ -89,14 +93,14 @@ class Speaker_Haskins(Speaker):
         for f in files:
             os.remove(f)
 
+    @profiled("read_ema")
     def read_ema_and_wav(self, k):
         """
         :param k: index wrt EMA_files list of the file to read
-        :return: ema positions for 12 arti (K',12) , acoustic features (K,429); where K in the # of frames.
+        :return: ema positions for 12 arti (K',12) , acoustic features (K,39); where K in the # of frames.
         read and reorganize the ema traj,
-        calculations of the mfcc with librosa , + Delta and DeltaDelta, + 10 context frames
-        # of acoustic features per frame: 13 ==> 13*3 = 39 ==> 39*11 = 429.
-        parameters for mfcc calculation are defined in class_corpus
+        calculations of the mfcc (see from_wav_to_mfcc in class_corpus)
+        The resampling of the wav is the stage "read_wav" of the profile (see instrumentation.py)
         """
         order_arti_haskins = ['td_x', 'td_y', 'tb_x', 'tb_y', 'tt_x', 'tt_y', 'ul_x', 'ul_y', "ll_x", "ll_y",
                               "ml_x", "ml_y", "li_x", "li_y", "jl_x", "jl_y"]
@@ -113,24 +117,15 @@ class Speaker_Haskins(Speaker):
         new_order_arti = [order_arti_haskins.index(col) for col in order_arti]
         ema = ema[:, new_order_arti]
 
-        # We create wav files form intensity matlab files
+        # the wav is the intensity in the matlab file, resampled in memory
         wav_data = data[0][2][:, 0]
-        librosa.output.write_wav(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker,
-                                              "wav", self.EMA_files[k] + ".wav"), wav_data, self.sampling_rate_wav)
-        wav, sr = librosa.load(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "wav",
-                                            self.EMA_files[k] + ".wav"), sr=self.sampling_rate_wav_wanted)
-        # np.save(os.path.join(root_path, "Raw_data", corpus, speaker, "wav",
-        #                      EMA_files[k]), wav)
-        wav = 0.5 * wav / np.max(wav)
-        mfcc = librosa.feature.mfcc(y=wav, sr=self.sampling_rate_wav_wanted, n_mfcc=self.n_coeff,
-                                       n_fft=self.frame_length, hop_length=self.hop_length).T
-        dyna_features = get_delta_features(mfcc)
-        dyna_features_2 = get_delta_features(dyna_features)
-        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
-        padding = np.zeros((self.window, mfcc.shape[1]))
-        frames = np.concatenate([padding, mfcc, padding])
-        full_window = 1 + 2 * self.window
-        mfcc = np.concatenate([frames[i:i + len(mfcc)] for i in range(full_window)], axis=1)
+        if self.keep_intermediate:
+            write_wav(os.path.join(self.root_path, "Raw_data", self.corpus, self.speaker, "wav",
+                                   self.EMA_files[k] + ".wav"), wav_data, self.sampling_rate_wav)
+        with self.profile_stage("read_wav"):
+            wav = resample_wav(wav_data, self.sampling_rate_wav, self.sampling_rate_wav_wanted)
+            wav = 0.5 * wav / np.max(wav)
+        mfcc = self.from_wav_to_mfcc(wav)
 
         marge = 0
         xtrm = detect_silence(data)
@@ -143,67 +138,60 @@ class Speaker_Haskins(Speaker):
         ema = ema[xtrm_temp_ema[0]:xtrm_temp_ema[1], :]
         mfcc = mfcc[xtrm_temp_mfcc[0]:xtrm_temp_mfcc[1]]
 
-        n_frames_wanted = mfcc.shape[0]
-        ema = scipy.signal.resample(ema, num=n_frames_wanted)
+        ema, mfcc = self.synchro_ema_mfcc(ema, mfcc)
         return ema, mfcc
 
-    def Preprocessing_general_speaker(self):
+    def get_raw_files(self, i):
         """
-        Go through the sentences one by one.
-            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
-        smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
-        frame mfcc, add it to the list of EMA traj for this speaker
-            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes) ,
-        add it to the list of the MFCC FEATURES for this speaker.
-        Then calculate the normvalues based on the list of ema/mfcc data for this speaker
-        Finally : normalization and last smoothing of the trajectories.
-        Final data are in Preprocessed_data/speaker/ema_final.npy and  mfcc.npy
+        :param i: utterance index (wrt the list "EMA_files")
+        :return: list of the raw files read for this utterance : the matlab file with the ema and the wav
         """
+        return [os.path.join(self.path_files_brutes, self.EMA_files[i] + ".mat")]
 
-        self.create_missing_dir()
-        N = len(self.EMA_files)
-        if self.N_max != 0:
-            N = int(self.N_max)
-
-        for i in range(N):
-            ema, mfcc = self.read_ema_and_wav(i)
-            ema_VT = self.add_vocal_tract(ema)
-            ema_VT_smooth = self.smooth_data(ema_VT)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i]), ema_VT)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final",
-                                 self.EMA_files[i]), ema_VT_smooth)
-            self.list_EMA_traj.append(ema_VT_smooth)
-            self.list_MFCC_frames.append(mfcc)
-        self.calculate_norm_values()
-
-        for i in range(N):
-            ema_VT_smooth = np.load(os.path.join(
-                root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i] + ".npy"))
-            mfcc = np.load(os.path.join(
-                root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i] + ".npy"))
-            ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
-            new_sr = 1 / self.hop_time
-            ema_VT_smooth_norma = self.smooth_data(ema_VT_smooth_norma, new_sr)
-
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]),
-                    ema_VT_smooth_norma)
-        #  split_sentences(speaker)
-        get_fileset_names(self.speaker)
-
-
-def Preprocessing_general_haskins(N_max, path_to_raw):
+    def preprocess_utterance(self, i):
+        """
+        first pass on one sentence : reads the ema and the wav (see read_ema_and_wav), turn the ema into a (K,18)
+        array where arti are in a precise order and smooth the trajectories
+        :param i: utterance index (wrt the list "EMA_files")
+        :return: the smoothed ema trajectory and the mfcc frames, used to calculate the norm values
+        """
+        ema, mfcc = self.read_ema_and_wav(i)
+        ema_VT = self.add_vocal_tract(ema)
+        ema_VT_smooth = self.smooth_data(ema_VT)
+        if self.keep_intermediate:
+            self.stage_utterance(i, ema_final=ema_VT_smooth, mfcc=mfcc, ema=ema_VT)
+        else:
+            self.stage_utterance(i, ema_final=ema_VT_smooth, mfcc=mfcc)
+        return ema_VT_smooth, mfcc
+
+    def normalize_utterance(self, i):
+        """
+        second pass on one sentence : normalization and last smoothing of the trajectories.
+        :param i: utterance index (wrt the list "EMA_files")
+        """
+        ema_VT_smooth, mfcc = self.load_staged_utterance(i, "ema_final", "mfcc")
+        if self.keep_intermediate:
+            ema_VT, = self.load_staged_utterance(i, "ema")
+            self.save_utterance(self.EMA_files[i], ema=ema_VT)
+        ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
+        new_sr = 1 / self.hop_time
+        ema_VT_smooth_norma = self.smooth_data(ema_VT_smooth_norma, new_sr)
+        self.save_utterance(self.EMA_files[i], mfcc=mfcc, ema_final=ema_VT_smooth_norma)
+
+
+def Preprocessing_general_haskins(N_max, path_to_raw, pool=None, **kwargs):
     """
     :param N_max: #max of files to treat (0 to treat all files), useful for test
+    :param pool: multiprocessing pool to send the utterances to (None to treat them one after the other)
+    :param kwargs: options of the preprocessing (see the Speaker class)
     go through all the speakers of Haskins
     """
     corpus = 'Haskins'
     speakers_Has = get_speakers_per_corpus(corpus)
     for sp in speakers_Has :
         print("In progress Haskins ",sp)
-        speaker = Speaker_Haskins(sp, path_to_raw=path_to_raw, N_max=N_max)
-        speaker.Preprocessing_general_speaker()
+        speaker = Speaker_Haskins(sp, path_to_raw=path_to_raw, N_max=N_max, **kwargs)
+        speaker.Preprocessing_general_speaker(pool=pool)
         print("Done Haskins ",sp)
 
 
@@ -14,7 +14,7 @@ sys.path.insert(0,parentdir)
 import scipy.signal
 import scipy.interpolate
 import scipy.io as sio
-from Preprocessing.tools_preprocessing import get_fileset_names, get_delta_features, split_sentences
+from Preprocessing.tools_preprocessing import get_fileset_names, get_delta_features, split_sentences, read_est_file
 
 from os.path import dirname
 import numpy as np
@@ -22,6 +22,7 @@ import scipy.signal
 import scipy.interpolate
 import librosa
 from Preprocessing.class_corpus import Speaker
+from Preprocessing.instrumentation import profiled
 import glob
 
 root_path = dirname(dirname(os.path.realpath(__file__)))
@@ -40,12 +41,13 @@ class Speaker_MNGU0(Speaker):
     class for the speaker of MNGU0, child of the Speaker class (in class_corpus.py),
     then inherits of some preprocessing scripts and attributes
     """
-    def __init__(self, path_to_raw,  N_max=0 ):
+    def __init__(self, path_to_raw,  N_max=0, **kwargs):
         """
         :param sp:  name of the speaker
         :param N_max:  # max of files we want to preprocess (0 is for All files), variable useful for test
+        :param kwargs: options of the preprocessing (see the Speaker class)
         """
-        super().__init__("MNGU0")  # gets the attributes of the Speaker class
+        super().__init__("MNGU0", **kwargs)  # gets the attributes of the Speaker class
         self.root_path = path_to_raw
         self.path_files_annotation = os.path.join(self.root_path, "Raw_data", self.speaker, "phone_labels")
         self.path_ema_files = os.path.join(self.root_path, "Raw_data", self.speaker, "ema")
@@ -59,7 +61,6 @@ class Speaker_MNGU0(Speaker):
             'T1_py', 'T1_pz', 'T3_py', 'T3_pz', 'T2_py', 'T2_pz',
             'jaw_py', 'jaw_pz', 'upperlip_py', 'upperlip_pz',
             'lowerlip_py', 'lowerlip_pz']
-        self.n_columns =  87
 
 
     def create_missing_dir(self):
@@ -81,6 +82,7 @@ class Speaker_MNGU0(Speaker):
             os.remove(f)
 
 
+    @profiled("read_ema")
     def read_ema_file(self,k):
         """
         read the ema file, first preprocessing,
@@ -88,29 +90,10 @@ class Speaker_MNGU0(Speaker):
         :return: npy array (K,12) , K depends on the duration of the recording, 12 trajectories
         """
         path_ema_file = os.path.join(self.path_ema_files, self.EMA_files[k] + ".ema")
-        with open(path_ema_file, 'rb') as ema_annotation:
-            column_names = [0] * self.n_columns
-            for line in ema_annotation:
-                line = line.decode('latin-1').strip("\n")
-                if line == 'EST_Header_End':
-                    break
-                elif line.startswith('NumFrames'):
-                    n_frames = int(line.rsplit(' ', 1)[-1])
-                elif line.startswith('Channel_'):
-                    col_id, col_name = line.split(' ', 1)
-                    column_names[int(col_id.split('_', 1)[-1])] = col_name
-
-            ema_data = np.fromfile(ema_annotation, "float32").reshape(n_frames, self.n_columns + 2)
-            cols_index = [column_names.index(col) for col in self.articulators_init]
-            ema_data = ema_data[:, cols_index]
-            ema_data = ema_data*100  #initial data in  10^-5m , we turn it to mm
-            if np.isnan(ema_data).sum() != 0:
-                # Build a cubic spline out of non-NaN values.
-                spline = scipy.interpolate.splrep( np.argwhere(~np.isnan(ema_data).ravel()), ema_data[~np.isnan(ema_data)], k=3)
-                # Interpolate missing values and replace them.
-                for j in np.argwhere(np.isnan(ema_data)).ravel():
-                    ema_data[j] = scipy.interpolate.splev(j, spline)
-            return ema_data
+        ema_data = read_est_file(path_ema_file, self.articulators_init)
+        ema_data = ema_data*100  #initial data in  10^-5m , we turn it to mm
+        ema_data = self.interpolate_missing_values(ema_data, k, self.articulators_init)
+        return ema_data
 
     def remove_silences(self,k, ema, mfcc):
         """
@@ -142,78 +125,61 @@ class Speaker_MNGU0(Speaker):
         ema = ema[xtrm_temp_ema[0]:xtrm_temp_ema[1], :]
         return ema, mfcc
 
-    def from_wav_to_mfcc(self,wav):
+    def get_raw_files(self, i):
         """
-        :param wav: list of intensity points of the wav file
-        :return: the acoustic features( K,429); where K in the # of frames.
-        calculations of the mfcc with librosa , + Delta and DeltaDelta, + 10 context frames
-        # of acoustic features per frame: 13 ==> 13*3 = 39 ==> 39*11 = 429.
-        parameters for mfcc calculation are defined in class_corpus
+        :param i: utterance index (wrt the list "EMA_files")
+        :return: list of the raw files read for this utterance : ema, wav and annotation
         """
-        mfcc = librosa.feature.mfcc(y=wav, sr=self.sampling_rate_wav, n_mfcc=self.n_coeff,
-                                    n_fft=self.frame_length, hop_length=self.hop_length
-                                    ).T
-        dyna_features = get_delta_features(mfcc)
-        dyna_features_2 = get_delta_features(dyna_features)
-        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
-        padding = np.zeros((self.window, mfcc.shape[1]))
-        frames = np.concatenate([padding, mfcc, padding])
-        full_window = 1 + 2 * self.window
-        mfcc = np.concatenate([frames[i:i + len(mfcc)] for i in range(full_window)], axis=1)
-        return mfcc
-
-    def Preprocessing_general_speaker(self):
+        return [os.path.join(self.path_ema_files, self.EMA_files[i] + ".ema"),
+                os.path.join(self.path_wav_files, self.EMA_files[i] + ".wav"),
+                os.path.join(self.path_files_annotation, self.EMA_files[i] + ".lab")]
+
+    def preprocess_utterance(self, i):
+        """
+        first pass on one sentence :
+            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing
+        values, smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position
+        per frame mfcc
+            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta)
+        :param i: utterance index (wrt the list "EMA_files")
+        :return: the smoothed ema trajectory and the mfcc frames, used to calculate the norm values
         """
-        Go through the sentences one by one.
-            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
-        smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
-        frame mfcc, add it to the list of EMA traj for this speaker
-            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes) ,
-        add it to the list of the MFCC FEATURES for this speaker.
-        Then calculate the normvalues based on the list of ema/mfcc data for this speaker
-        Finally : normalization and last smoothing of the trajectories.
-        Final data are in Preprocessed_data/speaker/ema_final.npy and  mfcc.npy
+        ema = self.read_ema_file(i)
+        ema_VT = self.add_vocal_tract(ema)
+        ema_VT_smooth = self.smooth_data(ema_VT)
+        path_wav = os.path.join(self.path_wav_files, self.EMA_files[i] + '.wav')
+        wav = self.read_wav(path_wav)
+        wav = 0.5 * wav / np.max(wav)
+        mfcc = self.from_wav_to_mfcc(wav)
+        ema_VT_smooth, mfcc = self.remove_silences(i, ema_VT_smooth, mfcc)
+        ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
+        if self.keep_intermediate:
+            self.stage_utterance(i, ema_final=ema_VT_smooth, mfcc=mfcc, ema=ema_VT)
+        else:
+            self.stage_utterance(i, ema_final=ema_VT_smooth, mfcc=mfcc)
+        return ema_VT_smooth, mfcc
+
+    def normalize_utterance(self, i):
         """
+        second pass on one sentence : normalization of the trajectories and of the mfcc.
+        :param i: utterance index (wrt the list "EMA_files")
+        """
+        ema_VT_smooth, mfcc = self.load_staged_utterance(i, "ema_final", "mfcc")
+        if self.keep_intermediate:
+            ema_VT, = self.load_staged_utterance(i, "ema")
+            self.save_utterance(self.EMA_files[i], ema=ema_VT)
+        ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
+        self.save_utterance(self.EMA_files[i], mfcc=mfcc, ema_final=ema_VT_smooth_norma)
+
 
-        self.create_missing_dir()
-        N = len(self.EMA_files)
-        if self.N_max != 0:
-            N = self.N_max
-        for i in range(N):
-            ema = self.read_ema_file(i)
-            ema_VT = self.add_vocal_tract(ema)
-            ema_VT_smooth = self.smooth_data(ema_VT)
-            path_wav = os.path.join(self.path_wav_files, self.EMA_files[i] + '.wav')
-            wav, sr = librosa.load(path_wav, sr=self.sampling_rate_wav)
-            wav = 0.5 * wav / np.max(wav)
-            mfcc = self.from_wav_to_mfcc(wav)
-            ema_VT_smooth, mfcc = self.remove_silences(i, ema_VT_smooth, mfcc)
-            ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i]), ema_VT)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]), ema_VT_smooth)
-            self.list_EMA_traj.append(ema_VT_smooth)
-            self.list_MFCC_frames.append(mfcc)
-        self.calculate_norm_values()
-
-        for i in range(N):
-            ema_VT_smooth = np.load(
-                os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i] + ".npy"))
-            mfcc = np.load(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i] + ".npy"))
-            ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]),
-                    ema_VT_smooth_norma)
-        #  split_sentences(speaker)
-        get_fileset_names(self.speaker)
-
-
-def Preprocessing_general_mngu0(N_max, path_to_raw):
+def Preprocessing_general_mngu0(N_max, path_to_raw, pool=None, **kwargs):
     """
     :param N_max: #max of files to treat (0 to treat all files), useful for tests
+    :param pool: multiprocessing pool to send the utterances to (None to treat them one after the other)
+    :param kwargs: options of the preprocessing (see the Speaker class)
     """
-    speaker = Speaker_MNGU0(path_to_raw=path_to_raw, N_max=N_max)
-    speaker.Preprocessing_general_speaker()
+    speaker = Speaker_MNGU0(path_to_raw=path_to_raw, N_max=N_max, **kwargs)
+    speaker.Preprocessing_general_speaker(pool=pool)
     print("Done MNGU0 ")
 
 #Test :
@@ -15,7 +15,7 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 import scipy.signal
 import scipy.interpolate
-from Preprocessing.tools_preprocessing import get_fileset_names, get_delta_features, split_sentences
+from Preprocessing.tools_preprocessing import get_fileset_names, get_delta_features, split_sentences, read_est_file
 
 from os.path import dirname
 import numpy as np
@@ -25,6 +25,7 @@ import scipy.interpolate
 import librosa
 from Preprocessing.tools_preprocessing import get_speakers_per_corpus
 from Preprocessing.class_corpus import Speaker
+from Preprocessing.instrumentation import profiled
 import glob
 
 root_path = dirname(dirname(os.path.realpath(__file__)))
@@ -34,12 +35,13 @@ class Speaker_mocha(Speaker):
     class for the speaker of MNGU0, child of the Speaker class (in class_corpus.py),
     then inherits of some preprocessing scripts and attributes
     """
-    def __init__(self, sp, path_to_raw, N_max=0 ):
+    def __init__(self, sp, path_to_raw, N_max=0, **kwargs):
         """
         :param sp:  name of the speaker
         :param N_max:  # max of files we want to preprocess (0 is for All files), variable useful for test
+        :param kwargs: options of the preprocessing (see the Speaker class)
         """
-        super().__init__(sp)  # gets the attributes of the Speaker class
+        super().__init__(sp, **kwargs)  # gets the attributes of the Speaker class
         self.root_path = path_to_raw
         self.N_max = N_max
         self.path_files_treated = os.path.join(root_path, "Preprocessed_data", self.speaker)
@@ -47,7 +49,6 @@ class Speaker_mocha(Speaker):
 
         self.EMA_files = sorted([name for name in os.listdir(self.path_files_brutes) if "palate" not in name])
         self.EMA_files = sorted([name[:-4] for name in self.EMA_files if name.endswith('.ema')])
-        self.n_columns = 20
         self.wav_files = sorted([name[:-4] for name in os.listdir(self.path_files_brutes) if name.endswith('.wav')])
         self.sp_with_trans = ["fsew0", "msak0", "mjjn0", "ffes0"] #speakers for which we have transcription ( ie we can remove silence)
 
@@ -73,6 +74,7 @@ class Speaker_mocha(Speaker):
         for f in files:
             os.remove(f)
 
+    @profiled("read_ema")
     def read_ema_file(self,k):
         """
         read the ema file, first preprocessing,
@@ -81,31 +83,10 @@ class Speaker_mocha(Speaker):
         the velum is provided , ie for 4 speakers)
         """
         path_ema_file = os.path.join(self.path_files_brutes, self.EMA_files[k] + ".ema")
-        with open(path_ema_file, 'rb') as ema_annotation:
-            column_names = [0] * self.n_columns
-            for line in ema_annotation:
-                line = line.decode('latin-1').strip("\n")
-                if line == 'EST_Header_End':
-                    break
-                elif line.startswith('NumFrames'):
-                    n_frames = int(line.rsplit(' ', 1)[-1])
-                elif line.startswith('Channel_'):
-                    col_id, col_name = line.split(' ', 1)
-                    column_names[int(col_id.split('_', 1)[-1])] = col_name.replace(" ",
-                                                                                   "")  # v_x has sometimes a space
-            ema_data = np.fromfile(ema_annotation, "float32").reshape(n_frames, -1)
-            cols_index = [column_names.index(col) for col in self.articulators]
-            ema_data = ema_data[:, cols_index]
-            ema_data = ema_data / 100  # met en mm, initallement en 10^-1m
-            if np.isnan(ema_data).sum() != 0:
-                print("nombre de nan ", np.isnan(ema_data).sum())
-                # Build a cubic spline out of non-NaN values.
-                spline = scipy.interpolate.splrep(np.argwhere(~np.isnan(ema_data).ravel()),
-                                                  ema_data[~np.isnan(ema_data)], k=3)
-                # Interpolate missing values and replace them.
-                for j in np.argwhere(np.isnan(ema_data)).ravel():
-                    ema_data[j] = scipy.interpolate.splev(j, spline)
-            return ema_data
+        ema_data = read_est_file(path_ema_file, self.articulators)
+        ema_data = ema_data / 100  # met en mm, initallement en 10^-1m
+        ema_data = self.interpolate_missing_values(ema_data, k, self.articulators)
+        return ema_data
 
     def remove_silences(self,ema, mfcc, k):
         """
@@ -137,97 +118,76 @@ class Speaker_mocha(Speaker):
 
         return ema, mfcc
 
-    def from_wav_to_mfcc(self,wav):
+    def get_raw_files(self, i):
         """
-       :param wav: list of intensity points of the wav file
-       :return: the acoustic features( K,429); where K in the # of frames.
-       calculations of the mfcc with librosa , + Delta and DeltaDelta, + 10 context frames
-       # of acoustic features per frame: 13 ==> 13*3 = 39 ==> 39*11 = 429.
-       parameters for mfcc calculation are defined in class_corpus
-       """
-        mfcc = librosa.feature.mfcc(y=wav, sr=self.sampling_rate_wav, n_mfcc=self.n_coeff,
-                                       n_fft=self.frame_length, hop_length=self.hop_length
-                                       ).T
-        dyna_features = get_delta_features(mfcc)
-        dyna_features_2 = get_delta_features(dyna_features)
-        mfcc = np.concatenate((mfcc, dyna_features, dyna_features_2), axis=1)
-        padding = np.zeros((self.window, mfcc.shape[1]))
-        frames = np.concatenate([padding, mfcc, padding])
-        full_window = 1 + 2 * self.window
-        mfcc = np.concatenate([frames[j:j + len(mfcc)] for j in range(full_window)], axis=1)  # add context
-        return mfcc
-
-    def Preprocessing_general_speaker(self):
+        :param i: utterance index (wrt the list "EMA_files")
+        :return: list of the raw files read for this utterance : ema, wav, and annotation if the speaker has some
         """
-        Go through the sentences one by one.
-            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing values,
-        smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position per
-        frame mfcc, add it to the list of EMA traj for this speaker
-            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta+contextframes) ,
-        add it to the list of the MFCC FEATURES for this speaker.
-        Then calculate the normvalues based on the list of ema/mfcc data for this speaker
-        Finally : normalization and last smoothing of the trajectories.
-        Final data are in Preprocessed_data/speaker/ema_final.npy and  mfcc.npy
+        raw_files = [os.path.join(self.path_files_brutes, self.EMA_files[i] + ".ema"),
+                     os.path.join(self.path_files_brutes, self.wav_files[i] + ".wav")]
+        if self.speaker in self.sp_with_trans:
+            raw_files.append(os.path.join(self.path_files_brutes, self.wav_files[i] + ".lab"))
+        return raw_files
+
+    def preprocess_utterance(self, i):
+        """
+        first pass on one sentence :
+            - reads ema data and turn it to a (K,18) array where arti are in a precise order, interploate missing
+        values, smooth the trajectories, remove silences at the beginning and the end, undersample to have 1 position
+        per frame mfcc
+            - reads the wav file, calculate the associated acoustic features (mfcc+delta+ deltadelta)
+        :param i: utterance index (wrt the list "EMA_files")
+        :return: the smoothed ema trajectory and the mfcc frames, used to calculate the norm values
         """
-        self.create_missing_dir()
-
-        N = len(self.EMA_files)
-        if self.N_max != 0:
-            N = self.N_max
-
-        for i in range(N):
-            ema = self.read_ema_file(i)
-            ema_VT = self.add_vocal_tract(ema)
-            ema_VT_smooth = self.smooth_data(ema_VT)  # smooth for a better calculation of norm values
-            path_wav = os.path.join(self.path_files_brutes, self.wav_files[i] + '.wav')
-            wav, sr = librosa.load(path_wav, sr=None)
-            wav = 0.5 * wav / np.max(wav)
-            mfcc = self.from_wav_to_mfcc(wav)
-            ema_VT_smooth, mfcc = self.remove_silences(ema_VT_smooth, mfcc, i)
-            ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
-
-            ema_VT, rien = self.remove_silences(ema_VT, mfcc, i)
-            ema_VT, rien = self.synchro_ema_mfcc(ema_VT, mfcc)
-
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i]), ema_VT)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]), ema_VT_smooth)
-            self.list_EMA_traj.append(ema_VT_smooth)
-            self.list_MFCC_frames.append(mfcc)
-
-        self.calculate_norm_values()
-
-        for i in range(N):
-            ema_pas_smooth = np.load(
-                os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i] + ".npy"))
-            ema_VT_smooth = np.load(
-                os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i] + ".npy"))
-            mfcc = np.load(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i] + ".npy"))
-            ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
+        ema = self.read_ema_file(i)
+        ema_VT = self.add_vocal_tract(ema)
+        ema_VT_smooth = self.smooth_data(ema_VT)  # smooth for a better calculation of norm values
+        path_wav = os.path.join(self.path_files_brutes, self.wav_files[i] + '.wav')
+        wav = self.read_wav(path_wav)
+        wav = 0.5 * wav / np.max(wav)
+        mfcc = self.from_wav_to_mfcc(wav)
+        ema_VT_smooth, mfcc = self.remove_silences(ema_VT_smooth, mfcc, i)
+        ema_VT_smooth, mfcc = self.synchro_ema_mfcc(ema_VT_smooth, mfcc)
+
+        ema_VT, rien = self.remove_silences(ema_VT, mfcc, i)
+        ema_VT, rien = self.synchro_ema_mfcc(ema_VT, mfcc)
+
+        if self.keep_intermediate:
+            self.stage_utterance(i, ema_final=ema_VT_smooth, mfcc=mfcc, ema=ema_VT)
+        else:
+            self.stage_utterance(i, ema_final=ema_VT_smooth, mfcc=mfcc)
+        return ema_VT_smooth, mfcc
+
+    def normalize_utterance(self, i):
+        """
+        second pass on one sentence : normalization and last smoothing of the trajectories.
+        :param i: utterance index (wrt the list "EMA_files")
+        """
+        ema_VT_smooth, mfcc = self.load_staged_utterance(i, "ema_final", "mfcc")
+        if self.keep_intermediate:
+            ema_pas_smooth, = self.load_staged_utterance(i, "ema")
             ema_pas_smooth_norma, rien = self.normalize_sentence(i, ema_pas_smooth, mfcc)
-            new_sr = 1 / self.hop_time   # we did undersampling of ema traj for 1 point per frame mfcc
-                                        # so about 1 point every hoptime sec.
-            ema_VT_smooth_norma = self.smooth_data(ema_VT_smooth_norma, new_sr)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema", self.EMA_files[i]), ema_pas_smooth_norma)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "mfcc", self.EMA_files[i]), mfcc)
-            np.save(os.path.join(root_path, "Preprocessed_data", self.speaker, "ema_final", self.EMA_files[i]),
-                    ema_VT_smooth_norma)
-
-        #  split_sentences(speaker)   #possibility to cut to long sentences
-        get_fileset_names(self.speaker)
+            self.save_utterance(self.EMA_files[i], ema=ema_pas_smooth_norma)
+        ema_VT_smooth_norma, mfcc = self.normalize_sentence(i, ema_VT_smooth, mfcc)
+        new_sr = 1 / self.hop_time   # we did undersampling of ema traj for 1 point per frame mfcc
+                                    # so about 1 point every hoptime sec.
+        ema_VT_smooth_norma = self.smooth_data(ema_VT_smooth_norma, new_sr)
+        self.save_utterance(self.EMA_files[i], mfcc=mfcc, ema_final=ema_VT_smooth_norma)
 
 
-def Preprocessing_general_mocha(N_max, path_to_raw):
+def Preprocessing_general_mocha(N_max, path_to_raw, pool=None, **kwargs):
     """
     :param N_max: #max of files to treat (0 to treat all files), useful for test
-    go through all the speakers of Haskins
+    :param pool: multiprocessing pool to send the utterances to (None to treat them one after the other)
+    :param kwargs: options of the preprocessing (see the Speaker class)
+    go through all the speakers of mocha
     """
     corpus = 'mocha'
     speakers_mocha = get_speakers_per_corpus(corpus)
     for sp in speakers_mocha :
         print("In progress mocha ",sp)
-        speaker = Speaker_mocha(sp,path_to_raw=path_to_raw, N_max=N_max)
-        speaker.Preprocessing_general_speaker()
+        speaker = Speaker_mocha(sp,path_to_raw=path_to_raw, N_max=N_max, **kwargs)
+        speaker.Preprocessing_general_speaker(pool=pool)
         print("Done mocha ",sp)
 
 #Test :
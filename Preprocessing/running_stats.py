@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Running statistics used to calculate the norm values of a speaker without keeping all its ema trajectories
+    and mfcc frames in memory.
+    The statistics are updated with each utterance as soon as it is preprocessed, and the statistics of several
+    workers (or several shards of the utterances of the speaker) can be merged.
+    Used by the class Speaker (see class_corpus, calculate_norm_values()).
+    RunningMovingAverage is the incremental version of the moving average of the mean ema of the sentences, to add
+    new sentences to a speaker without recomputing the whole moving average.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+from Preprocessing.tools_preprocessing import window_mean, rolling_mean
+
+
+class RunningMeanStd():
+    """
+    Mean and variance per feature of all the frames seen so far (Welford algorithm, updated one block of frames
+    at a time with the formula of Chan et al. so that two RunningMeanStd can be merged).
+    """
+    def __init__(self, n_features):
+        """
+        :param n_features: number of features per frame
+        """
+        self.count = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)  # sum of the squared differences to the mean
+
+    def update(self, frames):
+        """
+        :param frames: nparray (K, n_features) new frames
+        """
+        other = RunningMeanStd(frames.shape[1])
+        other.count = len(frames)
+        other.mean = np.mean(frames, axis=0)
+        other.m2 = np.sum((frames - other.mean) ** 2, axis=0)
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        :param other: RunningMeanStd of other frames, added to the statistics of this one
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def std(self):
+        """
+        :return: standard deviation per feature of all the frames (same as np.std of the concatenated frames)
+        """
+        return np.sqrt(self.m2 / self.count)
+
+
+class NormStats():
+    """
+    Statistics of the utterances of one speaker needed to calculate its norm values :
+    - mean and std of all the ema frames
+    - mean of each ema trajectory (for the mean and the moving average of the ema)
+    - mean and std of each mfcc sentence (the norm values of the mfcc are the means of those)
+    - number of frames of each sentence (to create the shards, see shards.py)
+    The values per sentence are stored with the index of the utterance, so that the merge of the statistics of
+    shards does not depend on the order of the shards.
+    """
+    def __init__(self):
+        self.ema_frames = None
+        self.mean_ema_per_sentence = {}
+        self.mean_mfcc_per_sentence = {}
+        self.std_mfcc_per_sentence = {}
+        self.n_frames_per_sentence = {}
+
+    @classmethod
+    def from_utterance(cls, i, ema, mfcc):
+        """
+        :param i: index of the utterance
+        :param ema: smoothed ema trajectory of the utterance (K,18)
+        :param mfcc: mfcc frames of the utterance
+        :return: the NormStats of this utterance alone
+        """
+        stats = cls()
+        stats.update(i, ema, mfcc)
+        return stats
+
+    def update(self, i, ema, mfcc):
+        """
+        :param i: index of the utterance
+        :param ema: smoothed ema trajectory of the utterance (K,18)
+        :param mfcc: mfcc frames of the utterance
+        add the utterance to the statistics
+        """
+        if self.ema_frames is None:
+            self.ema_frames = RunningMeanStd(ema.shape[1])
+        self.ema_frames.update(ema)
+        self.mean_ema_per_sentence[i] = np.mean(ema, axis=0)
+        self.mean_mfcc_per_sentence[i] = np.mean(mfcc, axis=0)
+        self.std_mfcc_per_sentence[i] = np.std(mfcc, axis=0)
+        self.n_frames_per_sentence[i] = len(mfcc)
+
+    def merge(self, other):
+        """
+        :param other: NormStats of other utterances of the same speaker, added to this one
+        """
+        if other.ema_frames is None:
+            return
+        if self.ema_frames is None:
+            self.ema_frames = RunningMeanStd(len(other.ema_frames.mean))
+        self.ema_frames.merge(other.ema_frames)
+        self.mean_ema_per_sentence.update(other.mean_ema_per_sentence)
+        self.mean_mfcc_per_sentence.update(other.mean_mfcc_per_sentence)
+        self.std_mfcc_per_sentence.update(other.std_mfcc_per_sentence)
+        self.n_frames_per_sentence.update(other.n_frames_per_sentence)
+
+    def __len__(self):
+        """
+        :return: number of utterances in the statistics
+        """
+        return len(self.mean_ema_per_sentence)
+
+    def per_sentence(self, values):
+        """
+        :param values: one of the dictionaries of values per sentence
+        :return: nparray (n_sentences, n_features) of the values sorted by utterance index
+        """
+        return np.array([values[i] for i in sorted(values)])
+
+
+class RunningMovingAverage():
+    """
+    Moving average (see tools_preprocessing, rolling_mean) of values that are appended a few at a time, for instance
+    the mean ema of the new sentences of a speaker.
+    The averages that no longer depend on the end of the values (ie more than pad values before the end) are
+    calculated once when the values are appended, only the last pad averages are calculated again by get().
+    """
+    def __init__(self, pad=30):
+        """
+        :param pad: half size of the window
+        """
+        self.pad = pad
+        self.values = []
+        self.final_averages = []
+        self.n_final = 0  # number of averages that will not change anymore
+
+    def padded_rows(self, start, end):
+        """
+        :return: nparray of the rows start to end-1 of the values padded with "symmetric" (negative indexes are in
+        the left padding, indexes >= # of values in the right padding)
+        """
+        n = len(self.values)
+        rows = [self.values[r] if 0 <= r < n else self.values[-r - 1] if r < 0 else self.values[2 * n - 1 - r]
+                for r in range(start, end)]
+        return np.array(rows)
+
+    def append(self, values):
+        """
+        :param values: nparray (m, N) (or (N,) for one value) new values
+        """
+        self.values.extend(np.atleast_2d(values))
+        n = len(self.values)
+        if n < self.pad:  # the left padding is not known yet
+            return
+        last_final = n - self.pad  # the window of this average ends with the last value
+        if last_final >= self.n_final:
+            rows = self.padded_rows(self.n_final - self.pad, last_final + self.pad)
+            self.final_averages.append(window_mean(rows, 2 * self.pad))
+            self.n_final = last_final + 1
+
+    def get(self):
+        """
+        :return: nparray (n, N), the moving average of all the values appended so far (same as rolling_mean)
+        """
+        n = len(self.values)
+        if n < self.pad:
+            return rolling_mean(np.array(self.values), pad=self.pad)
+        last_averages = window_mean(self.padded_rows(self.n_final - self.pad, n + self.pad - 1), 2 * self.pad)
+        return np.concatenate(self.final_averages + [last_averages])
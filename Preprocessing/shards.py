@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Packed format of the preprocessed data : instead of one npy file per sentence, the sentences of a speaker are
+    concatenated in one array per stream (Preprocessed_data/speaker/mfcc.npy and ema_final.npy), with an index
+    (Preprocessed_data/speaker/mfcc_index.json and ema_final_index.json) giving for each sentence its first frame and
+    its number of frames.
+    The arrays are memory-mapped when they are read, so that loading an epoch only reads the frames of the sentences
+    and does not open one file per sentence.
+    The index is written once the array is complete : a shard without index is not used.
+    This script also converts the per-file data already preprocessed (and writes their manifest, see manifest.py) :
+    python shards.py --speakers ["F01","fsew0"]
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import argparse
+import json
+import numpy as np
+from functools import lru_cache
+
+shard_streams = ["mfcc", "ema_final"]
+
+
+def get_shard_paths(path_speaker, stream):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker (Preprocessed_data/speaker)
+    :param stream: "mfcc" or "ema_final"
+    :return: path of the packed array and path of its index
+    """
+    return os.path.join(path_speaker, stream + ".npy"), os.path.join(path_speaker, stream + "_index.json")
+
+
+def get_shard_index(names, lengths):
+    """
+    :param names: names of the sentences, in the order they are packed
+    :param lengths: number of frames of each sentence
+    :return: dictionary name => [first frame, number of frames], and the total number of frames
+    """
+    starts = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+    index = {name: [int(start), int(length)] for name, start, length in zip(names, starts, lengths)}
+    return index, int(starts[-1])
+
+
+def remove_shard(path_speaker, stream):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param stream: "mfcc" or "ema_final"
+    delete the packed array and its index if they exist (the index first, so that the shard is no longer used)
+    """
+    for path in reversed(get_shard_paths(path_speaker, stream)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def create_shard(path_speaker, stream, names, lengths, n_features, dtype=np.float64, keep_existing=False):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param stream: "mfcc" or "ema_final"
+    :param names: names of the sentences, in the order they are packed
+    :param lengths: number of frames of each sentence
+    :param n_features: number of features per frame
+    :param dtype: type of the data
+    :param keep_existing: whether to keep the packed array if it already exists with the same shape and type (to
+    finish the shard of an interrupted run)
+    :return: the index of the shard (see get_shard_index)
+    create the packed array (not filled) of the stream, the sentences are then written with write_to_shard and the
+    index with write_shard_index once they are all written
+    """
+    index, n_frames = get_shard_index(names, lengths)
+    path_shard, path_index = get_shard_paths(path_speaker, stream)
+    if keep_existing and not os.path.exists(path_index) and os.path.exists(path_shard):
+        if read_npy_header(path_shard) == ((n_frames, n_features), np.dtype(dtype)):
+            return index
+    remove_shard(path_speaker, stream)
+    shard = np.lib.format.open_memmap(path_shard, mode="w+", dtype=dtype, shape=(n_frames, n_features))
+    del shard
+    return index
+
+
+def write_to_shard(path_speaker, stream, start, array):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param stream: "mfcc" or "ema_final"
+    :param start: first frame of the sentence in the shard
+    :param array: frames of the sentence
+    the sentences can be written by several processes at the same time, they do not overlap
+    """
+    path_shard, path_index = get_shard_paths(path_speaker, stream)
+    shard = np.load(path_shard, mmap_mode="r+")
+    shard[start:start + len(array)] = array
+    shard.flush()
+    del shard
+
+
+def write_shard_index(path_speaker, stream, index):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param stream: "mfcc" or "ema_final"
+    :param index: index of the shard (see get_shard_index)
+    """
+    path_shard, path_index = get_shard_paths(path_speaker, stream)
+    path_tmp = path_index + ".tmp"
+    with open(path_tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(path_tmp, path_index)
+
+
+def read_npy_header(path):
+    """
+    :param path: path of a npy file
+    :return: shape and type of the array, without reading the data
+    """
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype
+
+
+def pack_stream(path_speaker, stream):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param stream: "mfcc" or "ema_final"
+    :return: number of sentences packed
+    converts the npy files of the folder Preprocessed_data/speaker/stream into the packed array and its index
+    """
+    path_folder = os.path.join(path_speaker, stream)
+    names = sorted([name[:-4] for name in os.listdir(path_folder) if name.endswith('.npy')])
+    if len(names) == 0:
+        return 0
+    headers = [read_npy_header(os.path.join(path_folder, name + ".npy")) for name in names]
+    lengths = [shape[0] for shape, dtype in headers]
+    shape, dtype = headers[0]
+    index = create_shard(path_speaker, stream, names, lengths, shape[1], dtype)
+    path_shard, path_index = get_shard_paths(path_speaker, stream)
+    shard = np.load(path_shard, mmap_mode="r+")
+    for name in names:
+        start, length = index[name]
+        shard[start:start + length] = np.load(os.path.join(path_folder, name + ".npy"))
+    shard.flush()
+    del shard
+    write_shard_index(path_speaker, stream, index)
+    return len(names)
+
+
+@lru_cache(maxsize=None)
+def read_shard(path_speaker, stream):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param stream: "mfcc" or "ema_final"
+    :return: the packed array memory-mapped (read only) and its index, None if the stream is not packed.
+    Opened only once per process.
+    """
+    path_shard, path_index = get_shard_paths(path_speaker, stream)
+    if not os.path.exists(path_index):
+        return None
+    with open(path_index, "r") as f:
+        index = json.load(f)
+    return np.load(path_shard, mmap_mode="r"), index
+
+
+def load_sentence(path_speaker, stream, name):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :param stream: "mfcc" or "ema_final"
+    :param name: name of the sentence
+    :return: the frames of the sentence, read from the shard if the stream is packed, otherwise from its npy file
+    """
+    shard = read_shard(path_speaker, stream)
+    if shard is None:
+        return np.load(os.path.join(path_speaker, stream, name + ".npy"))
+    data, index = shard
+    start, length = index[name]
+    return np.array(data[start:start + length])
+
+
+def get_sentence_names(path_speaker):
+    """
+    :param path_speaker: directory of the preprocessed data of a speaker
+    :return: names of the preprocessed sentences of the speaker (from the index of ema_final if it is packed)
+    """
+    path_shard, path_index = get_shard_paths(path_speaker, "ema_final")
+    if os.path.exists(path_index):
+        with open(path_index, "r") as f:
+            return list(json.load(f))
+    return [name[:-4] for name in os.listdir(os.path.join(path_speaker, "ema_final")) if name.endswith('.npy')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts the preprocessed data of the speakers to the packed format')
+    parser.add_argument('--speakers', type=str, default="all",
+                        help='list of the speakers to convert, by default all the speakers in Preprocessed_data')
+    parser.add_argument('--remove_files', action='store_true',
+                        help='delete the npy files of the sentences once they are packed')
+    args = parser.parse_args()
+
+    path_preprocessed = os.path.join(parentdir, "Preprocessed_data")
+    if args.speakers == "all":
+        speakers = sorted([sp for sp in os.listdir(path_preprocessed)
+                           if os.path.isdir(os.path.join(path_preprocessed, sp, "ema_final"))])
+    else:
+        speakers = args.speakers[1:-1].replace("'", "").replace('"', '').replace(' ', '').split(",")
+    from Preprocessing.manifest import build_manifest, write_manifest  # not at the top, manifest.py imports shards
+    for sp in speakers:
+        path_speaker = os.path.join(path_preprocessed, sp)
+        for stream in shard_streams:
+            n_sentences = pack_stream(path_speaker, stream)
+            print("{} {} : {} sentences packed".format(sp, stream, n_sentences))
+            if args.remove_files and n_sentences > 0:
+                for name in os.listdir(os.path.join(path_speaker, stream)):
+                    if name.endswith('.npy'):
+                        os.remove(os.path.join(path_speaker, stream, name))
+        write_manifest(path_speaker, build_manifest(path_speaker, sp))  # the offsets of the sentences in the shards
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Information about the speakers shared by the preprocessing and the training : corpus, category and available
+    articulators of each speaker (from Preprocessing/articulators_per_speaker.csv), articulators of each category
+    (from Training/categ_of_speakers.json) and sampling parameters of each corpus.
+    The files are read only once per process, and the articulators are also given as boolean masks and index arrays
+    (read only, since they are shared by all the calls).
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import csv
+import json
+import numpy as np
+from functools import lru_cache
+
+articulators = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y',
+                'ul_x', 'ul_y', 'll_x', 'll_y', 'la', 'lp', 'ttcl', 'tbcl', 'v_x', 'v_y']
+
+sampling_parameters_per_corpus = {
+    "mocha": {"sampling_rate_wav": 16000, "sampling_rate_ema": 500, "cutoff": 10},
+    "MNGU0": {"sampling_rate_wav": 16000, "sampling_rate_ema": 200, "cutoff": 10},
+    "usc": {"sampling_rate_wav": 20000, "sampling_rate_ema": 100, "cutoff": 10},
+    "Haskins": {"sampling_rate_wav": 44100, "sampling_rate_ema": 100, "cutoff": 20}}
+
+
+def read_only(array):
+    """
+    :param array: nparray
+    :return: the same array, that can not be modified anymore
+    """
+    array.setflags(write=False)
+    return array
+
+
+def get_masks(arti_to_consider):
+    """
+    :param arti_to_consider: list of 18 "0"/"1", "1" if the articulator is available
+    :return: dictionary with the boolean mask of the available articulators ("arti_mask"), the indexes of the
+    available articulators ("arti_indexes") and of the unavailable ones ("idx_to_ignore")
+    """
+    arti_mask = np.array([n == "1" for n in arti_to_consider])
+    return {"arti_mask": read_only(arti_mask),
+            "arti_indexes": read_only(np.flatnonzero(arti_mask)),
+            "idx_to_ignore": read_only(np.flatnonzero(~arti_mask))}
+
+
+@lru_cache(maxsize=None)
+def get_speakers_info():
+    """
+    :return: dictionary speaker => information about the speaker : "corpus", "category", "arti_to_consider" (list of 18
+    "0"/"1" of the csv file, "1" if the articulator is available), and its masks (see get_masks)
+    """
+    speakers_info = dict()
+    with open(os.path.join(currentdir, "articulators_per_speaker.csv"), 'r', encoding="utf-8-sig") as csvFile:
+        reader = csv.reader(csvFile, delimiter=";")
+        next(reader)
+        for row in reader:
+            speakers_info[row[0]] = dict(corpus=row[20], category=row[19], arti_to_consider=row[1:19],
+                                         **get_masks(row[1:19]))
+    return speakers_info
+
+
+def get_speaker_info(speaker):
+    """
+    :param speaker: name of the speaker
+    :return: the information about the speaker (see get_speakers_info)
+    """
+    speakers_info = get_speakers_info()
+    if speaker not in speakers_info:
+        raise NameError("vous navez pas choisi un des speasker")
+    return speakers_info[speaker]
+
+
+@lru_cache(maxsize=None)
+def get_categories():
+    """
+    :return: dictionary category => {"sp" : list of the speakers of the category, "arti" : list of 18 "0"/"1" of the
+    articulators used for the training of this category} as in categ_of_speakers.json, and the masks of "arti" (see
+    get_masks)
+    """
+    with open(os.path.join(parentdir, "Training", "categ_of_speakers.json"), 'r') as fp:
+        categ_of_speakers = json.load(fp)
+    for categ in categ_of_speakers:
+        categ_of_speakers[categ].update(get_masks(categ_of_speakers[categ]["arti"]))
+    return categ_of_speakers
+
+
+def get_common_articulators(speakers):
+    """
+    :param speakers: list of speakers (the names that are not speakers are ignored)
+    :return: list of the indexes of the articulators available for all the speakers
+    """
+    speakers_info = get_speakers_info()
+    common = np.ones(len(articulators), dtype=bool)
+    for speaker in speakers:
+        if speaker in speakers_info:
+            common &= speakers_info[speaker]["arti_mask"]
+    return np.flatnonzero(common).tolist()
+
+
+def get_sampling_parameters(corpus):
+    """
+    :param corpus: name of the corpus
+    :return: dictionary with the sampling rate of the wav ("sampling_rate_wav"), of the ema ("sampling_rate_ema"), and
+    the cutoff of the low pass filter of the ema ("cutoff")
+    """
+    return sampling_parameters_per_corpus[corpus]
@@ -19,28 +19,74 @@ from random import shuffle
 import csv
 import json
 import scipy
+import scipy.interpolate
+import scipy.ndimage
+import scipy.signal
+import scipy.fft
+import scipy.io.wavfile
+import hashlib
+import wave
+import librosa
+import soundfile
+from functools import lru_cache
+from fractions import Fraction
+from Preprocessing.shards import get_sentence_names
 
 root_folder = os.path.dirname(os.getcwd())
 
 
-def get_delta_features(array, window=5):
+def get_delta_features(array, window=5, lengths=None):
     """
-    :param array: nparray (K,N) N features per frame, K frames.
+    :param array: nparray (K,N) N features per frame, K frames. Or a batch of utterances nparray (B,K,N) padded to the
+    same number of frames K.
     :param window: size of the window to calculate the average speed of the features
-    :return: the speed of each feature wrt 5 future and 5 past frames
-
-    """
-    all_diff = []
-    for lag in range(1, window + 1):
-        padding = np.ones((lag, array.shape[1]))
-        past = np.concatenate([padding * array[0], array[:-lag]])
-        future = np.concatenate([array[lag:], padding * array[-1]])
-        all_diff.append(future - past)
-    tempo =np.array([all_diff[lag] * lag for lag in range(window)])
-    norm = 2 * np.sum(i ** 2 for i in range(1, window + 1))
-    delta_features = np.sum(tempo,axis=0)/norm
+    :param lengths: for a batch, list of the B numbers of frames of the utterances (None if they all have K frames)
+    :return: the speed of each feature wrt 5 future and 5 past frames, same shape as array (0 after the end of
+    each utterance of the batch)
+    The speed is a fixed filter over the input padded with its first and last frames :
+    sum_lag (lag-1)*(x[k+lag]-x[k-lag]) / (2*sum_lag lag**2) for lag in 1..window. The weight of each lag is lag-1
+    to give the same features as the previous implementation (with which the models were trained).
+    The padding is done once and the lags are accumulated in place in the same order, so the result is identical.
+    """
+    array = np.asarray(array, dtype=np.float64)
+    n_frames = array.shape[-2]
+    padded = np.empty(array.shape[:-2] + (n_frames + 2 * window, array.shape[-1]))
+    padded[..., :window, :] = array[..., :1, :]
+    padded[..., window:window + n_frames, :] = array
+    padded[..., window + n_frames:, :] = array[..., -1:, :]
+    if lengths is not None:
+        for b, length in enumerate(lengths):  # repeat the last frame of each utterance instead of the padding
+            padded[b, window + length:] = array[b, length - 1]
+    delta_features = np.zeros(array.shape)
+    diff = np.empty(array.shape)
+    for lag in range(2, window + 1):  # the weight of the lag 1 is 0
+        np.subtract(padded[..., window + lag:window + lag + n_frames, :],
+                    padded[..., window - lag:window - lag + n_frames, :], out=diff)
+        diff *= lag - 1
+        delta_features += diff
+    norm = 2 * sum(i ** 2 for i in range(1, window + 1))
+    delta_features /= norm
+    if lengths is not None:
+        for b, length in enumerate(lengths):
+            delta_features[b, length:] = 0
     return delta_features
 
+
+def add_context_frames(mfcc, window=5):
+    """
+    :param mfcc: nparray (K,N) N features per frame (usually 39 : mfcc + delta + deltadelta), K frames.
+    :param window: number of context frames on each side of the frame
+    :return: nparray (K,N*(2*window+1)), for each frame the features of the window previous frames, the frame and the
+    window next frames (zero padding at the extremities).
+    The result is a strided view on the padded features (no copy of the 11 shifted frames), do not write into it.
+    """
+    padding = np.zeros((window, mfcc.shape[1]), dtype=mfcc.dtype)
+    frames = np.concatenate([padding, mfcc, padding])
+    full_window = 1 + 2 * window
+    return np.lib.stride_tricks.as_strided(frames, shape=(len(mfcc), full_window * mfcc.shape[1]),
+                                           strides=(frames.strides[0], frames.strides[1]))
+
+
 def get_speakers_per_corpus(corpus):
     """
     :param corpus: name of the corpus
@@ -70,7 +116,7 @@ def get_fileset_names(speaker):
     """
     donnees_path = os.path.join(root_folder, "Preprocessed_data")
     files_path = os.path.join(donnees_path,speaker)
-    EMA_files_names = [name[:-4] for name in os.listdir(os.path.join(files_path,"ema_final")) if name.endswith('.npy') ]
+    EMA_files_names = get_sentence_names(files_path)  # one npy file per sentence, or index of the shard
     N = len(EMA_files_names)
     shuffle(EMA_files_names)
     pourcent_train = 0.7
@@ -168,6 +214,411 @@ def low_pass_filter_weight(cut_off,sampling_rate):
     return h
 
 
+@lru_cache(maxsize=None)
+def get_low_pass_filter(cut_off, sampling_rate):
+    """
+    :param cut_off: cutoff of the filter
+    :param sampling_rate: sampling rate of the data
+    :return: the weights of the lowpass filter (see low_pass_filter_weight), computed only once per
+    (cut_off, sampling_rate). The array is shared by all the calls so it is read only.
+    """
+    weights = low_pass_filter_weight(cut_off=cut_off, sampling_rate=sampling_rate)
+    weights.setflags(write=False)
+    return weights
+
+
+def low_pass_filter(data, cut_off, sampling_rate, pad=30, fft_threshold=10000):
+    """
+    :param data: nparray (K,N), N trajectories of K points
+    :param cut_off: cutoff of the filter
+    :param sampling_rate: sampling rate of the trajectories
+    :param pad: number of points added (symmetric padding) at both extremities before the filtering
+    :param fft_threshold: above this number of points the convolution is done with fft
+    :return: the N trajectories filtered, (K,N)
+    all the trajectories are filtered at once along the time axis, the result is the same as the
+    np.convolve(mode="same") of each padded trajectory.
+    """
+    weights = get_low_pass_filter(cut_off, sampling_rate)
+    data_padded = np.pad(data, ((pad, pad), (0, 0)), "symmetric")
+    if len(data_padded) > fft_threshold:
+        data_filtered = scipy.signal.fftconvolve(data_padded, weights[:, np.newaxis], mode="same", axes=0)
+    else:
+        data_filtered = scipy.ndimage.convolve1d(data_padded, weights, axis=0, mode="constant")
+    return data_filtered[pad:-pad, :]
+
+
+def resample_wav(wav, sampling_rate, new_sampling_rate):
+    """
+    :param wav: 1D nparray, the intensity points of the wav
+    :param sampling_rate: sampling rate of the wav
+    :param new_sampling_rate: sampling rate wanted
+    :return: the wav resampled at new_sampling_rate (float32), with the resampling of librosa.load (the same values
+    as librosa.load, without writing and decoding the wav again)
+    """
+    wav = np.asarray(wav, dtype=np.float32)
+    if sampling_rate == new_sampling_rate:
+        return wav
+    return librosa.resample(wav, orig_sr=sampling_rate, target_sr=new_sampling_rate)
+
+
+@lru_cache(maxsize=None)
+def get_mfcc_filters(sampling_rate, n_fft, n_mfcc, n_mels=128):
+    """
+    :param sampling_rate: sampling rate of the wav
+    :param n_fft: size of the frames (and of the fft)
+    :param n_mfcc: number of mfcc
+    :param n_mels: number of mel bands
+    :return: the hann window of the frames (n_fft,), the transposed mel basis (1+n_fft/2, n_mels) and the transposed
+    orthonormal DCT-II matrix (n_mels, n_mfcc), as used by librosa.feature.mfcc. Computed only once per configuration,
+    the arrays are shared by all the calls so they are read only.
+    """
+    window = scipy.signal.get_window("hann", n_fft, fftbins=True).astype(np.float32)
+    mel_basis = librosa.filters.mel(sr=sampling_rate, n_fft=n_fft, n_mels=n_mels).astype(np.float32)
+    dct = scipy.fft.dct(np.eye(n_mels), type=2, norm="ortho", axis=0)[:n_mfcc].astype(np.float32)
+    filters = (window, np.ascontiguousarray(mel_basis.T), np.ascontiguousarray(dct.T))
+    for array in filters:
+        array.setflags(write=False)
+    return filters
+
+
+def get_mfcc_batches(wavs, sampling_rate, n_mfcc, n_fft, hop_length, n_mels=128, top_db=80., max_batch_frames=2000):
+    """
+    :param wavs: list of wav (1D nparray) sampled at sampling_rate
+    :param sampling_rate: sampling rate of the wav
+    :param n_mfcc: number of mfcc
+    :param n_fft: size of the frames (and of the fft)
+    :param hop_length: number of points between two frames
+    :param n_mels: number of mel bands
+    :param top_db: the log mel spectrogram of each wav is clipped at its max - top_db
+    :param max_batch_frames: max number of frames (# of wav * # of frames of the longest) of a batch
+    :return: generator of (indexes, mfcc, lengths) : indexes of the wav of the batch (wrt wavs), nparray (B,K,n_mfcc)
+    of their mfcc padded to the same number of frames K and list of their numbers of frames.
+    Same mfcc as librosa.feature.mfcc with pad_mode="reflect" (centered frames with "reflect" padding, power
+    spectrogram, mel bands, power_to_db, DCT-II), to float32 precision, but the wav are sorted by length and each
+    batch is done with a few large matrix operations (one fft and two matrix products), with the filters of
+    get_mfcc_filters. "reflect" is the padding of librosa 0.6.3, with which the models were trained. The default
+    padding of the newer versions of librosa ("constant") gives other mfcc : the first and last 2 frames differ by up
+    to about 20, and since the log mel spectrogram is clipped wrt its max (top_db), the other frames can also differ
+    (about 0.5).
+    """
+    window, mel_basis, dct = get_mfcc_filters(sampling_rate, n_fft, n_mfcc, n_mels)
+    pad = n_fft // 2
+    order = sorted(range(len(wavs)), key=lambda k: len(wavs[k]))
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and (end - start + 1) * (1 + len(wavs[order[end]]) // hop_length) <= max_batch_frames:
+            end += 1
+        indexes = order[start:end]
+        lengths = [1 + len(wavs[k]) // hop_length for k in indexes]
+        n_frames_max = lengths[-1]
+        padded = np.zeros((len(indexes), len(wavs[indexes[-1]]) + 2 * pad), dtype=np.float32)
+        for b, k in enumerate(indexes):
+            padded[b, :len(wavs[k]) + 2 * pad] = np.pad(wavs[k], pad, "reflect")
+        frames = np.lib.stride_tricks.as_strided(padded, shape=(len(indexes), n_frames_max, n_fft),
+                                                 strides=(padded.strides[0], hop_length * padded.strides[1],
+                                                          padded.strides[1]))
+        spectrum = scipy.fft.rfft(frames * window, axis=-1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        log_mel = 10 * np.log10(np.maximum(power @ mel_basis, 1e-10))
+        for b, length in enumerate(lengths):  # clipped wrt the max of the frames of the wav, not of the padding
+            np.maximum(log_mel[b], log_mel[b, :length].max() - top_db, out=log_mel[b])
+        yield indexes, log_mel @ dct, lengths
+        start = end
+
+
+def get_mfcc(wavs, sampling_rate, n_mfcc, n_fft, hop_length, **kwargs):
+    """
+    :param wavs: list of wav (1D nparray) sampled at sampling_rate
+    :param kwargs: other parameters of get_mfcc_batches
+    :return: list of the mfcc (K,n_mfcc) of the wav (float32, same as librosa.feature.mfcc(..., pad_mode="reflect").T),
+    computed by batches of wav of similar lengths (see get_mfcc_batches)
+    """
+    all_mfcc = [None] * len(wavs)
+    for indexes, mfcc, lengths in get_mfcc_batches(wavs, sampling_rate, n_mfcc, n_fft, hop_length, **kwargs):
+        for b, k in enumerate(indexes):
+            all_mfcc[k] = mfcc[b, :lengths[b]]
+    return all_mfcc
+
+
+def get_acoustic_features(wavs, sampling_rate, n_mfcc, n_fft, hop_length, window=5, **kwargs):
+    """
+    :param wavs: list of wav (1D nparray) sampled at sampling_rate
+    :param window: window of the delta features (see get_delta_features)
+    :param kwargs: other parameters of get_mfcc_batches
+    :return: list of the acoustic features (K,3*n_mfcc) of the wav : mfcc + delta + deltadelta, as in
+    Speaker.from_wav_to_mfcc. The delta features are calculated on the whole batch at once.
+    """
+    all_features = [None] * len(wavs)
+    for indexes, mfcc, lengths in get_mfcc_batches(wavs, sampling_rate, n_mfcc, n_fft, hop_length, **kwargs):
+        delta = get_delta_features(mfcc, window=window, lengths=lengths)
+        delta_delta = get_delta_features(delta, window=window, lengths=lengths)
+        features = np.concatenate((mfcc, delta, delta_delta), axis=2)
+        for b, k in enumerate(indexes):
+            all_features[k] = features[b, :lengths[b]]
+    return all_features
+
+
+def resample_trajectories(data, n_points, method="fft", up=None, down=None):
+    """
+    :param data: nparray (K,N), N trajectories of K points
+    :param n_points: number of points wanted
+    :param method: "fft" (scipy.signal.resample, fft of the whole trajectories), "polyphase" (polyphase filter with
+    the ratio up/down, scipy.signal.resample_poly) or "linear" (linear interpolation at the time of each new point)
+    :param up: for "polyphase", the ratio of the sampling rates (new/initial) is up/down. By default n_points/K
+    :param down: see up
+    :return: the N trajectories resampled, (n_points,N). All the trajectories are resampled at once. The new point k
+    is at the time k*K/n_points of the initial points, as for scipy.signal.resample.
+    For "polyphase" the result is cut or completed with its last point to have exactly n_points (the ratio of the
+    sampling rates does not always give n_points, since the ema and the mfcc are not cut at the same time).
+    The time of the fft depends on the prime factors of K, the other methods are linear in K.
+    """
+    if method == "fft":
+        return scipy.signal.resample(data, num=n_points)
+    elif method == "polyphase":
+        if up is None:
+            ratio = Fraction(n_points, len(data)).limit_denominator(100)
+            up, down = ratio.numerator, ratio.denominator
+        resampled = scipy.signal.resample_poly(data, up, down, axis=0, padtype="line")
+        if len(resampled) >= n_points:
+            return resampled[:n_points]
+        return np.pad(resampled, ((0, n_points - len(resampled)), (0, 0)), "edge")
+    elif method == "linear":
+        times = np.arange(n_points) * (len(data) / n_points)
+        index = np.minimum(times.astype(int), len(data) - 1)
+        next_index = np.minimum(index + 1, len(data) - 1)
+        weight = (times - index)[:, np.newaxis]
+        return data[index] * (1 - weight) + data[next_index] * weight
+    else:
+        raise NameError("synchronization method unknown : {}".format(method))
+
+
+def read_wav(path):
+    """
+    :param path: path of the wav file
+    :return: the intensity points of the wav (float32 in [-1,1], mean of the channels), and its sampling rate.
+    The PCM wav are decoded with scipy (same values as librosa.load), the other formats with librosa.
+    """
+    try:
+        sampling_rate, wav = scipy.io.wavfile.read(path)
+    except ValueError:  # format not read by scipy
+        wav, sampling_rate = librosa.load(path, sr=None, mono=True)
+        return wav, sampling_rate
+    if wav.dtype == np.uint8:
+        wav = (wav.astype(np.float32) - 128) / 128
+    elif wav.dtype.kind == "i":
+        wav = wav.astype(np.float32) / np.float32(2 ** (8 * wav.dtype.itemsize - 1))
+    else:
+        wav = wav.astype(np.float32)
+    if wav.ndim > 1:
+        wav = np.mean(wav, axis=1)
+    return wav, sampling_rate
+
+
+def write_wav(path, wav, sampling_rate):
+    """
+    :param path: path of the wav file
+    :param wav: 1D nparray, the intensity points of the wav
+    :param sampling_rate: sampling rate of the wav
+    writes the wav in 32 bits float, as librosa.output.write_wav did (removed in librosa 0.8). Only used for the
+    intermediate files (see keep_intermediate)
+    """
+    soundfile.write(path, np.asarray(wav, dtype=np.float32), sampling_rate, subtype="FLOAT")
+
+
+def get_file_digest(path):
+    """
+    :param path: path of a file
+    :return: the sha1 of the content of the file
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_wav_cache_key(digest, sampling_rate):
+    """
+    :param digest: sha1 of the content of the wav file (see get_file_digest)
+    :param sampling_rate: sampling rate wanted
+    :return: the name of the resampled wav in the cache of load_wav, it also depends on the version of librosa that
+    resamples the wav
+    """
+    return hashlib.sha1("{} {} librosa {}".format(digest, sampling_rate, librosa.__version__).encode()).hexdigest()
+
+
+def load_wav(path, sampling_rate, cache_dir=None):
+    """
+    :param path: path of the wav file
+    :param sampling_rate: sampling rate wanted
+    :param cache_dir: directory of the cache of the resampled wav, None to not use a cache
+    :return: the wav resampled at sampling_rate (see read_wav and resample_wav), float32. Replaces
+    librosa.load(path, sr=sampling_rate) with the same values.
+    With a cache the resampled wav is saved in cache_dir with a key that depends on the content of the file and on
+    sampling_rate (see get_wav_cache_key), so that it is not decoded and resampled again when the preprocessing is
+    launched again. The wav that are already at sampling_rate are not cached (reading them is faster than the key).
+    """
+    if cache_dir is not None:
+        try:
+            with wave.open(path, "rb") as f:
+                if f.getframerate() == sampling_rate:
+                    cache_dir = None
+        except (wave.Error, EOFError):  # not a PCM wav, the sampling rate is known once decoded
+            pass
+    if cache_dir is not None:
+        path_cache = os.path.join(cache_dir, get_wav_cache_key(get_file_digest(path), sampling_rate) + ".npy")
+        if os.path.exists(path_cache):
+            return np.load(path_cache)
+    wav, sr = read_wav(path)
+    wav = resample_wav(wav, sr, sampling_rate)
+    if cache_dir is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        save_atomic(path_cache, wav)
+    return wav
+
+
+def save_atomic(path, array):
+    """
+    :param path: path of the npy file
+    :param array: array to save
+    the array is written in a temporary file (one per process, not ending with .npy) renamed once complete, so that
+    an interrupted run never leaves an incomplete npy file
+    """
+    path_tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(path_tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(path_tmp, path)
+
+
+def read_est_header(est_file):
+    """
+    :param est_file: EST file (track, as the .ema files of mocha and MNGU0) opened in "rb"
+    :return: the number of frames, the tuple of the channel names (Channel_i, spaces removed), the size in bytes
+    of the header and whether the body is binary float32 (DataType binary, as in mocha and MNGU0) or text (DataType
+    ascii)
+    """
+    header = est_file.read(4096)
+    while b"EST_Header_End\n" not in header:
+        block = est_file.read(4096)
+        if not block:
+            raise ValueError("no EST_Header_End in {}".format(est_file.name))
+        header += block
+    header_size = header.index(b"EST_Header_End\n") + len(b"EST_Header_End\n")
+    channels = {}
+    binary = True
+    for line in header[:header_size].decode('latin-1').split("\n"):
+        if line.startswith('DataType'):
+            binary = line.rsplit(' ', 1)[-1] != "ascii"
+        elif line.startswith('NumFrames'):
+            n_frames = int(line.rsplit(' ', 1)[-1])
+        elif line.startswith('Channel_'):
+            col_id, col_name = line.split(' ', 1)
+            channels[int(col_id.split('_', 1)[-1])] = col_name.replace(" ", "")  # v_x has sometimes a space
+    return n_frames, tuple(channels[k] for k in sorted(channels)), header_size, binary
+
+
+@lru_cache(maxsize=None)
+def get_est_columns(header_channels, channels):
+    """
+    :param header_channels: tuple of the channel names in the header of the EST file
+    :param channels: tuple of the channel names wanted
+    :return: the index of the column of each wanted channel, as a slice when they are regularly spaced (the
+    columns are then a view of the data). All the files of a speaker have the same header, so it is computed once
+    per speaker (and per process)
+    """
+    columns = [header_channels.index(channel) for channel in channels]
+    steps = set(np.diff(columns))
+    if len(columns) > 1 and len(steps) == 1 and steps.pop() > 0:
+        return slice(columns[0], columns[-1] + 1, columns[1] - columns[0])
+    return columns
+
+
+def read_est_file(path, channels, mmap_size=1 << 24):
+    """
+    :param path: path of an EST file (binary float32 track as the .ema files of mocha and MNGU0, or ascii track)
+    :param channels: list of the channel names to read
+    :param mmap_size: size in bytes above which the body of a binary file is memory mapped instead of read
+    :return: nparray float32 (n_frames, len(channels)), the columns of the wanted channels
+    The header is parsed once, and only the wanted columns of the body are copied (the long recordings are memory
+    mapped so that the other columns are not in memory).
+    """
+    with open(path, 'rb') as est_file:
+        n_frames, header_channels, header_size, binary = read_est_header(est_file)
+        body_size = os.fstat(est_file.fileno()).st_size - header_size
+        width = body_size // (4 * n_frames)
+        if not binary:
+            est_file.seek(header_size)
+            body = np.loadtxt(est_file, dtype="float32", ndmin=2)
+        elif body_size > mmap_size:
+            body = np.memmap(est_file, dtype="float32", mode="r", offset=header_size, shape=(n_frames, width))
+        else:
+            est_file.seek(header_size)
+            body = np.fromfile(est_file, dtype="float32", count=n_frames * width).reshape(n_frames, width)
+        ema_data = np.array(body[:, get_est_columns(header_channels, tuple(channels))], order="C")
+    del body
+    return ema_data
+
+
+def fill_missing_values(ema, max_spline_gap=50):
+    """
+    :param ema: nparray (K, n_channels) ema trajectories with NaN where the sensor was lost
+    :param max_spline_gap: gaps longer than this number of points are filled by linear interpolation
+    :return: the trajectories with the NaN filled, and nparray (n_channels,) the number of values filled per channel
+    Each channel is filled independently : a cubic spline through the valid points of the channel is evaluated at
+    once on all its missing points. The long gaps and the gaps at the beginning or the end of the recording are
+    filled linearly (the last valid value is repeated at the extremities), since a spline diverges there.
+    """
+    missing = np.isnan(ema)
+    n_filled = missing.sum(axis=0)
+    if n_filled.sum() == 0:
+        return ema, n_filled
+    ema = ema.copy()
+    points = np.arange(len(ema))
+    for channel in np.flatnonzero(n_filled):
+        valid = ~missing[:, channel]
+        if not valid.any():  # the sensor was lost during the whole recording
+            ema[:, channel] = 0
+            continue
+        x, y = points[valid], ema[valid, channel]
+        to_fill = points[~valid]
+        filled = np.interp(to_fill, x, y)
+        gap_id = np.cumsum(np.diff(to_fill, prepend=-2) != 1) - 1  # consecutive missing points are in the same gap
+        gap_length = np.bincount(gap_id)[gap_id]
+        with_spline = (gap_length <= max_spline_gap) & (to_fill > x[0]) & (to_fill < x[-1])
+        if with_spline.any() and len(x) > 3:
+            spline = scipy.interpolate.splrep(x, y, k=3)
+            filled[with_spline] = scipy.interpolate.splev(to_fill[with_spline], spline)
+        ema[to_fill, channel] = filled
+    return ema, n_filled
+
+
+def window_mean(array, width):
+    """
+    :param array: nparray (n, N)
+    :param width: number of rows of the window
+    :return: nparray (n-width+1, N), row j is the mean of the rows j to j+width-1 of array
+    Calculated with a cumulative sum (centered on the mean of array to keep the precision for long arrays).
+    """
+    offset = np.mean(array, axis=0)
+    cumsum = np.zeros((len(array) + 1, array.shape[1]))
+    np.cumsum(array - offset, axis=0, out=cumsum[1:])
+    return (cumsum[width:] - cumsum[:-width]) / width + offset
+
+
+def rolling_mean(array, pad=30):
+    """
+    :param array: nparray (n, N), for instance the mean of each ema trajectory of a speaker (n sentences)
+    :param pad: half size of the window
+    :return: nparray (n, N), the moving average of array : row k is the mean of the rows k-pad to k+pad-1, array
+    being padded with "symmetric" at its extremities. To append rows without calculating it again on the whole array,
+    see running_stats.RunningMovingAverage
+    """
+    padded = np.pad(array, ((pad, pad), (0, 0)), "symmetric")
+    return window_mean(padded[:-1], 2 * pad)  # the last row of the padding is in none of the windows
+
+
 def split_sentences(speaker ,max_length = 300):
     """
     :param speaker:
@@ -177,6 +628,7 @@ def split_sentences(speaker ,max_length = 300):
     less than max_lenght points.
     Warning : when split the original file is removed
               ema files are split only in ema_final (those used for the training)
+              works on the npy files of the sentences, the shards (see shards.py) have to be packed after
     """
     Preprocessed_data_path = os.path.join(root_folder, "Preprocessed_data")
     file_names = os.listdir(os.path.join(Preprocessed_data_path, speaker, "ema_final"))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Throughput of the training in frames per second : one epoch on the training files of the speakers, with the
+    batches read and padded between the steps (the loop of train.py before the DataLoader, kept here as reference)
+    and with the DataLoader for several numbers of workers (see data_loading.py). The frames are the frames of the
+    sentences (without the padding).
+    Be in the folder "Training" and type :
+    python benchmark_training.py ["fsew0","msak0"] --num_workers [0,2,4]
+    With --length_buckets 10, the batches of the DataLoader are made of sentences of similar lengths.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import argparse
+import random
+import time
+import torch
+from Training.model import my_ac2art_model
+from Training.tools_learning import give_me_train_valid_test_filenames, load_np_ema_and_mfcc, criterion_both
+from Training.dataset_cache import DatasetCache
+from Training.data_loading import get_category_loader
+from Preprocessing.speaker_registry import get_categories
+from Preprocessing.manifest import get_sentence_info
+
+
+def train_step(model, optimizer, x, y, lengths, mask, categ):
+    """
+    :param model: the model
+    :param optimizer: its optimizer
+    :param x: padded mfcc of the batch
+    :param y: padded ema of the batch
+    :param lengths: lengths of the sentences of the batch
+    :param mask: mask of the padding
+    :param categ: category of the batch
+    one step of the training, as in train.py (with select_arti)
+    """
+    y_pred = model(x, lengths=lengths)
+    optimizer.zero_grad()
+    y_pred[:, :, get_categories()[categ]["idx_to_ignore"]] = 0
+    loss = criterion_both(y, y_pred, alpha=90, cuda_avail=False, device=None, mask=mask)
+    loss.backward()
+    optimizer.step()
+
+
+def epoch_reference(model, optimizer, files_per_categ, batch_size, dataset_cache):
+    """
+    one epoch with the batches read and padded between the steps
+    """
+    for categ in files_per_categ:
+        files_this_categ_courant = files_per_categ[categ]["train"]
+        random.shuffle(files_this_categ_courant)
+        while len(files_this_categ_courant) > 0:
+            x, y = load_np_ema_and_mfcc(files_this_categ_courant[:batch_size], dataset=dataset_cache)
+            files_this_categ_courant = files_this_categ_courant[batch_size:]
+            x, y, lengths, mask = model.prepare_batch(x, y)
+            train_step(model, optimizer, x, y, lengths, mask, categ)
+
+
+def epoch_loader(model, optimizer, loader):
+    """
+    one epoch with the batches of the DataLoader
+    """
+    for x, y, lengths, mask, categ in loader:
+        train_step(model, optimizer, x, y, lengths, mask, categ)
+
+
+def benchmark_training(speakers, num_workers=(0, 2, 4), batch_size=10, cache_memory=4., precision="float64",
+                       length_buckets=0):
+    """
+    :param speakers: list of the speakers to train on (all their sentences)
+    :param num_workers: numbers of workers of the DataLoader to compare with the reference
+    :param batch_size: number of sentences per batch
+    :param cache_memory: memory (GB) of the DatasetCache, 0 to read the files at each batch
+    :param precision: "float64" or "float32"
+    :param length_buckets: batches of sentences of similar lengths with the DataLoader (see CategoryBatchSampler), 0
+    for batches of sentences of any length as the reference
+    prints the time of the epoch and the frames per second of each way to prepare the batches
+    """
+    files_per_categ, files_for_test = give_me_train_valid_test_filenames(
+        train_on=speakers, test_on=speakers[0], config="indep", batch_size=batch_size)
+    n_frames = sum(get_sentence_info(f)["length"] for categ in files_per_categ
+                   for f in files_per_categ[categ]["train"])
+    model = my_ac2art_model(hidden_dim=300, input_dim=429, output_dim=18, batch_size=batch_size, cuda_avail=False,
+                            filter_type="fix", batch_norma=False, precision=precision)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+
+    def reference(dataset_cache):
+        epoch_reference(model, optimizer, files_per_categ, batch_size, dataset_cache)  # first epoch : cache filled
+        start = time.time()
+        epoch_reference(model, optimizer, files_per_categ, batch_size, dataset_cache)
+        return time.time() - start
+
+    def with_loader(dataset_cache, n):
+        loader = get_category_loader(files_per_categ, "train", batch_size, model, shuffle=True, num_workers=n,
+                                     dataset_cache=dataset_cache, length_buckets=length_buckets)
+        epoch_loader(model, optimizer, loader)  # first epoch : cache filled and workers started
+        start = time.time()
+        epoch_loader(model, optimizer, loader)
+        duration = time.time() - start
+        print("padding : {:.1f} % of the frames of the batches".format(100 * loader.batch_sampler.padding_ratio))
+        return duration
+
+    print("{} frames per epoch (the time is the one of the second epoch)".format(n_frames))
+    for name, n in [("reference", None)] + [("{} workers".format(n), n) for n in num_workers]:
+        dataset_cache = DatasetCache(memory_budget=cache_memory * 1e9)
+        duration = reference(dataset_cache) if n is None else with_loader(dataset_cache, n)
+        print("{:<12} {:8.2f} s per epoch | {:10.0f} frames/s".format(name, duration, n_frames / duration))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Frames per second of the training with and without DataLoader')
+    parser.add_argument('speakers', type=str,
+                        help='list of the speakers to train on')
+    parser.add_argument('--num_workers', type=str, default="[0,2,4]",
+                        help='list of the numbers of workers of the DataLoader')
+    parser.add_argument('--cache_memory', type=float, default=4.,
+                        help='memory (GB) for the sentences kept in memory, 0 to read the files at each batch')
+    parser.add_argument('--precision', type=str, default="float64", choices=["float64", "float32"],
+                        help='type of the model and of the batches')
+    parser.add_argument('--length_buckets', type=int, default=0,
+                        help='number of batches among which the sentences of similar lengths are grouped, 0 for '
+                             'batches of sentences of any length')
+    args = parser.parse_args()
+
+    speakers = args.speakers[1:-1].replace("'", "").replace('"', '').replace(' ', '').split(",")
+    num_workers = [int(n) for n in args.num_workers[1:-1].split(",")]
+    benchmark_training(speakers, num_workers=num_workers, cache_memory=args.cache_memory, precision=args.precision,
+                       length_buckets=args.length_buckets)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Batches of the training and of the validation with a torch DataLoader : the sentences are read and padded by
+    worker processes while the model trains on the previous batches (num_workers processes, each one preparing up to
+    prefetch_factor batches in advance).
+    The batches are made of sentences of the same category (same articulators available, needed to put the
+    unavailable articulators at 0 with select_arti), in the same order as the loop of train.py without DataLoader : the
+    categories one after the other, and the files of each category shuffled at each epoch (with the random module, in
+    the main process).
+    The sentences kept in memory (see dataset_cache.py) are read before the workers are started and shared with them,
+    the workers do not keep the other sentences (see init_worker).
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import random
+import multiprocessing
+import torch
+from torch.utils.data import Dataset, Sampler, DataLoader
+from Training.tools_learning import load_np_ema_and_mfcc, pad_batch
+from Preprocessing.manifest import get_sentence_info
+
+
+class SentenceDataset(Dataset):
+    """
+    Sentences served by name, with the category they are trained in
+    """
+    def __init__(self, categ_of_files, dataset_cache=None):
+        """
+        :param categ_of_files: dictionary name of the sentence => its category
+        :param dataset_cache: DatasetCache keeping the sentences in memory (see dataset_cache.py), None to read the
+        files for each batch
+        """
+        self.categ_of_files = categ_of_files
+        self.dataset_cache = dataset_cache
+
+    def __len__(self):
+        return len(self.categ_of_files)
+
+    def __getitem__(self, filename):
+        """
+        :param filename: name of the sentence
+        :return: its mfcc (K,429), its ema (K,18) and its category
+        """
+        x, y = load_np_ema_and_mfcc([filename], dataset=self.dataset_cache)
+        return x[0], y[0], self.categ_of_files[filename]
+
+
+def get_padding_ratio(batches):
+    """
+    :param batches: list of batches (list of names of sentences)
+    :return: part of the frames of the padded batches that are padding
+    """
+    n_frames, n_padded = 0, 0
+    for batch in batches:
+        lengths = [get_sentence_info(f)["length"] for f in batch]
+        n_frames += sum(lengths)
+        n_padded += max(lengths) * len(lengths)
+    return 1 - n_frames / n_padded if n_padded > 0 else 0.
+
+
+class CategoryBatchSampler(Sampler):
+    """
+    Batches of names of sentences of the same category
+    """
+    def __init__(self, files_per_categ, part, batch_size, shuffle=False, length_buckets=0):
+        """
+        :param files_per_categ: the files of each category (see give_me_train_valid_test_filenames)
+        :param part: "train" or "valid"
+        :param batch_size: number of sentences per batch
+        :param shuffle: whether to shuffle the files of each category at each epoch
+        :param length_buckets: number of batches of each pool of sentences sorted by length, 0 for batches of sentences
+        of any length
+        """
+        self.files_per_categ = files_per_categ
+        self.part = part
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.length_buckets = length_buckets
+        self.padding_ratio = None  # padding of the batches of the last epoch (see get_padding_ratio)
+
+    def get_batches_categ(self, files_this_categ):
+        """
+        :param files_this_categ: files of a category, in the order of the epoch
+        :return: the batches of the category
+        """
+        if self.length_buckets == 0:
+            return [files_this_categ[k:k + self.batch_size] for k in range(0, len(files_this_categ), self.batch_size)]
+        pool_size = self.length_buckets * self.batch_size
+        batches = []
+        for k in range(0, len(files_this_categ), pool_size):
+            pool = sorted(files_this_categ[k:k + pool_size], key=lambda f: get_sentence_info(f)["length"])
+            batches += [pool[j:j + self.batch_size] for j in range(0, len(pool), self.batch_size)]
+        if self.shuffle:
+            random.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        batches = []
+        for categ in self.files_per_categ:
+            files_this_categ = self.files_per_categ[categ][self.part]
+            if self.shuffle:
+                random.shuffle(files_this_categ)
+            batches += self.get_batches_categ(files_this_categ)
+        self.padding_ratio = get_padding_ratio(batches)
+        return iter(batches)
+
+    def __len__(self):
+        return sum((len(files[self.part]) + self.batch_size - 1) // self.batch_size
+                   for files in self.files_per_categ.values())
+
+
+class PadCollate():
+    """
+    Pads the sentences of a batch (see pad_batch), in the workers
+    """
+    def __init__(self, input_dim, output_dim, dtype):
+        """
+        :param input_dim: number of acoustic features per frame
+        :param output_dim: number of articulatory trajectories
+        :param dtype: torch type of the batches
+        """
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        self.dtype = dtype
+
+    def __call__(self, batch):
+        """
+        :param batch: list of (mfcc, ema, category) of the sentences of the batch
+        :return: the padded mfcc (B, K_max, 429), the padded ema (B, K_max, 18), the lengths of the sentences (B), the
+        mask of the padding (B, K_max, 1) and the category of the batch
+        """
+        x, y, categs = zip(*batch)
+        x, y, lengths, mask = pad_batch(list(x), list(y), self.input_dim, self.output_dim, self.dtype)
+        return x, y, lengths, mask, categs[0]
+
+
+def init_worker(worker_id):
+    """
+    :param worker_id: number of the worker of the DataLoader
+    the dataset cache of the worker is read only : the worker uses the sentences read by the main process before it
+    was started (shared with the main process when forked), and reads the other sentences from the files. The sentences
+    are then in memory only once, whatever the number of workers and of DataLoaders.
+    """
+    dataset_cache = torch.utils.data.get_worker_info().dataset.dataset_cache
+    if dataset_cache is not None:
+        dataset_cache.read_only = True
+
+
+def get_category_loader(files_per_categ, part, batch_size, model, shuffle=False, num_workers=0, prefetch_factor=2,
+                        dataset_cache=None, length_buckets=0):
+    """
+    :param files_per_categ: the files of each category (see give_me_train_valid_test_filenames)
+    :param part: "train" or "valid"
+    :param batch_size: number of sentences per batch
+    :param model: the model the batches are for (input and output dimensions, type, cuda)
+    :param shuffle: whether to shuffle the files of each category at each epoch
+    :param num_workers: number of processes reading and padding the batches, 0 to do it in the main process
+    :param prefetch_factor: number of batches prepared in advance by each worker
+    :param dataset_cache: DatasetCache keeping the sentences in memory. The speakers of the files are read before the
+    workers are started, so that the workers (forked) share them, and the workers do not read other speakers in the
+    cache (see init_worker) : the memory budget of the cache is for the main process and all the workers.
+    :param length_buckets: number of batches of each pool of sentences sorted by length (see CategoryBatchSampler), 0
+    for batches of sentences of any length
+    :return: the DataLoader giving the batches (x, y, lengths, mask, category), the workers are kept for all the epochs
+    """
+    categ_of_files = {f: categ for categ in files_per_categ for f in files_per_categ[categ][part]}
+    kwargs = dict()
+    if num_workers > 0:
+        kwargs = {"prefetch_factor": prefetch_factor, "persistent_workers": True, "worker_init_fn": init_worker}
+        if "fork" in multiprocessing.get_all_start_methods():
+            kwargs["multiprocessing_context"] = "fork"
+        if dataset_cache is not None:
+            dataset_cache.preload(sorted(set(get_sentence_info(f)["speaker"] for f in categ_of_files)))
+    return DataLoader(SentenceDataset(categ_of_files, dataset_cache),
+                      batch_sampler=CategoryBatchSampler(files_per_categ, part, batch_size, shuffle=shuffle,
+                                                         length_buckets=length_buckets),
+                      collate_fn=PadCollate(model.input_dim, model.output_dim, model.dtype),
+                      num_workers=num_workers, pin_memory=model.cuda_avail, **kwargs)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Cache of the preprocessed data for the training : the sentences of a speaker (mfcc and ema_final of all its
+    sentences) are read once and kept in memory, so that the batches of the next epochs, the validation and the final
+    evaluation do not read the npy files again.
+    The speakers are kept within a memory budget, the least recently used speaker is evicted when a new one does not
+    fit. A speaker bigger than the whole budget is not kept, its sentences are read at each batch as before
+    (memory-mapped if the speaker was preprocessed with shards, see shards.py).
+    With the workers of a DataLoader (see data_loading.py), the speakers are read by the main process before the
+    workers are started (preload) and are never evicted, the workers share them and do not read other speakers in
+    their copy of the cache (read_only) : the budget is for all the processes, not for each one.
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+from collections import OrderedDict
+from Preprocessing.shards import shard_streams, get_shard_paths, read_npy_header, load_sentence, get_sentence_names
+
+
+def get_npy_size(path):
+    """
+    :param path: path of a npy file
+    :return: size of the array in bytes, without reading the data
+    """
+    shape, dtype = read_npy_header(path)
+    return int(np.prod(shape)) * dtype.itemsize
+
+
+class DatasetCache():
+    """
+    Sentences of the speakers kept in memory (within memory_budget bytes), least recently used speaker evicted first
+    """
+    def __init__(self, memory_budget=4e9):
+        """
+        :param memory_budget: max size in bytes of the sentences kept in memory, 0 to keep nothing
+        """
+        self.memory_budget = memory_budget
+        self.speaker_sets = OrderedDict()  # speaker => {name : (mfcc, ema)}, the least recently used first
+        self.sizes = {}  # speaker => size in bytes of its sentences
+        self.memory_used = 0
+        self.n_loaded = 0  # number of times a speaker was read
+        self.n_evicted = 0
+        self.pinned = set()  # speakers read by preload, shared with the workers of the DataLoaders, not evicted
+        self.read_only = False  # in the workers : only the speakers already in memory are used, see get_speaker_set
+
+    def __getstate__(self):
+        """
+        the cache is sent to the workers of the DataLoader without the sentences when they are not forked (the workers
+        then read the files, see read_only), forked workers share the sentences read before they were started (see
+        preload)
+        """
+        state = self.__dict__.copy()
+        state["speaker_sets"] = OrderedDict()
+        state["memory_used"] = 0
+        return state
+
+    def preload(self, speakers):
+        """
+        :param speakers: list of speakers
+        reads the sentences of the speakers (as long as they fit in the memory budget) before the workers of the
+        DataLoader are started so that they share them. They are then never evicted : the memory of a speaker evicted
+        by the main process would not be freed, the workers still have it.
+        """
+        for speaker in speakers:
+            if self.memory_used + self.get_speaker_size(speaker) <= self.memory_budget:
+                if self.get_speaker_set(speaker) is not None:
+                    self.pinned.add(speaker)
+
+    def get_speaker_size(self, speaker):
+        """
+        :param speaker: name of the speaker
+        :return: size in bytes of the mfcc and ema_final of all the sentences of the speaker (from the headers of the
+        npy files, nothing is read)
+        """
+        if speaker not in self.sizes:
+            path_speaker = os.path.join(parentdir, "Preprocessed_data", speaker)
+            size = 0
+            for stream in shard_streams:
+                path_shard, path_index = get_shard_paths(path_speaker, stream)
+                if os.path.exists(path_index):
+                    size += get_npy_size(path_shard)
+                else:
+                    size += sum(get_npy_size(os.path.join(path_speaker, stream, name + ".npy"))
+                                for name in get_sentence_names(path_speaker))
+            self.sizes[speaker] = size
+        return self.sizes[speaker]
+
+    def read_speaker_set(self, speaker):
+        """
+        :param speaker: name of the speaker
+        :return: dictionary name of the sentence => (mfcc, ema) of all the sentences of the speaker
+        """
+        path_speaker = os.path.join(parentdir, "Preprocessed_data", speaker)
+        return {name: (load_sentence(path_speaker, "mfcc", name), load_sentence(path_speaker, "ema_final", name))
+                for name in get_sentence_names(path_speaker)}
+
+    def get_speaker_set(self, speaker):
+        """
+        :param speaker: name of the speaker
+        :return: the sentences of the speaker (see read_speaker_set), read if they are not in memory, None if the
+        speaker does not fit in the memory budget (with the pinned speakers), or if it is not in memory and the cache
+        is read only
+        """
+        if speaker in self.speaker_sets:
+            if not self.read_only:  # the order is not used in the workers, and their copy is not written
+                self.speaker_sets.move_to_end(speaker)
+            return self.speaker_sets[speaker]
+        if self.read_only:
+            return None
+        size = self.get_speaker_size(speaker)
+        evictable = [sp for sp in self.speaker_sets if sp not in self.pinned]  # the least recently used first
+        if self.memory_used - sum(self.sizes[sp] for sp in evictable) + size > self.memory_budget:
+            return None
+        for evicted in evictable:
+            if self.memory_used + size <= self.memory_budget:
+                break
+            del self.speaker_sets[evicted]
+            self.memory_used -= self.sizes[evicted]
+            self.n_evicted += 1
+        self.speaker_sets[speaker] = self.read_speaker_set(speaker)
+        self.memory_used += size
+        self.n_loaded += 1
+        return self.speaker_sets[speaker]
+
+    def get_sentence(self, speaker, name):
+        """
+        :param speaker: name of the speaker
+        :param name: name of the sentence
+        :return: the mfcc and the ema of the sentence kept in memory (shared by all the batches, do not write into
+        them), None if the speaker does not fit in the memory budget
+        """
+        speaker_set = self.get_speaker_set(speaker)
+        if speaker_set is None:
+            return None
+        return speaker_set[name]
+
+    def report(self):
+        """
+        :return: string with the speakers in memory, the memory used and the number of speakers read and evicted
+        """
+        return "dataset cache : {} speakers in memory ({:.1f} MB / {:.1f} MB), {} read, {} evicted".format(
+            len(self.speaker_sets), self.memory_used / 1e6, self.memory_budget / 1e6, self.n_loaded, self.n_evicted)
@@ -27,7 +27,8 @@ import math
 import matplotlib.pyplot as plt
 import numpy as np
 import gc
-from Training.tools_learning import get_right_indexes, criterion_pearson_no_reduction
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+from Training.tools_learning import get_right_indexes, criterion_pearson_no_reduction, pad_batch, get_mask
 
 def memReport(all = False):
     """
@@ -44,12 +45,15 @@ def memReport(all = False):
     print('nb objects tensor', nb_object)
 
 
+weights_version = 2  # saved with the weights (state_dict), see my_ac2art_model.load_state_dict
+
+
 class my_ac2art_model(torch.nn.Module):
     """
     pytorch implementation of neural network
     """
     def __init__(self, hidden_dim, input_dim, output_dim, batch_size,name_file="", sampling_rate=100,
-                  cutoff=10,cuda_avail =False, filter_type=1, batch_norma=False):
+                  cutoff=10,cuda_avail =False, filter_type=1, batch_norma=False, precision="float64"):
         """
         :param hidden_dim: int, hidden dimension of lstm (usually 300)
         :param input_dim: int, input dimension of the acoustic features for 1 frame mfcc (usually 429)
@@ -62,6 +66,8 @@ class my_ac2art_model(torch.nn.Module):
         :param filter type: str, "out": filter outside the nn, "fix" : weights are FIXED,
         "unfix" : weights are updated during the training
         :param batch_norma: bool, whether to add batch normalization after the lstm layers
+        :param precision: str, "float64" or "float32", type of the weights, of the batches and of the filter weights
+        (the float32 computations are about twice faster on cpu and need half the memory)
         """
         super(my_ac2art_model, self).__init__()
         self.input_dim = input_dim
@@ -72,11 +78,11 @@ class my_ac2art_model(torch.nn.Module):
         self.last_layer = torch.nn.Linear(output_dim,output_dim)
         self.lstm_layer = torch.nn.LSTM(input_size=hidden_dim,
                                         hidden_size=hidden_dim, num_layers=1,
-                                        bidirectional=True)
+                                        bidirectional=True, batch_first=True)
         self.batch_norm_layer =  torch.nn.BatchNorm1d(hidden_dim*2)
         self.lstm_layer_2= torch.nn.LSTM(input_size=hidden_dim*2,
                                        hidden_size=hidden_dim, num_layers=1,
-                                      bidirectional=True)
+                                      bidirectional=True, batch_first=True)
         self.batch_norm_layer_2 =  torch.nn.BatchNorm1d(hidden_dim*2)
         self.readout_layer = torch.nn.Linear(hidden_dim*2  , output_dim)
         self.batch_size = batch_size
@@ -86,6 +92,7 @@ class my_ac2art_model(torch.nn.Module):
         self.tanh = torch.nn.Tanh()
         self.sampling_rate = sampling_rate
         self.cutoff = cutoff
+        self.dtype = getattr(torch, precision)
         self.N = None
         self.min_valid_error = 100000
         self.all_training_loss = []
@@ -94,6 +101,7 @@ class my_ac2art_model(torch.nn.Module):
         self.name_file = name_file
         self.lowpass = None
         self.init_filter_layer()
+        self.register_buffer("weights_version", torch.tensor(weights_version))
         self.cuda_avail = cuda_avail
 
         self.epoch_ref = 0
@@ -102,6 +110,23 @@ class my_ac2art_model(torch.nn.Module):
             self.device = torch.device("cuda")
         else:
             self.device = None
+        self.to(dtype=self.dtype)
+
+    def load_state_dict(self, state_dict, strict=True):
+        """
+        :param state_dict: weights saved by the model (torch.load of saved_models/name_file.pt or .txt)
+        :param strict: see torch.nn.Module.load_state_dict
+        raises a ValueError for the weights saved by a previous version of the model : they have the same layers, but
+        before the version 2 (weights saved without their version) the lstm layers were not batch first (the recurrence
+        was along the sentences of the batch, each frame was predicted alone at test) and the batch normalization mixed
+        up the frames and the features. The same weights would give other predictions, they cannot be converted.
+        """
+        version = state_dict.get("weights_version")
+        if version is None or int(version) != weights_version:
+            raise ValueError("the weights of {} were saved by the version {} of the model, they give other predictions "
+                             "with the version {} (lstm layers batch first) : the model has to be trained again"
+                             .format(self.name_file, 1 if version is None else int(version), weights_version))
+        return super(my_ac2art_model, self).load_state_dict(state_dict, strict=strict)
 
     def prepare_batch(self, x, y):
         """
@@ -109,57 +134,82 @@ class my_ac2art_model(torch.nn.Module):
         each element of the list is an array (K,18)  (K not always the same)
         :param y: list of B(batchsize) articulatory features,
         each element of the list is an array (K,429) (K not always the same)
-        :return: 2 np array of sizes (B, K_max, 18) and (B, K_max, 429
+        :return: 2 np array of sizes (B, K_max, 18) and (B, K_max, 429, the lengths of the sentences (B) and the mask
+        of the padding (B, K_max, 1)
         x,y initially data of the batch with different sizes . the script zeropad the acoustic and
-        articulatory sequences so that all element in the batch have the same size
+        articulatory sequences so that all element in the batch have the same size (see pad_batch)
         """
 
-        max_length = np.max([len(phrase) for phrase in x])
-        B = len(x)  # often batch size but not for validation
-        new_x = torch.zeros((B, max_length, self.input_dim), dtype=torch.double)
-        new_y = torch.zeros((B, max_length, self.output_dim), dtype=torch.double)
-        for j in range(B):
-            zeropad = torch.nn.ZeroPad2d((0, 0, 0, max_length - len(x[j])))
-            new_x[j] = zeropad(torch.from_numpy(x[j])).double()
-            new_y[j] = zeropad(torch.from_numpy(y[j])).double()
-        x = new_x.view((B, max_length, self.input_dim))
-        y = new_y.view((B, max_length, self.output_dim))
+        return pad_batch(x, y, self.input_dim, self.output_dim, self.dtype)
 
-        return x, y
+    def lstm_forward(self, lstm_layer, x, lengths=None):
+        """
+        :param lstm_layer: one of the bilstm layers
+        :param x: (Batchsize,K,dim) input of the layer
+        :param lengths: lengths of the sentences of the batch (see prepare_batch), None if there is no padding
+        :return: the output (Batchsize,K,2*hidden_dim) of the layer. With lengths the sequences are packed : the lstm
+        does not go through the padding (the backward direction starts at the last frame of each sentence), and the
+        output of the padded frames is 0
+        """
+        if lengths is None:
+            return lstm_layer(x)[0]
+        packed = pack_padded_sequence(x, lengths, batch_first=True, enforce_sorted=False)
+        lstm_out, hidden_dim = lstm_layer(packed)
+        return pad_packed_sequence(lstm_out, batch_first=True, total_length=x.shape[1])[0]
 
-    def forward(self, x, filter_output=None):
+    def batch_norm_forward(self, batch_norm_layer, x, lengths=None):
+        """
+        :param batch_norm_layer: one of the batch normalization layers
+        :param x: (Batchsize,K,2*hidden_dim) output of a bilstm layer
+        :param lengths: lengths of the sentences of the batch (see prepare_batch), None if there is no padding
+        :return: x normalized per feature (Batchsize,K,2*hidden_dim). With lengths, the statistics of the batch (in
+        train mode) are calculated on the frames of the sentences only, and the output of the padded frames is 0
+        """
+        if lengths is None:
+            return batch_norm_layer(x.transpose(1, 2)).transpose(1, 2)
+        frames = get_mask(lengths, x.shape[1], torch.bool).to(device=x.device).view(x.shape[0], x.shape[1])
+        out = torch.zeros_like(x)
+        out[frames] = batch_norm_layer(x[frames])  # (number of frames of the sentences, 2*hidden_dim)
+        return out
+
+    def forward(self, x, filter_output=None, lengths=None):
         """
         :param x: (Batchsize,K,429)  acoustic features corresponding to batch size
         :param filter_output: whether or not to pass throught the convolutional layer
+        :param lengths: lengths of the sentences of the batch (see prepare_batch), None if there is no padding. With the
+        lengths, the prediction of each sentence does not depend on the other sentences of the batch : the lstm layers
+        do not go through the padding, and the prediction of the padded frames is set to 0 before and after the
+        smoothing. With batch_norma in train mode, the statistics of the batch normalization still depend on the batch
+        (they are calculated on the frames of all its sentences, not on the padding)
         :return: the articulatory prediction (Batchsize, K,18) based on the current weights
         """
         if filter_output is None :
             filter_output = (self.filter_type != "out")
         dense_out =  torch.nn.functional.relu(self.first_layer(x))
         dense_out_2 = torch.nn.functional.relu(self.second_layer(dense_out))
-        lstm_out, hidden_dim = self.lstm_layer(dense_out_2)
-        B = lstm_out.shape[0] #presque tjrs batch size
+        lstm_out = self.lstm_forward(self.lstm_layer, dense_out_2, lengths)
         if self.batch_norma :
-            lstm_out_temp = lstm_out.view(B,2*self.hidden_dim,-1)
-            lstm_out_temp = torch.nn.functional.relu(self.batch_norm_layer(lstm_out_temp))
-            lstm_out= lstm_out_temp.view(B,  -1,2 * self.hidden_dim)
+            lstm_out = torch.nn.functional.relu(self.batch_norm_forward(self.batch_norm_layer, lstm_out, lengths))
         lstm_out = torch.nn.functional.relu(lstm_out)
-        lstm_out, hidden_dim = self.lstm_layer_2(lstm_out)
+        lstm_out = self.lstm_forward(self.lstm_layer_2, lstm_out, lengths)
         if self.batch_norma :
-            lstm_out_temp = lstm_out.view(B,2*self.hidden_dim,-1)
-            lstm_out_temp = torch.nn.functional.relu(self.batch_norm_layer_2(lstm_out_temp))
-            lstm_out= lstm_out_temp.view(B,  -1,2 * self.hidden_dim)
+            lstm_out = torch.nn.functional.relu(self.batch_norm_forward(self.batch_norm_layer_2, lstm_out, lengths))
         lstm_out=torch.nn.functional.relu(lstm_out)
         y_pred = self.readout_layer(lstm_out)
+        if lengths is not None:
+            mask = get_mask(lengths, y_pred.shape[1], self.dtype).to(device=y_pred.device)
+            y_pred = y_pred * mask  # the padding smoothed as the zeros at the end of a sentence alone
         if filter_output:
             y_pred = self.filter_layer(y_pred)
+            if lengths is not None:
+                y_pred = y_pred * mask.to(device=y_pred.device)
         return y_pred
 
     def get_filter_weights(self):
         """
         :return: low pass filter weights based on calculus exclusively using tensors so pytorch compatible
         """
-        cutoff = torch.tensor(self.cutoff, dtype=torch.float64,requires_grad=True).view(1, 1)
+        cutoff = torch.tensor(self.cutoff, dtype=self.dtype,requires_grad=True).view(1, 1)
         fc = torch.div(cutoff,
               self.sampling_rate)  # Cutoff frequency as a fraction of the sampling rate (in (0, 0.5)).
         if fc > 0.5:
@@ -170,9 +220,9 @@ class my_ac2art_model(torch.nn.Module):
             N += 1  # Make sure that N is odd .
         self.N = N
 
-        n = torch.arange(N).double()
-        alpha = torch.mul(fc, 2 * (n - (N - 1) / 2)).double()
-        minim = torch.tensor(0.01, dtype=torch.float64) #utile ?
+        n = torch.arange(N).to(self.dtype)
+        alpha = torch.mul(fc, 2 * (n - (N - 1) / 2)).to(self.dtype)
+        minim = torch.tensor(0.01, dtype=self.dtype) #utile ?
         alpha = torch.max(alpha,minim)#utile ?
         h = torch.div(torch.sin(alpha), alpha)
         beta = n * 2 * math.pi / (N - 1)
@@ -198,7 +248,7 @@ class my_ac2art_model(torch.nn.Module):
         w = 0.5 * (1 - np.cos(n * 2 * math.pi / (N - 1)))  # Compute hanning window.
         h = h * w
         h = h / np.sum(h)
-        return torch.tensor(h)
+        return torch.tensor(h, dtype=self.dtype)
 
     def init_filter_layer(self):
         """
@@ -226,7 +276,7 @@ class my_ac2art_model(torch.nn.Module):
         else :  # "out" we don't care the filter won't be applied, or "fix" the wieghts are fixed
             lowpass.weight = torch.nn.Parameter(weight_init,requires_grad=False)
 
-        lowpass = lowpass.double()
+        lowpass = lowpass.to(self.dtype)
         self.lowpass = lowpass
 
     def filter_layer(self, y):
@@ -237,8 +287,8 @@ class my_ac2art_model(torch.nn.Module):
         """
         B = len(y)
         L = len(y[0])
-        y = y.double()
-        y_smoothed = torch.zeros(B, L, self.output_dim)
+        y = y.to(self.dtype)
+        y_smoothed = torch.zeros(B, L, self.output_dim, dtype=self.dtype)
         for i in range(self.output_dim):
             traj_arti = y[:, :, i].view(B, 1, L)
             traj_arti_smoothed = self.lowpass(traj_arti)
@@ -294,7 +344,7 @@ class my_ac2art_model(torch.nn.Module):
             indices_to_plot = np.random.choice(len(X_test), 2, replace=False)
         for i in range(len(X_test)):
             L = len(X_test[i])
-            x_torch = torch.from_numpy(X_test[i]).view(1, L, self.input_dim)  #x (1,L,429)
+            x_torch = torch.from_numpy(X_test[i]).to(self.dtype).view(1, L, self.input_dim)  #x (1,L,429)
             y = Y_test[i].reshape((L, 18))                     #y (L,13)
             if index_common != []:
                 y = get_right_indexes(y, index_common, shape = 2)
@@ -359,7 +409,7 @@ class my_ac2art_model(torch.nn.Module):
             indices_to_plot = np.random.choice(len(X_test), 2, replace=False)
         for i in range(len(X_test)):
             L = len(X_test[i])
-            x_torch = torch.from_numpy(X_test[i]).view(1, L, self.input_dim)  #x (1,L,429)
+            x_torch = torch.from_numpy(X_test[i]).to(self.dtype).view(1, L, self.input_dim)  #x (1,L,429)
             y = Y_test[i].reshape((L, 18))                     #y (L,13)
             if index_common != []:
                 y = get_right_indexes(y, index_common, shape = 2)
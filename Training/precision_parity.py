@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Parity report of the float32 path : a model already trained is evaluated on the same sentences in float64 (the
+    weights and the data as before) and in float32 (the weights, the filter weights and the data in float32, as with
+    the argument --precision float32 of the preprocessing and of the training).
+    Prints the rmse and pearson per articulator for both precisions, their differences and the time of the
+    evaluation, and whether the differences are within the tolerances.
+    Only for the models that predict the 18 articulators. Be in the folder "Training" and type :
+    python precision_parity.py F01 F01_spec_loss_90_filter_fix_bn_False_0
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import argparse
+import time
+import numpy as np
+import torch
+from Training.tools_learning import load_np_ema_and_mfcc, load_filenames
+from Training.model import my_ac2art_model
+from Preprocessing.speaker_registry import articulators, get_speaker_info
+
+root_folder = os.path.dirname(os.getcwd())
+
+
+def evaluate_with_precision(model_name, x, y, std_speaker, arti_to_consider, precision):
+    """
+    :param model_name: name of the model (weights in saved_models/model_name.txt)
+    :param x: list of the mfcc of the sentences
+    :param y: list of the ema of the sentences
+    :param std_speaker: std of the ema of the speaker (to have the rmse in mm)
+    :param arti_to_consider: 18 booleans, True if the articulator is available
+    :param precision: "float64" or "float32"
+    :return: rmse and pearson per articulator, and the time of the evaluation in second
+    """
+    model = my_ac2art_model(hidden_dim=300, input_dim=429, output_dim=18, batch_size=10, cuda_avail=False,
+                            name_file=model_name, filter_type="fix", batch_norma=False, precision=precision)
+    loaded_state = torch.load(os.path.join("saved_models", model_name + ".txt"), map_location="cpu")
+    model.load_state_dict(loaded_state)  # the weights are converted to the precision of the model
+    x = [mfcc.astype(precision) for mfcc in x]
+    y = [ema.astype(precision) for ema in y]
+    start = time.time()
+    with torch.no_grad():
+        rmse, pearson = model.evaluate_on_test(x, y, std_speaker=std_speaker, to_consider=arti_to_consider,
+                                               verbose=False)
+    return rmse, pearson, time.time() - start
+
+
+def precision_parity(test_on, model_name, n_files=0, tol_rmse=0.01, tol_pearson=0.001):
+    """
+    :param test_on: the speaker the model is evaluated on
+    :param model_name: name of the model (weights in saved_models/model_name.txt)
+    :param n_files: number of sentences to evaluate on (0 for all the sentences of the test set)
+    :param tol_rmse: max difference of the rmse per articulator (mm) between float32 and float64
+    :param tol_pearson: max difference of the pearson per articulator between float32 and float64
+    :return: whether the differences are within the tolerances
+    """
+    if "indep" in model_name:  # the model was not trained on the test speaker
+        files_for_test = load_filenames([test_on], part=["train", "valid", "test"])
+    else:
+        files_for_test = load_filenames([test_on], part=["test"])
+    if n_files > 0:
+        files_for_test = files_for_test[:n_files]
+    x, y = load_np_ema_and_mfcc(files_for_test)
+    std_speaker = np.load(os.path.join(root_folder, "Preprocessing", "norm_values", "std_ema_" + test_on + ".npy"))
+    arti_to_consider = get_speaker_info(test_on)["arti_mask"]
+
+    rmse_64, pearson_64, time_64 = evaluate_with_precision(model_name, x, y, std_speaker, arti_to_consider, "float64")
+    rmse_32, pearson_32, time_32 = evaluate_with_precision(model_name, x, y, std_speaker, arti_to_consider, "float32")
+    diff_rmse = np.abs(rmse_32 - rmse_64)
+    diff_pearson = np.abs(pearson_32 - pearson_64)
+
+    print("parity float32 / float64 of {} on {} ({} sentences)".format(model_name, test_on, len(files_for_test)))
+    print("{:<6} {:>10} {:>10} {:>9} {:>10} {:>10} {:>9}".format(
+        "arti", "rmse 64", "rmse 32", "diff", "pearson 64", "pearson 32", "diff"))
+    for k in np.flatnonzero(arti_to_consider):
+        print("{:<6} {:10.4f} {:10.4f} {:9.1e} {:10.4f} {:10.4f} {:9.1e}".format(
+            articulators[k], rmse_64[k], rmse_32[k], diff_rmse[k], pearson_64[k], pearson_32[k], diff_pearson[k]))
+    print("mean   {:10.4f} {:10.4f} {:9.1e} {:10.4f} {:10.4f} {:9.1e}".format(
+        np.mean(rmse_64[arti_to_consider]), np.mean(rmse_32[arti_to_consider]), np.max(diff_rmse),
+        np.mean(pearson_64[arti_to_consider]), np.mean(pearson_32[arti_to_consider]), np.max(diff_pearson)))
+    print("evaluation time : float64 {:.2f}s, float32 {:.2f}s (x{:.1f})".format(time_64, time_32, time_64 / time_32))
+    within_tolerance = np.max(diff_rmse) <= tol_rmse and np.max(diff_pearson) <= tol_pearson
+    print("max diff rmse {:.1e} (tolerance {:.1e}), pearson {:.1e} (tolerance {:.1e}) : {}".format(
+        np.max(diff_rmse), tol_rmse, np.max(diff_pearson), tol_pearson, "OK" if within_tolerance else "FAILED"))
+    return within_tolerance
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the evaluation of a model in float32 and in float64')
+    parser.add_argument('test_on', type=str,
+                        help='the speaker we want to test on')
+    parser.add_argument('model_name', type=str,
+                        help='name of the model (without .txt)')
+    parser.add_argument('--n_files', type=int, default=0,
+                        help='number of sentences to evaluate on, by default all the sentences of the test set')
+    parser.add_argument('--tol_rmse', type=float, default=0.01,
+                        help='max difference of the rmse per articulator (mm)')
+    parser.add_argument('--tol_pearson', type=float, default=0.001,
+                        help='max difference of the pearson per articulator')
+    args = parser.parse_args()
+
+    ok = precision_parity(test_on=args.test_on, model_name=args.model_name, n_files=args.n_files,
+                          tol_rmse=args.tol_rmse, tol_pearson=args.tol_pearson)
+    sys.exit(0 if ok else 1)
@@ -20,6 +20,7 @@ import os
 import csv
 import sys
 from Training.tools_learning import load_np_ema_and_mfcc, load_filenames, give_me_common_articulators, criterion_pearson_no_reduction
+from Preprocessing.speaker_registry import get_speaker_info
 import random
 from scipy import signal
 import matplotlib.pyplot as plt
@@ -31,10 +32,11 @@ fileset_path = os.path.join(root_folder, "Preprocessed_data", "fileset")
 print(sys.argv)
 articulators = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y',
                     'ul_x', 'ul_y', 'll_x', 'll_y', 'la', 'lp', 'ttcl', 'tbcl', 'v_x', 'v_y']
-def test_model(test_on ,model_name, test_on_per_default = False, ) :
+def test_model(test_on ,model_name, test_on_per_default = False, precision="float64") :
     """
     :param test_on:  the speaker test
     :param model_name: the name of the model (of the .txt file, without the ".txt")
+    :param precision: "float64" or "float32", type of the model and of the batches (see my_ac2art_model)
     Need to have to weights of the models saved in a txt file located in Training/saved_models/
     for example F01_speaker_indep_Haskins__loss_both_90_filter_fix_0.txt
     The test speaker has to be precised (in fact readable in the begining of the filename ==> future work)
@@ -97,8 +99,7 @@ def test_model(test_on ,model_name, test_on_per_default = False, ) :
 
     model = my_ac2art_model(hidden_dim=hidden_dim, input_dim=input_dim, output_dim=output_dim,
                              batch_size=batch_size, cuda_avail=cuda_avail, name_file=model_name,
-                             filter_type=filter_type, batch_norma=batch_norma)
-    model = model.double()
+                             filter_type=filter_type, batch_norma=batch_norma, precision=precision)
 
     file_weights = os.path.join("saved_models", model_name + ".txt")
 
@@ -120,17 +121,9 @@ def test_model(test_on ,model_name, test_on_per_default = False, ) :
     x, y = load_np_ema_and_mfcc(files_for_test)
     print("evaluation on speaker {}".format(test_on))
     std_speaker = np.load(os.path.join(root_folder, "Preprocessing", "norm_values", "std_ema_"+test_on+".npy"))
-    arti_per_speaker = os.path.join(root_folder, "Preprocessing", "articulators_per_speaker.csv")
-    csv.register_dialect('myDialect', delimiter=';')
     weight_apres = model.lowpass.weight.data[0, 0, :]
 
-    with open(arti_per_speaker, 'r') as csvFile:
-        reader = csv.reader(csvFile, dialect="myDialect")
-        next(reader)
-        for row in reader:
-            if row[0] == test_on:
-                arti_to_consider = row[1:19]
-                arti_to_consider = [int(x) for x in arti_to_consider]
+    arti_to_consider = get_speaker_info(test_on)["arti_mask"]  # 18 booleans, True if the arti is available
     if arti_indexes != []:
         arti_to_consider = [1 for k in range(len(arti_indexes))]
 
@@ -179,10 +172,12 @@ if __name__ == '__main__':
     parser.add_argument('model_name', type=str,
                         help='name of the model (without .txt)')
 
+    parser.add_argument('--precision', type=str, default="float64", choices=["float64", "float32"],
+                        help='type of the model, float32 is faster and needs half the memory')
 
     args = parser.parse_args()
 
-    rmse,pearson = test_model(test_on=args.test_on, model_name=args.model_name)
+    rmse,pearson = test_model(test_on=args.test_on, model_name=args.model_name, precision=args.precision)
     print("results for model ",args.model_name)
     print("rmse",rmse)
     print("pearson",pearson)
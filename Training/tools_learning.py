@@ -14,7 +14,10 @@ import gc
 import torch
 import sys
 import psutil
-from Preprocessing.tools_preprocessing import get_speakers_per_corpus
+from Preprocessing.tools_preprocessing import get_speakers_per_corpus, add_context_frames
+from Preprocessing.speaker_registry import get_categories, get_common_articulators
+from Preprocessing.shards import load_sentence
+from Preprocessing.manifest import get_sentence_info
 import json
 import random
 import matplotlib.pyplot as plt
@@ -39,27 +42,72 @@ def load_filenames(speakers, part=["train"]):
     return filenames
 
 
-def load_np_ema_and_mfcc(filenames):
+def load_np_ema_and_mfcc(filenames, dataset=None):
     """
     :param filenames: list of files we want to load the ema and mfcc data
+    :param dataset: DatasetCache keeping the sentences of the speakers in memory between the batches (see
+    dataset_cache.py), None to read the files at each call
     :return: x : the list of mfcc features,
             y : the list of ema traj
     Load the numpy arrays correspondign the ema and mfcc of the files in the list filenames
+    The mfcc saved without their context frames (K,39) are returned as a (K,429) view with the context frames
+    The speakers preprocessed with shards are read from their packed arrays (memory-mapped, see shards.py)
+    The speaker of each file is given by the manifest of the preprocessed sentences (see manifest.py)
     """
     folder = os.path.join(os.path.dirname(os.getcwd()), "Preprocessed_data")
     x = []
     y = []
-    speakers = ["F01", "F02", "F03", "F04", "M01", "M02", "M03", "M04","F1", "F5", "M1", "M3"
-        , "maps0", "faet0", 'mjjn0', "ffes0", "MNGU0", "fsew0", "msak0","falh0"]
     for filename in filenames:
-        speaker = [s for s in speakers if s.lower() in filename.lower()][0] # we can deduce the speaker from the filename
-        files_path = os.path.join(folder,speaker)
-        the_ema_file = np.load(os.path.join(files_path, "ema_final", filename + ".npy"))
-        the_mfcc_file = np.load(os.path.join(files_path, "mfcc", filename + ".npy"))
+        speaker = get_sentence_info(filename)["speaker"]
+        sentence = dataset.get_sentence(speaker, filename) if dataset is not None else None
+        if sentence is not None:
+            the_mfcc_file, the_ema_file = sentence
+        else:
+            files_path = os.path.join(folder,speaker)
+            the_ema_file = load_sentence(files_path, "ema_final", filename)
+            the_mfcc_file = load_sentence(files_path, "mfcc", filename)
+        if the_mfcc_file.shape[1] == 39:
+            the_mfcc_file = add_context_frames(the_mfcc_file, window=5)
         x.append(the_mfcc_file)
         y.append(the_ema_file)
     return x, y
 
+def get_mask(lengths, max_length, dtype=torch.float64):
+    """
+    :param lengths: tensor (B) of the number of frames of the sentences of a batch
+    :param max_length: number of frames of the padded batch
+    :param dtype: torch type of the mask
+    :return: tensor (B, max_length, 1), 1 for the frames of the sentences and 0 for the padding
+    """
+    mask = torch.arange(max_length).view(1, max_length) < lengths.view(-1, 1)
+    return mask.to(dtype).view(-1, max_length, 1)
+
+
+def pad_batch(x, y, input_dim, output_dim, dtype=torch.float64):
+    """
+    :param x: list of B acoustic features (K,input_dim) of variable lengths
+    :param y: list of B articulatory trajectories (K,output_dim)
+    :param input_dim: number of acoustic features per frame
+    :param output_dim: number of articulatory trajectories
+    :param dtype: torch type of the batch
+    :return: 2 tensors (B, K_max, input_dim) and (B, K_max, output_dim), zero padded so that all the sentences of the
+    batch have the same length, the lengths of the sentences (tensor (B) of int64, on cpu as needed to pack the
+    sequences) and the mask of the padding (see get_mask)
+    """
+    lengths = torch.tensor([len(phrase) for phrase in x], dtype=torch.int64)
+    max_length = int(lengths.max())
+    B = len(x)  # often batch size but not for validation
+    new_x = torch.zeros((B, max_length, input_dim), dtype=dtype)
+    new_y = torch.zeros((B, max_length, output_dim), dtype=dtype)
+    for j in range(B):
+        zeropad = torch.nn.ZeroPad2d((0, 0, 0, max_length - len(x[j])))
+        new_x[j] = zeropad(torch.from_numpy(x[j])).to(dtype)
+        new_y[j] = zeropad(torch.from_numpy(y[j])).to(dtype)
+    x = new_x.view((B, max_length, input_dim))
+    y = new_y.view((B, max_length, output_dim))
+    return x, y, lengths, get_mask(lengths, max_length, dtype)
+
+
 def memReport(all=False):
     """
     :param all: show size of each obj
@@ -88,25 +136,32 @@ def cpuStats():
 
 
 
-def criterion_pearson(y, y_pred, cuda_avail , device):
+def criterion_pearson(y, y_pred, cuda_avail , device, mask=None):
     """
     :param y: nparray (B,K,18) target trajectories of the batch (size B) , padded (K = maxlenght)
     :param y_pred: nparray (B,K,18) predicted trajectories of the batch (size B), padded (K = maxlenght
     :param cuda_avail: bool whether gpu is available
     :param device: the device
+    :param mask: (B,K,1) 1 for the frames of the sentences and 0 for the padding (see get_mask), the padded frames are
+    then not in the correlations. None to use all the frames
     :return: loss function for this prediction for loss = pearson correlation
     for each pair of trajectories (target & predicted) we calculate the pearson correlation between the two
     we sum all the pearson correlation to obtain the loss function
     // Idea : integrate the range of the traj here, making the loss for each sentence as the weighted average of the
     losses with weight proportional to the range of the traj (?)
     """
-    y_1 = y.sub(torch.mean(y, dim=1, keepdim=True))
-    y_pred_1 = y_pred.sub(torch.mean(y_pred,dim=1, keepdim=True))
+    if mask is None:
+        y_1 = y.sub(torch.mean(y, dim=1, keepdim=True))
+        y_pred_1 = y_pred.sub(torch.mean(y_pred,dim=1, keepdim=True))
+    else:  # means on the frames of the sentences, and padded frames at 0 after the centering
+        lengths = torch.sum(mask, dim=1, keepdim=True)  # (B,1,1)
+        y_1 = (y - torch.sum(y * mask, dim=1, keepdim=True) / lengths) * mask
+        y_pred_1 = (y_pred - torch.sum(y_pred * mask, dim=1, keepdim=True) / lengths) * mask
     nume = torch.sum(y_1 * y_pred_1, dim=1, keepdim=True)  # (B,1,18)
     deno = torch.sqrt(torch.sum(y_1 ** 2, dim=1, keepdim=True)) * \
         torch.sqrt(torch.sum(y_pred_1 ** 2, dim=1, keepdim=True))  # (B,1,18)
 
-    minim = torch.tensor(0.000001,dtype=torch.float64)  # avoid division by 0
+    minim = torch.tensor(0.000001,dtype=y.dtype)  # avoid division by 0
     if cuda_avail:
         minim = minim.to(device=device)
         deno = deno.to(device=device)
@@ -141,16 +196,29 @@ def criterion_pearson_no_reduction(y, y_pred, cuda_avail, device):
     #return -my_loss
 
 
-def criterion_both(my_y,my_ypred,alpha,cuda_avail,device):
-    compl = torch.tensor(1. - float(alpha) / 100., dtype=torch.float64)
-    alpha = torch.tensor(float(alpha) / 100., dtype = torch.float64)
-    multip = torch.tensor(float(1000), dtype = torch.float64)
+def criterion_both(my_y,my_ypred,alpha,cuda_avail,device, mask=None):
+    """
+    :param my_y: (B,K,18) target trajectories of the batch, padded
+    :param my_ypred: (B,K,18) predicted trajectories of the batch, padded
+    :param alpha: from 0 to 100, weight of the pearson in the loss
+    :param cuda_avail: bool whether gpu is available
+    :param device: the device
+    :param mask: (B,K,1) mask of the padding (see get_mask), the padded frames are then not in the loss. None to use
+    all the frames
+    :return: loss = alpha/100 * pearson * 1000 + (1 - alpha/100) * sum of the squared errors
+    """
+    compl = torch.tensor(1. - float(alpha) / 100., dtype=my_y.dtype)
+    alpha = torch.tensor(float(alpha) / 100., dtype = my_y.dtype)
+    multip = torch.tensor(float(1000), dtype = my_y.dtype)
     if cuda_avail:
         alpha = alpha.to(device = device)
         multip = multip.to(device = device)
         compl = compl.to(device= device)
-    a = alpha * criterion_pearson(my_y, my_ypred, cuda_avail, device)*multip
-    b = compl * torch.nn.MSELoss(reduction='sum')(my_y, my_ypred)
+    a = alpha * criterion_pearson(my_y, my_ypred, cuda_avail, device, mask=mask)*multip
+    if mask is None:
+        b = compl * torch.nn.MSELoss(reduction='sum')(my_y, my_ypred)
+    else:
+        b = compl * torch.sum(((my_y - my_ypred) * mask) ** 2)
     new_loss = a + b
     return new_loss
 
@@ -196,24 +264,25 @@ def give_me_common_articulators(list_speakers):
     """
     Give the indexes of the articulators that are in common for a list of speakers
     :param list_speakers: list of the speakers to consider
-    :return: list of indexes that correspond to tha articulators in common
+    :return: list of indexes that correspond to tha articulators in common (see speaker_registry)
     """
-    f_artic = open('articulators_per_speaker.csv', 'r')
-    ind = f_artic.readline().replace('\n', '').split(';')
-    list_arti_common = range(18)
-    for line in f_artic:
-        new_line = line.replace('\n', '').split(';')
-        if new_line[0] in list_speakers:
-            arti_dispo = []
-            for i in range(len(new_line[1:-2])):
-                if new_line[1 + i] == '1':
-                    arti_dispo.append(int(i))
-            list_arti_common = list(set(list_arti_common).intersection(arti_dispo))
-    return list_arti_common
+    return get_common_articulators(list_speakers)
 
 
 
 
+def get_files_per_speaker(filenames):
+    """
+    :param filenames: list of names of preprocessed sentences
+    :return: dictionary speaker => list of its sentences in filenames (in the same order), the speaker of each
+    sentence is given by the manifest (see manifest.py)
+    """
+    files_per_speaker = dict()
+    for filename in filenames:
+        files_per_speaker.setdefault(get_sentence_info(filename)["speaker"], []).append(filename)
+    return files_per_speaker
+
+
 def give_me_train_valid_test_filenames(train_on, test_on, config, batch_size, valid_on = []):
     """
     :param train_on: list of corpus to train on
@@ -230,6 +299,7 @@ def give_me_train_valid_test_filenames(train_on, test_on, config, batch_size, va
     - dep : for speaker dependant, learning on speakers in train_on and a part of the speaker test
     - indep : for speaker independant, learnong on other speakers.
     - train_indep: when you want to train on a list of speakers, valid on another list and test on another speaker
+    The files are put in the category of their speaker (given by the manifest, see manifest.py)
     """
     if config == "spec":
         files_for_train = load_filenames([test_on], part=["train"])
@@ -253,21 +323,17 @@ def give_me_train_valid_test_filenames(train_on, test_on, config, batch_size, va
         files_for_valid = load_filenames(valid_on, part=["train", "valid", "test"])
         files_for_test = load_filenames([test_on], part=["train", "valid", "test"])
 
-    with open('categ_of_speakers.json', 'r') as fp:
-        categ_of_speakers = json.load(fp)  # dictionnary { categ : dict_2} where
-                                            # dict_2 :{  speakers : [sp_1,..], arti  : [0,1,1...]  }
+    categ_of_speakers = get_categories()  # dictionnary { categ : dict_2} where
+                                          # dict_2 :{  speakers : [sp_1,..], arti  : [0,1,1...]  }
     files_per_categ = dict()
+    files_train_per_speaker = get_files_per_speaker(files_for_train)
+    files_valid_per_speaker = get_files_per_speaker(files_for_valid)
 
     for categ in categ_of_speakers.keys():
         sp_in_categ = categ_of_speakers[categ]["sp"]
 
-        files_train_this_categ = [[f for f in files_for_train if sp.lower() in f.lower()]
-                                  for sp in sp_in_categ]  # the speaker name is always in the namefile
-        files_train_this_categ = [item for sublist in files_train_this_categ
-                                  for item in sublist]  # flatten the list of list
-
-        files_valid_this_categ = [[f for f in files_for_valid if sp.lower() in f.lower()] for sp in sp_in_categ]
-        files_valid_this_categ = [item for sublist in files_valid_this_categ for item in sublist]
+        files_train_this_categ = [f for sp in sp_in_categ for f in files_train_per_speaker.get(sp, [])]
+        files_valid_this_categ = [f for sp in sp_in_categ for f in files_valid_per_speaker.get(sp, [])]
 
         if len(files_train_this_categ) > 0:  # meaning we have at least one file in this categ
             files_per_categ[categ] = dict()
@@ -40,15 +40,19 @@ import torch
 import os
 import csv
 from Training.pytorchtools import EarlyStopping
+from Training.dataset_cache import DatasetCache
+from Training.data_loading import get_category_loader
 import random
 from Training.tools_learning import which_speakers_to_train_on, give_me_train_valid_test_filenames, \
     cpuStats, memReport, criterion_both, load_np_ema_and_mfcc, plot_filtre, criterion_pearson
+from Preprocessing.speaker_registry import get_categories, get_speaker_info
 import json
 
 root_folder = os.path.dirname(os.getcwd())
 
 def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_train_on, batch_norma, filter_type,
-                to_plot, lr, delta_test, config, speakers_to_train_on = "", speakers_to_valid_on = "", relearn = False):
+                to_plot, lr, delta_test, config, speakers_to_train_on = "", speakers_to_valid_on = "", relearn = False,
+                precision="float64", cache_memory=4., num_workers=2, length_buckets=0):
     """
     :param test_on: (str) one speaker's name we want to test on, the speakers and the corpus the come frome can be seen in
     "fonction_utiles.py", in the function "get_speakers_per_corpus'.
@@ -84,6 +88,17 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
     :param config : either "spe" "dep", or "indep", for specific (train only on test sp), dependant (train on test sp
     and others), or independant, train only on other speakers
 
+    :param precision: "float64" or "float32", type of the model and of the batches (see my_ac2art_model)
+
+    :param cache_memory: memory in GB for the sentences kept in memory between the batches and the epochs (see
+    DatasetCache), 0 to read the files at each batch
+
+    :param num_workers: number of processes reading and padding the batches while the model trains (see
+    get_category_loader), 0 to do it between the batches
+
+    :param length_buckets: the batches are made of sentences of similar lengths, taken among length_buckets batches of
+    shuffled sentences (see CategoryBatchSampler), 0 (default) for batches of sentences of any length as before
+
     :return: [rmse, pearson] . rmse the is the list of the 18 rmse (1 per articulator), same for pearson.
     """
     f_loss_train = open('training_loss.csv', 'w')
@@ -140,8 +155,7 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
     early_stopping = EarlyStopping(name_file, patience=patience, verbose=True)
     model = my_ac2art_model(hidden_dim=hidden_dim, input_dim=input_dim, name_file=name_file, output_dim=output_dim,
                             batch_size=batch_size, cuda_avail=cuda_avail,
-                            filter_type=filter_type, batch_norma=batch_norma)
-    model = model.double()
+                            filter_type=filter_type, batch_norma=batch_norma, precision=precision)
     file_weights = os.path.join("saved_models", name_file +".pt")
     if cuda_avail:
         model = model.to(device=device)
@@ -163,12 +177,17 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
 
 
     files_per_categ, files_for_test = give_me_train_valid_test_filenames(train_on=train_on,test_on=test_on,config=config,batch_size= batch_size, valid_on=valid_on)
+    dataset = DatasetCache(memory_budget=cache_memory * 1e9)  # the sentences are read only once for all the epochs
+    # the batches are read and padded by num_workers processes while the model trains (see data_loading.py)
+    train_loader = get_category_loader(files_per_categ, "train", batch_size, model, shuffle=True,
+                                       num_workers=num_workers, dataset_cache=dataset, length_buckets=length_buckets)
+    valid_loader = get_category_loader(files_per_categ, "valid", batch_size, model, num_workers=num_workers,
+                                       dataset_cache=dataset, length_buckets=length_buckets)
 
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
 
     categs_to_consider = files_per_categ.keys()
-    with open('categ_of_speakers.json', 'r') as fp:
-        categ_of_speakers = json.load(fp)  # dict that gives for each category the speakers in it and the available arti
+    categ_of_speakers = get_categories()  # dict that gives for each category the speakers in it and the available arti
     plot_filtre_chaque_epochs = False
 
     for epoch in range(n_epochs):
@@ -180,78 +199,65 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
         loss_train_this_epoch = 0
         loss_pearson = 0
         loss_rmse = 0
-        for categ in categs_to_consider:
-            files_this_categ_courant = files_per_categ[categ]["train"]
-            random.shuffle(files_this_categ_courant)
-            while len(files_this_categ_courant) > 0: # go through all  the files batch by batch
-                n_this_epoch+=1
-                x, y = load_np_ema_and_mfcc(files_this_categ_courant[:batch_size])
-
-                files_this_categ_courant = files_this_categ_courant[batch_size:] #we a re going to train on this 10 files
-                x, y = model.prepare_batch(x, y)
-                if cuda_avail:
-                    x, y = x.to(device=model.device), y.to( device=model.device)
-                y_pred = model(x).double()
-                if cuda_avail:
-                    y_pred = y_pred.to(device=device)
-                y = y.double ()
-                optimizer.zero_grad()
-                if select_arti:
-                    arti_to_consider = categ_of_speakers[categ]["arti"]  # liste de 18 0/1 qui indique les arti à considérer
-                    idx_to_ignore = [i for i, n in enumerate(arti_to_consider) if n == "0"]
-                    y_pred[:, :, idx_to_ignore] = 0 #the grad associated to this value will be zero  : CHECK THAT
-                   # y_pred[:,:,idx_to_ignore].detach()
-                    #y[:,:,idx_to_ignore].requires_grad = False
-
-                loss = criterion_both(y, y_pred,alpha=loss_train, cuda_avail = cuda_avail, device=device)
-                loss.backward()
-                optimizer.step()
-
-                # computation to have evolution of the losses
-                loss_2 = criterion_pearson(y, y_pred, cuda_avail = cuda_avail, device=device)
-                loss_pearson += loss_2.item()
-                loss_3 = torch.nn.MSELoss(reduction='sum')(y, y_pred)
-                loss_rmse += loss_3.item()
-                torch.cuda.empty_cache()
-                loss_train_this_epoch += loss.item()
+        for x, y, lengths, mask, categ in train_loader:  # go through all the files batch by batch, category by category
+            n_this_epoch+=1
+            if cuda_avail:
+                x, y = x.to(device=model.device), y.to( device=model.device)
+                mask = mask.to(device=model.device)
+            y_pred = model(x, lengths=lengths)
+            if cuda_avail:
+                y_pred = y_pred.to(device=device)
+            optimizer.zero_grad()
+            if select_arti:
+                idx_to_ignore = categ_of_speakers[categ]["idx_to_ignore"]  # arti que l'on ne considère pas
+                y_pred[:, :, idx_to_ignore] = 0 #the grad associated to this value will be zero  : CHECK THAT
+               # y_pred[:,:,idx_to_ignore].detach()
+                #y[:,:,idx_to_ignore].requires_grad = False
+
+            loss = criterion_both(y, y_pred,alpha=loss_train, cuda_avail = cuda_avail, device=device, mask=mask)
+            loss.backward()
+            optimizer.step()
+
+            # computation to have evolution of the losses
+            loss_2 = criterion_pearson(y, y_pred, cuda_avail = cuda_avail, device=device, mask=mask)
+            loss_pearson += loss_2.item()
+            loss_3 = torch.nn.MSELoss(reduction='sum')(y, y_pred)
+            loss_rmse += loss_3.item()
+            torch.cuda.empty_cache()
+            loss_train_this_epoch += loss.item()
 
         torch.cuda.empty_cache()
 
         loss_train_this_epoch = loss_train_this_epoch/n_this_epoch
         print("Training loss for epoch", epoch, ': ', loss_train_this_epoch)
+        print("padding : {:.1f} % of the frames of the batches".format(100 * train_loader.batch_sampler.padding_ratio))
         f_loss_train.write(str(epoch) + ',' + str(loss_train_this_epoch) + ',' + str(loss_pearson/n_this_epoch/batch_size/18.*(-1.)) + ',' + str(loss_rmse/n_this_epoch/batch_size) + '\n')
         if epoch%delta_test == 0:  #toutes les delta_test epochs on évalue le modèle sur validation et on sauvegarde le modele si le score est meilleur
             loss_vali = 0
             n_valid = 0
             loss_pearson = 0
             loss_rmse = 0
-            for categ in categs_to_consider:  # de A à F pour le moment
-                files_this_categ_courant = files_per_categ[categ]["valid"]  # on na pas encore apprit dessus au cours de cette epoch
-                while len(files_this_categ_courant) >0 :
-                    n_valid +=1
-                    x, y = load_np_ema_and_mfcc(files_this_categ_courant[:batch_size])
-                    files_this_categ_courant = files_this_categ_courant[batch_size:]  # on a appris sur ces 10 phrases
-                    x, y = model.prepare_batch(x, y)
-                    if cuda_avail:
-                        x, y = x.to(device=model.device), y.to(device=model.device)
-                    y_pred = model(x).double()
-                    torch.cuda.empty_cache()
-                    if cuda_avail:
-                        y_pred = y_pred.to(device=device)
-                    y = y.double()  # (Batchsize, maxL, 18)
-                    if select_arti:
-                        arti_to_consider = categ_of_speakers[categ]["arti"]  # liste de 18 0/1 qui indique les arti à considérer
-                        idx_to_ignore = [i for i, n in enumerate(arti_to_consider) if n == "0"]
-                        y_pred[:, :, idx_to_ignore] = 0
-                    #    y_pred[:, :, idx_to_ignore].detach()
-                   #     y[:, :, idx_to_ignore].requires_grad = False
-                    loss_courant = criterion_both(y, y_pred, loss_train, cuda_avail = cuda_avail, device=device)
-                    loss_vali += loss_courant.item()
-                    # to follow both losses
-                    loss_2 = criterion_pearson(y, y_pred, cuda_avail = cuda_avail, device=device)
-                    loss_pearson += loss_2.item()
-                    loss_3 = torch.nn.MSELoss(reduction='sum')(y, y_pred)
-                    loss_rmse += loss_3.item()
+            for x, y, lengths, mask, categ in valid_loader:  # de A à F pour le moment
+                n_valid +=1
+                if cuda_avail:
+                    x, y = x.to(device=model.device), y.to(device=model.device)
+                    mask = mask.to(device=model.device)
+                y_pred = model(x, lengths=lengths)  # (Batchsize, maxL, 18)
+                torch.cuda.empty_cache()
+                if cuda_avail:
+                    y_pred = y_pred.to(device=device)
+                if select_arti:
+                    idx_to_ignore = categ_of_speakers[categ]["idx_to_ignore"]  # arti que l'on ne considère pas
+                    y_pred[:, :, idx_to_ignore] = 0
+                #    y_pred[:, :, idx_to_ignore].detach()
+               #     y[:, :, idx_to_ignore].requires_grad = False
+                loss_courant = criterion_both(y, y_pred, loss_train, cuda_avail = cuda_avail, device=device, mask=mask)
+                loss_vali += loss_courant.item()
+                # to follow both losses
+                loss_2 = criterion_pearson(y, y_pred, cuda_avail = cuda_avail, device=device, mask=mask)
+                loss_pearson += loss_2.item()
+                loss_3 = torch.nn.MSELoss(reduction='sum')(y, y_pred)
+                loss_rmse += loss_3.item()
 
             loss_vali  = loss_vali/n_valid
             f_loss_valid.write(str(epoch) + ',' + str(loss_vali) + ',' +  str(loss_pearson/n_valid/batch_size/18.*(-1.)) + ',' + str(loss_rmse/n_this_epoch/batch_size) + '\n')
@@ -275,18 +281,10 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
         model.load_state_dict(torch.load(os.path.join("saved_models",name_file+'.pt')))
         torch.save(model.state_dict(), os.path.join( "saved_models",name_file+".txt")) #lorsque .txt ==> training terminé !
     random.shuffle(files_for_test)
-    x, y = load_np_ema_and_mfcc(files_for_test)
+    x, y = load_np_ema_and_mfcc(files_for_test, dataset=dataset)
     print("evaluation on speaker {}".format(test_on))
     std_speaker = np.load(os.path.join(root_folder,"Preprocessing","norm_values","std_ema_"+test_on+".npy"))
-    arti_per_speaker = os.path.join(root_folder, "Preprocessing", "articulators_per_speaker.csv")
-    csv.register_dialect('myDialect', delimiter=';')
-    with open(arti_per_speaker, 'r') as csvFile:
-        reader = csv.reader(csvFile, dialect="myDialect")
-        next(reader)
-        for row in reader:
-            if row[0] == test_on:
-                arti_to_consider = row[1:19]
-                arti_to_consider = [int(x) for x in arti_to_consider]
+    arti_to_consider = get_speaker_info(test_on)["arti_mask"]  # 18 booleans, True if the arti is available
 
     rmse_per_arti_mean, pearson_per_arti_mean = model.evaluate_on_test(x, y, std_speaker = std_speaker, to_plot=to_plot
                                                                        , to_consider = arti_to_consider)
@@ -298,9 +296,9 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
     for categ in categs_to_consider:  # de A à F pour le moment
         files_this_categ_courant = files_per_categ[categ]["valid"]  # on na pas encore apprit dessus au cours de cette epoch
         while len(files_this_categ_courant) > 0:
-            x, y = load_np_ema_and_mfcc(files_this_categ_courant[:batch_size])
+            x, y = load_np_ema_and_mfcc(files_this_categ_courant[:batch_size], dataset=dataset)
             files_this_categ_courant = files_this_categ_courant[batch_size:]  # on a appris sur ces 10 phrases
-            arti_to_consider = categ_of_speakers[categ]["arti"]  # liste de 18 0/1 qui indique les arti à considérer
+            arti_to_consider = categ_of_speakers[categ]["arti_mask"]  # 18 booleens, True si l'arti est à considérer
 
             rien, pearson_valid_temp = model.evaluate_on_test(x,y,std_speaker=1, to_plot=to_plot,
                                                                  to_consider=arti_to_consider,verbose=False)
@@ -311,6 +309,7 @@ def train_model(test_on, n_epochs, loss_train, patience, select_arti, corpus_to_
     pearson_valid = np.mean(pearson_valid,axis=0)
     print("on validation set :mean :\n",pearson_valid)
     print("training done for : ",name_file)
+    print(dataset.report())
 
     articulators = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y',
                     'ul_x', 'ul_y', 'll_x', 'll_y', 'la', 'lp', 'ttcl', 'tbcl', 'v_x', 'v_y']
@@ -394,6 +393,21 @@ if __name__=='__main__':
     parser.add_argument('config', type=str,
                         help='spec or dep or train_indep or indep that stands for speaker specific/dependant/independant')
 
+    parser.add_argument('--precision', type=str, default="float64", choices=["float64", "float32"],
+                        help='type of the model and of the batches, float32 is faster and needs half the memory')
+
+    parser.add_argument('--cache_memory', type=float, default=4.,
+                        help='memory (GB) for the sentences of the speakers kept in memory between the epochs, '
+                             '0 to read the files at each batch')
+
+    parser.add_argument('--num_workers', type=int, default=2,
+                        help='number of processes preparing the next batches while the model trains, 0 to prepare '
+                             'them between the batches')
+
+    parser.add_argument('--length_buckets', type=int, default=0,
+                        help='number of batches among which the sentences of similar lengths are grouped (10 for '
+                             'instance), 0 for batches of sentences of any length')
+
     args = parser.parse_args()
     print('arguments given:', args.test_on, args.speakers_to_train, args.n_epochs, args.loss_train,
           args.patience, args.select_arti, args.corpus_to_train_on, args.batch_norma, args.filter_type, args.to_plot,args.lr, args.delta_test, args.config )
@@ -401,4 +415,6 @@ if __name__=='__main__':
                 patience=args.patience, select_arti=args.select_arti, corpus_to_train_on=args.corpus_to_train_on,
                 batch_norma=args.batch_norma, filter_type=args.filter_type, to_plot=args.to_plot,
                 lr=args.lr, delta_test=args.delta_test, config=args.config, speakers_to_train_on=args.speakers_to_train,
-                relearn=args.relearn, speakers_to_valid_on=args.speakers_to_valid)
\ No newline at end of file
+                relearn=args.relearn, speakers_to_valid_on=args.speakers_to_valid, precision=args.precision,
+                cache_memory=args.cache_memory, num_workers=args.num_workers,
+                length_buckets=args.length_buckets)
\ No newline at end of file
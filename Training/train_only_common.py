@@ -40,6 +40,7 @@ import torch
 import os
 import csv
 from Training.pytorchtools import EarlyStopping
+from Training.dataset_cache import DatasetCache
 import random
 from Training.tools_learning import which_speakers_to_train_on, give_me_train_valid_test_filenames_no_cat, \
     criterion_both, load_np_ema_and_mfcc, plot_filtre, give_me_common_articulators, get_right_indexes
@@ -48,7 +49,8 @@ import json
 root_folder = os.path.dirname(os.getcwd())
 
 def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_train_on, batch_norma, filter_type,
-                to_plot, lr, delta_valid, delta_test, config, speakers_to_train_on = "", speakers_to_valid_on = ""):
+                to_plot, lr, delta_valid, delta_test, config, speakers_to_train_on = "", speakers_to_valid_on = "",
+                            precision="float64", cache_memory=4.):
     """
     :param test_on: (str) one speaker's name we want to test on, the speakers and the corpus the come frome can be seen in
     "fonction_utiles.py", in the function "get_speakers_per_corpus'.
@@ -85,6 +87,11 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
     and others), or independant, train only on other speakers, and training independant for training on a certain list, validation
     on another an d test on another speaker
 
+    :param precision: "float64" or "float32", type of the model and of the batches (see my_ac2art_model)
+
+    :param cache_memory: memory in GB for the sentences kept in memory between the batches and the epochs (see
+    DatasetCache), 0 to read the files at each batch
+
     :return: [rmse, pearson] . rmse the is the list of the 18 rmse (1 per articulator), same for pearson.
     """
 
@@ -148,8 +155,7 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
     early_stopping = EarlyStopping(name_file, patience=patience, verbose=True)
     model = my_ac2art_model(hidden_dim=hidden_dim, input_dim=input_dim, name_file=name_file, output_dim=output_dim,
                             batch_size=batch_size, cuda_avail=cuda_avail,
-                            filter_type=filter_type, batch_norma=batch_norma)
-    model = model.double()
+                            filter_type=filter_type, batch_norma=batch_norma, precision=precision)
     file_weights = os.path.join("saved_models", name_file +".pt")
     if cuda_avail:
         model = model.to(device=device)
@@ -171,6 +177,7 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
 
     files_for_train, files_for_valid, files_for_test = give_me_train_valid_test_filenames_no_cat(train_on,test_on,config, valid_on=valid_on)
     print('train on', len(files_for_train), 'valid on', len(files_for_valid), 'test on', len(files_for_test))
+    dataset = DatasetCache(memory_budget=cache_memory * 1e9)  # the sentences are read only once for all the epochs
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
 
     plot_filtre_chaque_epochs = False
@@ -189,28 +196,29 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
 
             n_this_epoch+=1
 
-            x, y = load_np_ema_and_mfcc(files_for_train[i*batch_size:(i+1)*batch_size])
+            x, y = load_np_ema_and_mfcc(files_for_train[i*batch_size:(i+1)*batch_size], dataset=dataset)
             model.output_dim = 18
-            x, y = model.prepare_batch(x, y)
+            x, y, lengths, mask = model.prepare_batch(x, y)
 
             model.output_dim = len(arti_common)
             y = get_right_indexes(y,arti_common)
             if cuda_avail:
-                x, y = x.to(device=model.device), torch.from_numpy(y).double().to(device=model.device)
-            y_pred = model(x).double()
+                x, y = x.to(device=model.device), torch.from_numpy(y).to(model.dtype).to(device=model.device)
+                mask = mask.to(device=model.device)
+            y_pred = model(x, lengths=lengths)
             if cuda_avail:
                 y_pred = y_pred.to(device=device)
-            y = y.double ()
+            y = y.to(model.dtype)
             optimizer.zero_grad()
 
-            loss = criterion_both(y, y_pred,alpha=loss_train, cuda_avail = cuda_avail, device=device)
+            loss = criterion_both(y, y_pred,alpha=loss_train, cuda_avail = cuda_avail, device=device, mask=mask)
             loss.backward()
             optimizer.step()
 
             # computation to have evolution of the losses
-            loss_2 = criterion_both(y, y_pred, alpha=100, cuda_avail=cuda_avail, device=device)
+            loss_2 = criterion_both(y, y_pred, alpha=100, cuda_avail=cuda_avail, device=device, mask=mask)
             loss_pearson += loss_2.item()
-            loss_3 = criterion_both(y, y_pred, alpha=0, cuda_avail=cuda_avail, device=device)
+            loss_3 = criterion_both(y, y_pred, alpha=0, cuda_avail=cuda_avail, device=device, mask=mask)
             loss_rmse += loss_3.item()
             torch.cuda.empty_cache()
             loss_train_this_epoch += loss.item()
@@ -230,26 +238,27 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
             nb_batch = len(files_for_valid) / batch_size
             for i in range(int(nb_batch)):
                 n_valid +=1
-                x, y = load_np_ema_and_mfcc(files_for_valid[i * batch_size:(i + 1) * batch_size])
+                x, y = load_np_ema_and_mfcc(files_for_valid[i * batch_size:(i + 1) * batch_size], dataset=dataset)
                 model.output_dim = 18
-                x, y = model.prepare_batch(x, y)
+                x, y, lengths, mask = model.prepare_batch(x, y)
                 model.output_dim = len(arti_common)
                 y = get_right_indexes(y, arti_common)
                 if cuda_avail:
-                    x, y = x.to(device=model.device), torch.from_numpy(y).double().to(
+                    x, y = x.to(device=model.device), torch.from_numpy(y).to(model.dtype).to(
                         device=model.device)
-                y_pred = model(x).double()
+                    mask = mask.to(device=model.device)
+                y_pred = model(x, lengths=lengths)
                 torch.cuda.empty_cache()
                 if cuda_avail:
                     y_pred = y_pred.to(device=device)
-                y = y.double()  # (Batchsize, maxL, art_common_nb)
-                loss_courant = criterion_both(y, y_pred, loss_train, cuda_avail = cuda_avail, device=device)
+                y = y.to(model.dtype)  # (Batchsize, maxL, art_common_nb)
+                loss_courant = criterion_both(y, y_pred, loss_train, cuda_avail = cuda_avail, device=device, mask=mask)
                 loss_vali += loss_courant.item()
 
                 # to follow both losses
-                loss_2 = criterion_both(y, y_pred, alpha=100, cuda_avail=cuda_avail, device=device)
+                loss_2 = criterion_both(y, y_pred, alpha=100, cuda_avail=cuda_avail, device=device, mask=mask)
                 loss_pearson += loss_2.item()
-                loss_3 = criterion_both(y, y_pred, alpha=0, cuda_avail=cuda_avail, device=device)
+                loss_3 = criterion_both(y, y_pred, alpha=0, cuda_avail=cuda_avail, device=device, mask=mask)
                 loss_rmse += loss_3.item()
 
             loss_vali  = loss_vali/n_valid
@@ -264,26 +273,27 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
             nb_batch = len(files_for_test) / batch_size
             for i in range(int(nb_batch)):
                 n_test += 1
-                x, y = load_np_ema_and_mfcc(files_for_test[i * batch_size:(i + 1) * batch_size])
+                x, y = load_np_ema_and_mfcc(files_for_test[i * batch_size:(i + 1) * batch_size], dataset=dataset)
                 model.output_dim = 18
-                x, y = model.prepare_batch(x, y)
+                x, y, lengths, mask = model.prepare_batch(x, y)
                 model.output_dim = len(arti_common)
                 y = get_right_indexes(y, arti_common)
                 if cuda_avail:
-                    x, y = x.to(device=model.device), torch.from_numpy(y).double().to(
+                    x, y = x.to(device=model.device), torch.from_numpy(y).to(model.dtype).to(
                         device=model.device)
-                y_pred = model(x).double()
+                    mask = mask.to(device=model.device)
+                y_pred = model(x, lengths=lengths)
                 torch.cuda.empty_cache()
                 if cuda_avail:
                     y_pred = y_pred.to(device=device)
-                y = y.double()  # (Batchsize, maxL, art_common_nb)
-                loss_courant = criterion_both(y, y_pred, loss_train, cuda_avail=cuda_avail, device=device)
+                y = y.to(model.dtype)  # (Batchsize, maxL, art_common_nb)
+                loss_courant = criterion_both(y, y_pred, loss_train, cuda_avail=cuda_avail, device=device, mask=mask)
                 loss_test += loss_courant.item()
 
                 # to follow both losses
-                loss_2 = criterion_both(y, y_pred, alpha=100, cuda_avail=cuda_avail, device=device)
+                loss_2 = criterion_both(y, y_pred, alpha=100, cuda_avail=cuda_avail, device=device, mask=mask)
                 loss_pearson += loss_2.item()
-                loss_3 = criterion_both(y, y_pred, alpha=0, cuda_avail=cuda_avail, device=device)
+                loss_3 = criterion_both(y, y_pred, alpha=0, cuda_avail=cuda_avail, device=device, mask=mask)
                 loss_rmse += loss_3.item()
 
             loss_test = loss_test / n_test
@@ -311,7 +321,7 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
         model.load_state_dict(torch.load(os.path.join("saved_models",name_file+'.pt')))
         torch.save(model.state_dict(), os.path.join( "saved_models",name_file+".txt")) #lorsque .txt ==> training terminé !
     random.shuffle(files_for_test)
-    x, y = load_np_ema_and_mfcc(files_for_test)
+    x, y = load_np_ema_and_mfcc(files_for_test, dataset=dataset)
     #y = get_right_indexes(y, arti_common)
     print("evaluation on speaker {}".format(test_on))
     std_speaker = np.load(os.path.join(root_folder,"Preprocessing","norm_values","std_ema_"+test_on+".npy"))
@@ -325,7 +335,7 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
     pearson_valid = np.zeros((1,output_dim))
     nb_batch = len(files_for_valid) / batch_size
     for i in range(int(nb_batch)):
-        x, y = load_np_ema_and_mfcc(files_for_valid[i * batch_size:(i + 1) * batch_size])
+        x, y = load_np_ema_and_mfcc(files_for_valid[i * batch_size:(i + 1) * batch_size], dataset=dataset)
         #y = get_right_indexes(y, arti_common)
         rien, pearson_valid_temp = model.evaluate_on_test(x,y,std_speaker=1, to_plot=to_plot,
                                                              to_consider=arti_to_consider,verbose=False, index_common=arti_common , no_std = True)
@@ -336,6 +346,7 @@ def train_model_arti_common(test_on, n_epochs, loss_train, patience, corpus_to_t
     pearson_valid = np.mean(pearson_valid,axis=0)
     print("on validation set :mean :\n",pearson_valid)
     print("training done for : ",name_file)
+    print(dataset.report())
 
     articulators = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y',
                     'ul_x', 'ul_y', 'll_x', 'll_y', 'la', 'lp', 'ttcl', 'tbcl', 'v_x', 'v_y']
@@ -418,10 +429,18 @@ if __name__=='__main__':
     parser.add_argument('config', type=str,
                         help='spec or dep or indep that stands for speaker specific/dependant/independant')
 
+    parser.add_argument('--precision', type=str, default="float64", choices=["float64", "float32"],
+                        help='type of the model and of the batches, float32 is faster and needs half the memory')
+
+    parser.add_argument('--cache_memory', type=float, default=4.,
+                        help='memory (GB) for the sentences of the speakers kept in memory between the epochs, '
+                             '0 to read the files at each batch')
+
     args = parser.parse_args()
 
     train_model_arti_common(test_on=args.test_on, n_epochs=args.n_epochs, loss_train=args.loss_train,
                 patience=args.patience,  corpus_to_train_on=args.corpus_to_train_on,
                 batch_norma=args.batch_norma, filter_type=args.filter_type, to_plot=args.to_plot,
                 lr=args.lr, delta_valid=args.delta_valid, delta_test=args.delta_test, config=args.config,
-                            speakers_to_train_on=args.speakers_to_train, speakers_to_valid_on=args.speakers_to_valid)
\ No newline at end of file
+                            speakers_to_train_on=args.speakers_to_train, speakers_to_valid_on=args.speakers_to_valid,
+                            precision=args.precision, cache_memory=args.cache_memory)
\ No newline at end of file
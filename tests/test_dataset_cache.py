@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    The memory budget of DatasetCache is for the main process and all the workers of the DataLoaders : the total
+    memory of the processes (PSS, the pages shared by the forked workers counted once) grows by about the budget, not
+    by the budget per worker. And the speakers shared with the workers are not evicted by the main process.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import gc
+import glob
+import ctypes
+import types
+import numpy as np
+import pytest
+torch = pytest.importorskip("torch")
+pytest.importorskip("matplotlib")  # imported by the training modules
+import Preprocessing.manifest
+import Training.dataset_cache
+from Training.dataset_cache import DatasetCache
+from Training.data_loading import get_category_loader
+
+speakers = ["F01", "F02", "F03", "F04", "M01", "M02", "M03", "M04"]
+n_sentences, n_frames = 200, 650
+speaker_size = n_sentences * n_frames * (39 + 18) * 8  # 59 MB
+
+
+def write_speakers(root):
+    """
+    :param root: directory with Preprocessed_data and Training
+    :return: the manifest of the speakers written (n_sentences of n_frames each), see manifest.get_manifest
+    """
+    rng = np.random.RandomState(0)
+    manifest = {}
+    for speaker in speakers:
+        for stream, dim in [("mfcc", 39), ("ema_final", 18)]:
+            os.makedirs(os.path.join(root, "Preprocessed_data", speaker, stream))
+        for k in range(n_sentences):
+            name = "{}_{:03d}".format(speaker, k)
+            np.save(os.path.join(root, "Preprocessed_data", speaker, "mfcc", name + ".npy"), rng.randn(n_frames, 39))
+            np.save(os.path.join(root, "Preprocessed_data", speaker, "ema_final", name + ".npy"),
+                    rng.randn(n_frames, 18))
+            manifest[name] = {"speaker": speaker, "length": n_frames}
+    os.makedirs(os.path.join(root, "Training"))
+    return manifest
+
+
+@pytest.fixture
+def preprocessed(tmp_path, monkeypatch):
+    manifest = write_speakers(str(tmp_path))
+    monkeypatch.setattr(Preprocessing.manifest, "get_manifest", lambda: manifest)
+    monkeypatch.setattr(Training.dataset_cache, "parentdir", str(tmp_path))
+    monkeypatch.chdir(str(tmp_path / "Training"))  # see load_np_ema_and_mfcc
+    return sorted(manifest)
+
+
+def get_pss(pid):
+    """
+    :return: proportional set size of the process in bytes (the pages shared with other processes are divided
+    between them)
+    """
+    with open("/proc/{}/smaps_rollup".format(pid)) as f:
+        return next(int(line.split()[1]) * 1024 for line in f if line.startswith("Pss:"))
+
+
+def get_total_pss():
+    """
+    :return: PSS of this process and of its children (the workers of the DataLoaders)
+    """
+    children = []
+    for path in glob.glob("/proc/self/task/*/children"):
+        with open(path) as f:
+            children += f.read().split()
+    return get_pss("self") + sum(get_pss(pid) for pid in children)
+
+
+def set_mmap_threshold():
+    """
+    :return: whether the threshold was set : the arrays freed by the workers (files read, batches) are given back to
+    the system at once, glibc keeps them in the heap of each worker otherwise (about 300 MB per worker, see mallopt)
+    """
+    try:
+        return ctypes.CDLL(None).mallopt(-3, 64 * 1024) == 1  # M_MMAP_THRESHOLD
+    except AttributeError:  # not glibc
+        return False
+
+
+def get_memory_growth(names, memory_budget):
+    """
+    :param names: the sentences, the first half for the training and the second half for the validation
+    :param memory_budget: see DatasetCache
+    :return: growth of the memory of all the processes after 2 epochs of both loaders with 2 workers each, and the
+    cache of the main process
+    """
+    gc.collect()
+    gc.freeze()  # the objects of this process are not copied by the garbage collector of the forked workers
+    memory_before = get_total_pss()
+    files_per_categ = {"cat0": {"train": names[:len(names) // 2], "valid": names[len(names) // 2:]}}
+    model = types.SimpleNamespace(input_dim=429, output_dim=18, dtype=torch.float64, cuda_avail=False)
+    dataset_cache = DatasetCache(memory_budget=memory_budget)
+    loaders = [get_category_loader(files_per_categ, part, 4, model, shuffle=True, num_workers=2,
+                                   dataset_cache=dataset_cache) for part in ["train", "valid"]]
+    for epoch in range(2):
+        for loader in loaders:
+            for batch in loader:
+                pass
+    del batch
+    gc.collect()
+    gc.unfreeze()
+    return get_total_pss() - memory_before, dataset_cache
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="needs /proc/pid/smaps_rollup")
+def test_total_memory_within_budget(preprocessed):
+    if not set_mmap_threshold():
+        pytest.skip("needs mallopt of glibc")
+    growth_without_cache, _ = get_memory_growth(preprocessed, 0)  # the workers and the batches
+    memory_budget = 2.5 * speaker_size
+    growth, dataset_cache = get_memory_growth(preprocessed, memory_budget)
+    assert dataset_cache.pinned == {"F01", "F02"}  # read before the workers of the training were started
+    assert growth - growth_without_cache < memory_budget  # each worker filling its own cache : about 5 budgets
+
+
+def test_pinned_not_evicted(preprocessed):
+    dataset_cache = DatasetCache(memory_budget=2.5 * speaker_size)
+    dataset_cache.preload(["F01"])
+    assert dataset_cache.get_speaker_set("F02") is not None
+    assert dataset_cache.get_speaker_set("F03") is not None  # evicts F02
+    assert list(dataset_cache.speaker_sets) == ["F01", "F03"] and dataset_cache.n_evicted == 1
+    dataset_cache.preload(["M01"])  # does not fit with F01 and F03, not read
+    assert dataset_cache.pinned == {"F01"}
+    dataset_cache.memory_budget = 1.5 * speaker_size
+    assert dataset_cache.get_speaker_set("M01") is None  # F01 is kept, M01 would not fit even without F03
+    assert list(dataset_cache.speaker_sets) == ["F01", "F03"]
+
+
+def test_read_only(preprocessed):
+    dataset_cache = DatasetCache(memory_budget=10 * speaker_size)
+    dataset_cache.preload(["F01"])
+    dataset_cache.read_only = True
+    assert dataset_cache.get_sentence("F01", "F01_000") is dataset_cache.speaker_sets["F01"]["F01_000"]
+    assert dataset_cache.get_sentence("F02", "F02_000") is None
+    assert list(dataset_cache.speaker_sets) == ["F01"] and dataset_cache.n_loaded == 1
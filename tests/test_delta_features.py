@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    get_delta_features (one fixed filter over the padded array, one utterance or a batch) against the previous
+    implementation, with its weight lag-1 for the lag.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import pytest
+from Preprocessing.tools_preprocessing import get_delta_features
+
+
+def get_delta_features_reference(array, window=5):
+    """
+    the previous get_delta_features : the difference at lag+1 weighted by lag
+    """
+    all_diff = []
+    for lag in range(1, window + 1):
+        padding = np.ones((lag, array.shape[1]))
+        past = np.concatenate([padding * array[0], array[:-lag]])
+        future = np.concatenate([array[lag:], padding * array[-1]])
+        all_diff.append(future - past)
+    tempo = np.array([all_diff[lag] * lag for lag in range(window)])
+    norm = 2 * np.sum([i ** 2 for i in range(1, window + 1)])
+    return np.sum(tempo, axis=0) / norm
+
+
+@pytest.mark.parametrize("n_frames", [6, 50, 400])
+def test_delta_same_as_previous(n_frames):
+    mfcc = np.random.RandomState(0).randn(n_frames, 13)
+    delta = get_delta_features(mfcc)
+    np.testing.assert_array_equal(delta, get_delta_features_reference(mfcc))
+    np.testing.assert_array_equal(get_delta_features(delta), get_delta_features_reference(delta))
+
+
+def test_batch_same_as_utterances():
+    rng = np.random.RandomState(0)
+    lengths = [50, 7, 120]
+    mfccs = [rng.randn(length, 13) for length in lengths]
+    batch = np.zeros((len(lengths), max(lengths), 13))
+    for b, mfcc in enumerate(mfccs):
+        batch[b, :len(mfcc)] = mfcc
+    delta = get_delta_features(batch, lengths=lengths)
+    delta_delta = get_delta_features(delta, lengths=lengths)
+    for b, mfcc in enumerate(mfccs):
+        np.testing.assert_array_equal(delta[b, :len(mfcc)], get_delta_features_reference(mfcc))
+        np.testing.assert_array_equal(delta_delta[b, :len(mfcc)],
+                                      get_delta_features_reference(get_delta_features_reference(mfcc)))
+        assert np.all(delta[b, len(mfcc):] == 0) and np.all(delta_delta[b, len(mfcc):] == 0)
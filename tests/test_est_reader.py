@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    read_est_file (tools_preprocessing) against the previous reader of mocha and MNGU0 (read_est_file_reference in
+    benchmark_preprocessing), on small EST files with the 20 channels of mocha : binary body read directly and
+    memory mapped, and ascii body.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import pytest
+from Preprocessing.tools_preprocessing import read_est_file
+from Preprocessing.benchmark_preprocessing import read_est_file_reference
+
+channel_names = ['tt_x', 'tt_y', 'td_x', 'td_y', 'tb_x', 'tb_y', 'li_x', 'li_y', 'ul_x', 'ul_y', 'll_x', 'll_y',
+                 'v_x', 'v_y', 'bn_x', 'bn_y', 'a1', 'a2', 'a3', 'a4']
+
+
+def get_body(n_frames=50):
+    """
+    :return: float32 body of an EST file with the channels of mocha and 2 more columns, with a few NaN (sensor lost)
+    """
+    body = np.random.RandomState(0).randn(n_frames, len(channel_names) + 2).astype("float32")
+    body[10:13, 4] = np.nan
+    return body
+
+
+def write_est(path, body, data_type):
+    """
+    :param path: path of the EST file
+    :param body: float32 array (n_frames, n_columns)
+    :param data_type: "binary" or "ascii"
+    """
+    with open(path, "wb") as f:
+        f.write(("EST_File Track\nDataType {}\nByteOrder 01\n".format(data_type)).encode())
+        f.write(("NumFrames %d\n" % len(body)).encode())
+        for k, name in enumerate(channel_names):
+            f.write(("Channel_%d %s\n" % (k, name)).encode())
+        f.write(b"EST_Header_End\n")
+        if data_type == "binary":
+            f.write(body.tobytes())
+        else:
+            np.savetxt(f, body, fmt="%.9g")
+
+
+@pytest.mark.parametrize("channels", [channel_names[:14], channel_names[:12], ['li_y', 'tt_x', 'v_y', 'a2']])
+@pytest.mark.parametrize("mmap_size", [0, 1 << 24])  # memory mapped, read
+def test_binary_same_as_previous_reader(tmp_path, channels, mmap_size):
+    path = str(tmp_path / "fsew0_001.ema")
+    write_est(path, get_body(), "binary")
+    ema = read_est_file(path, channels, mmap_size=mmap_size)
+    assert ema.dtype == np.float32 and ema.flags["C_CONTIGUOUS"]
+    np.testing.assert_array_equal(ema, read_est_file_reference(path, channels))
+
+
+@pytest.mark.parametrize("channels", [channel_names[:14], ['li_y', 'tt_x', 'v_y', 'a2']])
+def test_ascii_same_as_binary(tmp_path, channels):
+    body = get_body()
+    path_binary, path_ascii = str(tmp_path / "binary.ema"), str(tmp_path / "ascii.ema")
+    write_est(path_binary, body, "binary")
+    write_est(path_ascii, body, "ascii")
+    np.testing.assert_array_equal(read_est_file(path_ascii, channels), read_est_file_reference(path_binary, channels))
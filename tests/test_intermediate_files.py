@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    The intermediate files written with keep_intermediate, on small raw data of one speaker : the sentences cut from
+    the usc recordings (mat_cut and wav_cut), read back the same as the sentences kept in memory, and the wav of the
+    haskins matlab files.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import scipy.io as sio
+import soundfile
+from Preprocessing.preprocessing_usc_timit import Speaker_usc
+from Preprocessing.preprocessing_haskins import Speaker_Haskins
+
+
+def write_recording(path, n_channels, n_frames, sampling_rate_ema, rng):
+    """
+    :param path: path of the mat file, the name of the file is the name of the variable
+    :return: the structure of the recordings of usc : one field (name, sampling rate, data) per channel
+    """
+    name = os.path.basename(path)[:-4]
+    recording = np.zeros((1, n_channels), dtype=[("name", "O"), ("srate", "O"), ("data", "O")])
+    for channel in range(n_channels):
+        recording[0, channel] = ("s%d" % channel, float(sampling_rate_ema), rng.randn(n_frames, 3).cumsum(axis=0))
+    sio.savemat(path, {name: recording})
+    return recording
+
+
+def make_usc_speaker(root, speaker="F1"):
+    """
+    :param root: directory of the raw data
+    writes one recording of usc (6 s, ema at 100 Hz, wav at 20 kHz) with 2 sentences in its transcription
+    """
+    path_speaker = os.path.join(root, "Raw_data", "usc", speaker)
+    for folder in ["mat", "wav", "trans"]:
+        os.makedirs(os.path.join(path_speaker, folder))
+    rng = np.random.RandomState(0)
+    name = "usctimit_ema_{}_001_005".format(speaker.lower())
+    write_recording(os.path.join(path_speaker, "mat", name + ".mat"), 7, 600, 100, rng)
+    soundfile.write(os.path.join(path_speaker, "wav", name + ".wav"), rng.uniform(-0.5, 0.5, 6 * 20000), 20000,
+                    subtype="PCM_16")
+    with open(os.path.join(path_speaker, "trans", name + ".trans"), "w") as f:
+        f.write("0.00,0.20,sil,x,\n0.20,1.00,aa,x,1\n1.00,1.70,bb,x,1\n2.00,2.20,sil,x,\n2.20,3.50,cc,x,2\n")
+
+
+def test_usc_cut_sentences(tmp_path):
+    make_usc_speaker(str(tmp_path))
+    speaker = Speaker_usc("F1", path_to_raw=str(tmp_path), keep_intermediate=True)
+    path_wav_cut = os.path.join(speaker.path_files_brutes, "wav_cut")
+    os.makedirs(path_wav_cut)
+    open(os.path.join(path_wav_cut, "usctimit_ema_f1_9.wav"), "w").close()  # from a previous run
+    records = speaker.get_data_per_sentence()
+    assert sorted(records) == ["usctimit_ema_f1_1", "usctimit_ema_f1_2"]
+    assert sorted(os.listdir(path_wav_cut)) == ["usctimit_ema_f1_1.wav", "usctimit_ema_f1_2.wav"]
+    for name, record in records.items():
+        np.testing.assert_array_equal(np.load(os.path.join(speaker.path_files_brutes, "mat_cut", name + ".npy")),
+                                      record["ema"])
+        wav, sampling_rate = soundfile.read(os.path.join(path_wav_cut, name + ".wav"), dtype="float32")
+        assert sampling_rate == speaker.sampling_rate_wav_wanted
+        np.testing.assert_array_equal(wav, record["wav"])
+
+
+def make_haskins_speaker(root, speaker="F01"):
+    """
+    :param root: directory of the raw data
+    :return: the wav of the one sentence written (2 s at 44.1 kHz, ema of 8 sensors at 100 Hz), in the matlab file
+    with the ema : audio first, with the words of the sentence (silence from 0 to 0.3 s and from 1.6 s)
+    """
+    path_data = os.path.join(root, "Raw_data", "Haskins", speaker, "data")
+    os.makedirs(path_data)
+    os.makedirs(os.path.join(root, "Raw_data", "Haskins", speaker, "wav"))
+    rng = np.random.RandomState(0)
+    name = speaker + "_B01_S01_R01_N"
+    fields = [("NAME", "O"), ("SRATE", "O"), ("SIGNAL", "O"), ("SOURCE", "O"), ("SENTENCE", "O"), ("WORDS", "O")]
+    recording = np.zeros((1, 9), dtype=fields)
+    words = np.zeros((1, 3), dtype=[("LABEL", "O"), ("OFFS", "O")])
+    for k, (label, start, end) in enumerate([("sil", 0, 0.3), ("word", 0.3, 1.6), ("sil", 1.6, 2.)]):
+        words[0, k] = (label, np.array([[start, end]]))
+    wav = rng.uniform(-0.5, 0.5, (2 * 44100, 1))
+    recording[0, 0] = ("AUDIO", 44100., wav, "", "", words)
+    for sensor in range(1, 9):
+        recording[0, sensor] = ("s%d" % sensor, 100., rng.randn(200, 3).cumsum(axis=0), "", "", "")
+    sio.savemat(os.path.join(path_data, name + ".mat"), {name: recording})
+    return wav[:, 0]
+
+
+def test_haskins_wav(tmp_path):
+    wav = make_haskins_speaker(str(tmp_path))
+    speaker = Speaker_Haskins("F01", path_to_raw=str(tmp_path), keep_intermediate=True)
+    ema, mfcc = speaker.read_ema_and_wav(0)
+    assert len(ema) == len(mfcc) > 0
+    path_wav = os.path.join(str(tmp_path), "Raw_data", "Haskins", "F01", "wav", speaker.EMA_files[0] + ".wav")
+    wav_written, sampling_rate = soundfile.read(path_wav, dtype="float32")
+    assert sampling_rate == speaker.sampling_rate_wav
+    np.testing.assert_array_equal(wav_written, wav.astype(np.float32))
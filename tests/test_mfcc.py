@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    get_mfcc and get_acoustic_features (wav of similar lengths done by batches, see get_mfcc_batches) against
+    librosa.feature.mfcc with the "reflect" padding of the frames (librosa 0.6.3) on each wav, with the parameters of
+    the preprocessing (16kHz, 13 mfcc, frames of 25ms every 10ms).
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import librosa
+import pytest
+from Preprocessing.tools_preprocessing import get_mfcc, get_acoustic_features, get_delta_features
+
+sampling_rate, n_mfcc, n_fft, hop_length = 16000, 13, 400, 160
+
+
+def get_wavs():
+    """
+    :return: list of float32 wav of different lengths : noise, and voiced-like sounds louder at the extremities
+    """
+    rng = np.random.RandomState(0)
+    wavs = []
+    for length in [3000, 8000, 8160, 23456, 40000]:
+        t = np.arange(length) / sampling_rate
+        wavs.append((0.1 * rng.randn(length)).astype(np.float32))
+        wavs.append((0.3 * np.sin(2 * np.pi * 220 * t) * np.exp(-3 * t) + 0.001 * rng.randn(length)).astype(np.float32))
+    return wavs
+
+
+def mfcc_reference(wav):
+    return librosa.feature.mfcc(y=wav, sr=sampling_rate, n_mfcc=n_mfcc, n_fft=n_fft, hop_length=hop_length,
+                                pad_mode="reflect").T
+
+
+@pytest.mark.parametrize("max_batch_frames", [1, 500, 2000])  # one wav per batch, several batches, one batch
+def test_mfcc_same_as_librosa(max_batch_frames):
+    wavs = get_wavs()
+    for wav, mfcc in zip(wavs, get_mfcc(wavs, sampling_rate, n_mfcc, n_fft, hop_length,
+                                        max_batch_frames=max_batch_frames)):
+        expected = mfcc_reference(wav)
+        assert mfcc.shape == expected.shape
+        np.testing.assert_allclose(mfcc, expected, rtol=1e-4, atol=1e-3)
+
+
+def test_acoustic_features_same_as_librosa():
+    wavs = get_wavs()
+    for wav, features in zip(wavs, get_acoustic_features(wavs, sampling_rate, n_mfcc, n_fft, hop_length,
+                                                         max_batch_frames=500)):
+        mfcc = mfcc_reference(wav).astype(np.float64)
+        delta = get_delta_features(mfcc)
+        expected = np.concatenate((mfcc, delta, get_delta_features(delta)), axis=1)
+        assert features.shape == (len(mfcc), 3 * n_mfcc)
+        np.testing.assert_allclose(features, expected, rtol=1e-4, atol=1e-3)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    fill_missing_values against a gap by gap filling of each channel : cubic spline through the valid points of the
+    channel for the short gaps inside the recording, linear for the long gaps, last valid value repeated at the
+    extremities, 0 for a channel lost during the whole recording.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import scipy.interpolate
+import pytest
+from Preprocessing.tools_preprocessing import fill_missing_values
+
+max_spline_gap = 5
+
+
+def fill_channel_reference(channel, max_spline_gap):
+    """
+    :param channel: nparray (K,) with NaN
+    :return: the channel filled gap by gap
+    """
+    channel = channel.copy()
+    valid = np.flatnonzero(~np.isnan(channel))
+    if len(valid) == 0:
+        return np.zeros(len(channel))
+    spline = scipy.interpolate.splrep(valid, channel[valid], k=3) if len(valid) > 3 else None
+    k = 0
+    while k < len(channel):
+        if not np.isnan(channel[k]):
+            k += 1
+            continue
+        end = k
+        while end < len(channel) and np.isnan(channel[end]):
+            end += 1
+        if k == 0:  # before the first valid point
+            channel[:end] = channel[end]
+        elif end == len(channel):  # after the last valid point
+            channel[k:] = channel[k - 1]
+        elif end - k <= max_spline_gap and spline is not None:
+            channel[k:end] = scipy.interpolate.splev(np.arange(k, end), spline)
+        else:
+            channel[k:end] = np.linspace(channel[k - 1], channel[end], end - k + 2)[1:-1]
+        k = end
+    return channel
+
+
+def get_ema():
+    """
+    :return: nparray (200, 6) smooth trajectories with gaps : at the beginning, at the end, of max_spline_gap points,
+    of max_spline_gap+1 points, a channel without valid point, a channel with only 3 valid points, one without gap
+    """
+    t = np.arange(200) / 100.
+    ema = np.stack([np.sin(2 * np.pi * f * t) * 10 + f for f in [1, 2, 3, 1.5, 0.5, 2.5]], axis=1)
+    ema[:7, 0] = np.nan
+    ema[-4:, 0] = np.nan
+    ema[50:50 + max_spline_gap, 0] = np.nan
+    ema[100:100 + max_spline_gap + 1, 1] = np.nan
+    ema[120:121, 1] = np.nan
+    ema[:, 2] = np.nan
+    ema[3:, 3] = np.nan
+    ema[[30, 31, 90, 150], 4] = np.nan
+    return ema
+
+
+def test_fill_same_as_gap_by_gap():
+    ema = get_ema()
+    filled, n_filled = fill_missing_values(ema, max_spline_gap=max_spline_gap)
+    assert np.isnan(ema).sum() > 0 and not np.isnan(filled).any()
+    np.testing.assert_array_equal(n_filled, np.isnan(ema).sum(axis=0))
+    for channel in range(ema.shape[1]):
+        np.testing.assert_allclose(filled[:, channel], fill_channel_reference(ema[:, channel], max_spline_gap),
+                                   rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(filled[~np.isnan(ema)], ema[~np.isnan(ema)])
+
+
+@pytest.mark.parametrize("gap", [max_spline_gap, max_spline_gap + 1])
+def test_spline_up_to_max_gap(gap):
+    t = np.arange(100.)
+    ema = (0.01 * (t - 50) ** 3)[:, np.newaxis]  # cubic : the spline is exact, the linear filling is not
+    expected = ema.copy()
+    ema[40:40 + gap] = np.nan
+    filled = fill_missing_values(ema, max_spline_gap=max_spline_gap)[0]
+    if gap <= max_spline_gap:
+        np.testing.assert_allclose(filled[40:40 + gap, 0], expected[40:40 + gap, 0], atol=1e-9)
+    else:
+        linear = np.linspace(expected[39, 0], expected[40 + gap, 0], gap + 2)[1:-1]
+        np.testing.assert_allclose(filled[40:40 + gap, 0], linear, atol=1e-9)
+
+
+def test_without_missing_values():
+    ema = get_ema()[:, 5:]
+    filled, n_filled = fill_missing_values(ema)
+    assert filled is ema and n_filled.sum() == 0
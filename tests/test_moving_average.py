@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    rolling_mean (cumulative sum, see window_mean) against the previous moving average of calculate_norm_values, and
+    RunningMovingAverage (sentences appended a few at a time) against rolling_mean on all the sentences.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import pytest
+from Preprocessing.tools_preprocessing import rolling_mean
+from Preprocessing.running_stats import RunningMovingAverage
+
+
+def rolling_mean_reference(array, pad=30):
+    """
+    the previous moving average : each column padded with "symmetric", np.mean of the window of each row
+    """
+    padded = np.concatenate([np.expand_dims(np.pad(array[:, k], (pad, pad), "symmetric"), 1)
+                             for k in range(array.shape[1])], axis=1)
+    return np.array([np.mean(padded[k - pad:k + pad], axis=0) for k in range(pad, len(padded) - pad)])
+
+
+def get_mean_ema(n_sentences):
+    """
+    :return: nparray (n_sentences, 18) slowly drifting, as the mean ema of the sentences of a speaker
+    """
+    rng = np.random.RandomState(0)
+    return np.cumsum(rng.randn(n_sentences, 18), axis=0) + 100
+
+
+@pytest.mark.parametrize("n_sentences", [10, 30, 61, 1000])
+def test_rolling_mean_same_as_previous(n_sentences):
+    mean_ema = get_mean_ema(n_sentences)
+    np.testing.assert_allclose(rolling_mean(mean_ema), rolling_mean_reference(mean_ema), rtol=1e-12)
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 45])
+def test_appended_same_as_rolling_mean(batch_size):
+    mean_ema = get_mean_ema(300)
+    moving_average = RunningMovingAverage(pad=30)
+    for start in range(0, len(mean_ema), batch_size):
+        moving_average.append(mean_ema[start:start + batch_size])
+        np.testing.assert_allclose(moving_average.get(), rolling_mean(mean_ema[:start + batch_size]), rtol=1e-12)
+
+
+def test_append_one_sentence():
+    mean_ema = get_mean_ema(80)
+    moving_average = RunningMovingAverage(pad=30)
+    for values in mean_ema:
+        moving_average.append(values)
+    np.testing.assert_allclose(moving_average.get(), rolling_mean(mean_ema), rtol=1e-12)
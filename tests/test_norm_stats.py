@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    The norm values calculated from the running statistics (NormStats, merged from several workers) against the
+    previous calculate_norm_values, on all the ema trajectories and mfcc frames kept in memory.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+from Preprocessing.class_corpus import Speaker
+from Preprocessing.running_stats import NormStats
+
+
+def get_utterances(n_utterances=70):
+    """
+    :return: list of ema trajectories (K,18) and list of mfcc (K,39) of different lengths, the last ema channel is
+    constant (std set to 1)
+    """
+    rng = np.random.RandomState(0)
+    emas, mfccs = [], []
+    for i in range(n_utterances):
+        n_frames = rng.randint(20, 200)
+        ema = rng.randn(n_frames, 18) * rng.uniform(0.5, 3, size=18) + rng.uniform(-10, 10, size=18)
+        ema[:, -1] = 4.
+        emas.append(ema)
+        mfccs.append(rng.randn(n_frames, 39) * 5 + 2)
+    return emas, mfccs
+
+
+def norm_values_reference(emas, mfccs, pad=30):
+    """
+    the previous calculate_norm_values
+    :return: moving average, std, mean of the ema, std and mean of the mfcc
+    """
+    all_mean_ema = np.array([np.mean(traj, axis=0) for traj in emas])
+    all_mean_ema_padded = np.concatenate([np.expand_dims(np.pad(all_mean_ema[:, k], (pad, pad), "symmetric"), 1)
+                                          for k in range(all_mean_ema.shape[1])], axis=1)
+    moving_average = np.array([np.mean(all_mean_ema_padded[k - pad:k + pad], axis=0)
+                               for k in range(pad, len(all_mean_ema_padded) - pad)])
+    std_ema = np.std(np.concatenate(emas, axis=0), axis=0)
+    std_ema[std_ema < 1e-3] = 1
+    mean_ema = np.mean(all_mean_ema, axis=0)
+    std_mfcc = np.mean(np.array([np.std(frame, axis=0) for frame in mfccs]), axis=0)
+    mean_mfcc = np.mean(np.array([np.mean(frame, axis=0) for frame in mfccs]), axis=0)
+    return moving_average, std_ema, mean_ema, std_mfcc, mean_mfcc
+
+
+def get_merged_stats(emas, mfccs, n_workers=3):
+    """
+    :return: NormStats of the utterances, each worker updates its own statistics and they are merged in the order
+    the workers finish
+    """
+    workers = [NormStats() for _ in range(n_workers)]
+    for i, (ema, mfcc) in enumerate(zip(emas, mfccs)):
+        workers[i % n_workers].update(i, ema, mfcc)
+    norm_stats = NormStats()
+    for worker in reversed(workers):
+        norm_stats.merge(worker)
+    return norm_stats
+
+
+def test_merged_std_same_as_concatenated_frames():
+    emas, mfccs = get_utterances()
+    norm_stats = get_merged_stats(emas, mfccs)
+    all_frames = np.concatenate(emas, axis=0)
+    assert norm_stats.ema_frames.count == len(all_frames) and len(norm_stats) == len(emas)
+    np.testing.assert_allclose(norm_stats.ema_frames.mean, np.mean(all_frames, axis=0), rtol=1e-12)
+    np.testing.assert_allclose(norm_stats.ema_frames.std, np.std(all_frames, axis=0), rtol=1e-10, atol=1e-12)
+    assert [norm_stats.n_frames_per_sentence[i] for i in range(len(emas))] == [len(mfcc) for mfcc in mfccs]
+
+
+def test_norm_values_same_as_previous(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the norm values are saved in norm_values
+    os.makedirs("norm_values")
+    emas, mfccs = get_utterances()
+    speaker = Speaker("fsew0")
+    speaker.norm_stats = get_merged_stats(emas, mfccs)
+    speaker.calculate_norm_values()
+    calculated = [speaker.moving_average_ema, speaker.std_ema, speaker.mean_ema, speaker.std_mfcc, speaker.mean_mfcc]
+    for value, expected in zip(calculated, norm_values_reference(emas, mfccs)):
+        assert value.shape == expected.shape
+        np.testing.assert_allclose(value, expected, rtol=1e-10, atol=1e-12)
+    assert speaker.std_ema[-1] == 1
+    np.testing.assert_array_equal(np.load(os.path.join("norm_values", "std_ema_fsew0.npy")), speaker.std_ema)
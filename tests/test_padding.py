@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    The padding of the batches is ignored by the model and the losses (see my_ac2art_model.forward and the mask of
+    criterion_both) : the sentences of a padded batch get the same prediction and the same loss as the sentences run
+    one at a time.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import pytest
+torch = pytest.importorskip("torch")
+pytest.importorskip("matplotlib")  # imported by the training modules
+from Training.model import my_ac2art_model
+from Training.tools_learning import criterion_both
+
+input_dim, output_dim = 429, 18
+
+
+def get_sentences(lengths=(80, 35, 120)):
+    """
+    :return: list of the acoustic features (K,429) and list of the articulatory trajectories (K,18) of the sentences
+    """
+    rng = np.random.RandomState(0)
+    x = [rng.randn(K, input_dim) for K in lengths]
+    y = [rng.randn(K, output_dim) for K in lengths]
+    return x, y
+
+
+def get_model(batch_norma):
+    torch.manual_seed(0)
+    model = my_ac2art_model(hidden_dim=30, input_dim=input_dim, output_dim=output_dim, batch_size=3,
+                            filter_type="fix", batch_norma=batch_norma)
+    for batch_norm_layer in [model.batch_norm_layer, model.batch_norm_layer_2]:  # not the identity of the init
+        batch_norm_layer.running_mean.uniform_(-0.5, 0.5)
+        batch_norm_layer.running_var.uniform_(0.5, 2)
+        torch.nn.init.uniform_(batch_norm_layer.weight, 0.5, 2)
+        torch.nn.init.uniform_(batch_norm_layer.bias, -0.5, 0.5)
+    model.eval()  # batch normalization with its running statistics
+    return model
+
+
+@pytest.mark.parametrize("batch_norma", [False, True])
+@pytest.mark.parametrize("alpha", [0, 50, 100])
+def test_batch_same_as_sentences_alone(batch_norma, alpha):
+    model = get_model(batch_norma)
+    x, y = get_sentences()
+    x_batch, y_batch, lengths, mask = model.prepare_batch(x, y)
+    with torch.no_grad():
+        y_pred_batch = model(x_batch, lengths=lengths)
+        loss_batch = criterion_both(y_batch, y_pred_batch, alpha, False, None, mask=mask)
+        loss_alone = 0
+        for j in range(len(x)):
+            x_alone, y_alone, lengths_alone, mask_alone = model.prepare_batch(x[j:j + 1], y[j:j + 1])
+            y_pred_alone = model(x_alone)
+            np.testing.assert_allclose(y_pred_batch[j, :lengths[j]].numpy(), y_pred_alone[0].numpy(), atol=1e-10)
+            assert torch.all(y_pred_batch[j, lengths[j]:] == 0)
+            loss_alone = loss_alone + criterion_both(y_alone, y_pred_alone, alpha, False, None)
+    np.testing.assert_allclose(loss_batch.item(), loss_alone.item(), rtol=1e-10)
+
+
+def test_batch_norm_statistics_without_padding():
+    model = get_model(True)
+    model.train()
+    x, y = get_sentences()
+    x_batch, y_batch, lengths, mask = model.prepare_batch(x, y)
+    lstm_out = torch.randn(x_batch.shape[0], x_batch.shape[1], 60, dtype=torch.float64) * mask
+    out = model.batch_norm_forward(model.batch_norm_layer, lstm_out, lengths)
+    frames = torch.cat([lstm_out[j, :lengths[j]] for j in range(len(x))])
+    batch_norm_layer = model.batch_norm_layer
+    expected = (frames - frames.mean(dim=0)) / torch.sqrt(frames.var(dim=0, unbiased=False) + batch_norm_layer.eps)
+    expected = expected * batch_norm_layer.weight.detach() + batch_norm_layer.bias.detach()
+    np.testing.assert_allclose(torch.cat([out[j, :lengths[j]] for j in range(len(x))]).detach().numpy(),
+                               expected.numpy(), atol=1e-10)
+    assert torch.all(out * (1 - mask) == 0)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    The final data of a small speaker written by the preprocessing (Speaker.save_utterance and save_manifest) in one
+    npy file per sentence and in the shards (see shards.py) are read back the same by load_sentence, and their
+    manifests give the same sentences (see manifest.py).
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import pytest
+from Preprocessing.class_corpus import Speaker
+from Preprocessing.running_stats import NormStats
+from Preprocessing.shards import shard_streams, write_shard_index, read_shard, load_sentence, get_sentence_names
+from Preprocessing.manifest import read_speaker_manifest, build_manifest
+
+speaker = "fsew0"
+
+
+def get_sentences(n_sentences=5):
+    """
+    :return: dictionary name => (ema_final (K,18), mfcc (K,39)), of different lengths
+    """
+    rng = np.random.RandomState(0)
+    lengths = rng.randint(20, 80, size=n_sentences)
+    return {"{}_{:03d}".format(speaker, k + 1): (rng.randn(K, 18), rng.randn(K, 39)) for k, K in enumerate(lengths)}
+
+
+def write_speaker(path_speaker, sentences, shards, precision):
+    """
+    :param path_speaker: directory of the preprocessed data of the speaker
+    :param sentences: see get_sentences
+    :param shards: whether to write the sentences in the shards or in one npy file per sentence
+    :param precision: type of the final data
+    writes the final data and the manifest as Speaker.Preprocessing_general_speaker does after the first pass
+    """
+    sp = Speaker(speaker, shards=shards, precision=precision)
+    sp.path_files_treated = path_speaker
+    sp.EMA_files = list(sentences)
+    for stream in shard_streams:
+        os.makedirs(os.path.join(path_speaker, stream))
+    utterances = list(range(len(sentences)))
+    for i, (ema, mfcc) in zip(utterances, sentences.values()):
+        sp.norm_stats.update(i, ema, mfcc)
+    if shards:
+        sp.create_shards(utterances)
+    for name, (ema, mfcc) in sentences.items():
+        sp.save_utterance(name, ema_final=ema, mfcc=mfcc)
+    if shards:
+        for stream in shard_streams:
+            write_shard_index(path_speaker, stream, sp.shard_index[stream])
+    sp.save_manifest(utterances, sp.norm_stats)
+    sp.shard_index = None
+
+
+@pytest.mark.parametrize("precision", ["float64", "float32"])
+def test_shards_same_as_files(tmp_path, precision):
+    sentences = get_sentences()
+    path_files, path_shards = str(tmp_path / "files"), str(tmp_path / "shards")
+    write_speaker(path_files, sentences, False, precision)
+    write_speaker(path_shards, sentences, True, precision)
+    assert read_shard(path_files, "ema_final") is None
+    assert os.listdir(os.path.join(path_shards, "ema_final")) == []
+
+    assert sorted(get_sentence_names(path_files)) == get_sentence_names(path_shards) == list(sentences)
+    for name, (ema, mfcc) in sentences.items():
+        for stream, array in [("ema_final", ema), ("mfcc", mfcc)]:
+            from_files = load_sentence(path_files, stream, name)
+            from_shards = load_sentence(path_shards, stream, name)
+            assert from_files.dtype == from_shards.dtype == np.dtype(precision)
+            np.testing.assert_array_equal(from_shards, from_files)
+            np.testing.assert_array_equal(from_files, array.astype(precision))
+
+    manifest_files = read_speaker_manifest(path_files, speaker)
+    manifest_shards = read_speaker_manifest(path_shards, speaker)
+    assert manifest_files == build_manifest(path_files, speaker)
+    assert manifest_shards == build_manifest(path_shards, speaker)
+    assert list(manifest_shards) == list(sentences)
+    offset = 0
+    for name, (ema, mfcc) in sentences.items():
+        info_files, info_shards = manifest_files[name], manifest_shards[name]
+        assert info_files["offset"] is None and info_shards["offset"] == offset
+        assert info_files["length"] == info_shards["length"] == len(ema)
+        assert {k: v for k, v in info_files.items() if k != "offset"} == \
+               {k: v for k, v in info_shards.items() if k != "offset"}
+        offset += len(ema)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Speaker.smooth_data (all the channels filtered at once, see low_pass_filter) against the previous smoothing, one
+    np.convolve per channel of the symmetric padded trajectories.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import pytest
+from Preprocessing.class_corpus import Speaker
+from Preprocessing.tools_preprocessing import low_pass_filter_weight
+
+
+def smooth_data_reference(ema, cutoff, sr, pad=30):
+    """
+    the previous Speaker.smooth_data
+    """
+    weights = low_pass_filter_weight(cut_off=cutoff, sampling_rate=sr)
+    ema_padded = np.concatenate([np.expand_dims(np.pad(ema[:, k], (pad, pad), "symmetric"), 1)
+                                 for k in range(ema.shape[1])], axis=1)
+    ema_filtered = np.concatenate([np.expand_dims(np.convolve(channel, weights, mode='same'), 1)
+                                   for channel in ema_padded.T], axis=1)
+    return ema_filtered[pad:-pad, :]
+
+
+@pytest.mark.parametrize("n_frames", [40, 500, 12000])  # shorter than the filter, direct convolution, fft
+@pytest.mark.parametrize("sr", [0, 200])  # sampling rate of the corpus, given
+def test_smooth_data_same_as_previous(n_frames, sr):
+    speaker = Speaker("fsew0")
+    ema = np.cumsum(np.random.RandomState(0).randn(n_frames, 18), axis=0)
+    expected = smooth_data_reference(ema, speaker.cutoff, sr if sr != 0 else speaker.sampling_rate_ema)
+    np.testing.assert_allclose(speaker.smooth_data(ema, sr), expected, rtol=0, atol=1e-9 * np.abs(ema).max())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    resample_trajectories and Speaker.synchro_ema_mfcc : "fft" against the previous synchronization
+    (scipy.signal.resample), "linear" against np.interp of each channel, "polyphase" against the trajectories
+    sampled at the frames mfcc.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import numpy as np
+import scipy.signal
+import pytest
+from Preprocessing.class_corpus import Speaker
+from Preprocessing.tools_preprocessing import resample_trajectories
+
+
+def get_ema(n_frames, sampling_rate_ema):
+    """
+    :return: nparray (n_frames, 18) slow sinusoids (under the cutoff of the smoothing) sampled at sampling_rate_ema,
+    and the function giving them at any time
+    """
+    frequencies = np.linspace(0.5, 5, 18)
+    phases = np.linspace(0, np.pi, 18)
+    trajectories = lambda t: np.sin(2 * np.pi * frequencies * t[:, np.newaxis] + phases)
+    return trajectories(np.arange(n_frames) / sampling_rate_ema), trajectories
+
+
+@pytest.mark.parametrize("n_frames", [1000, 997, 1237])  # prime number of frames : slow fft, same result
+def test_fft_same_as_previous(n_frames):
+    speaker = Speaker("fsew0")
+    assert speaker.synchro_method == "fft"
+    ema, _ = get_ema(n_frames, speaker.sampling_rate_ema)
+    mfcc = np.zeros((n_frames * 100 // speaker.sampling_rate_ema + 1, 39))
+    ema_synchro, mfcc_synchro = speaker.synchro_ema_mfcc(ema, mfcc)
+    np.testing.assert_array_equal(ema_synchro, scipy.signal.resample(ema, num=len(mfcc)))
+    assert mfcc_synchro is mfcc
+
+
+@pytest.mark.parametrize("n_points", [200, 201, 205])
+def test_linear_same_as_interp(n_points):
+    ema, _ = get_ema(1000, 500)
+    times = np.arange(n_points) * (len(ema) / n_points)
+    expected = np.stack([np.interp(times, np.arange(len(ema)), channel) for channel in ema.T], axis=1)
+    np.testing.assert_allclose(resample_trajectories(ema, n_points, method="linear"), expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("n_points", [199, 200, 201, 203])  # the mfcc are not always cut at the same time as the ema
+def test_polyphase_at_the_frames_mfcc(n_points):
+    speaker = Speaker("fsew0", synchro_method="polyphase")
+    ema, trajectories = get_ema(1000, speaker.sampling_rate_ema)
+    ema_synchro, _ = speaker.synchro_ema_mfcc(ema, np.zeros((n_points, 39)))
+    assert ema_synchro.shape == (n_points, 18)
+    expected = trajectories(np.arange(n_points) * speaker.hop_time)
+    np.testing.assert_allclose(ema_synchro[10:190], expected[10:190], atol=1e-2)
+    if n_points > 200:  # completed with the last point
+        np.testing.assert_array_equal(ema_synchro[200:], np.repeat(ema_synchro[199:200], n_points - 200, axis=0))
+
+
+def test_unknown_method():
+    with pytest.raises(NameError):
+        resample_trajectories(np.zeros((10, 18)), 5, method="cubic")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    The weights saved by the model are loaded back with their version (see my_ac2art_model.load_state_dict), the
+    weights saved before the lstm layers were batch first (same layers, without the version) are refused.
+    python -m pytest tests
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import pytest
+torch = pytest.importorskip("torch")
+pytest.importorskip("matplotlib")  # imported by the training modules
+from Training.model import my_ac2art_model
+
+
+def get_model(precision="float64"):
+    return my_ac2art_model(hidden_dim=30, input_dim=429, output_dim=18, batch_size=3, filter_type="fix",
+                           name_file="F01_test", precision=precision)
+
+
+def test_saved_weights_loaded(tmp_path):
+    torch.manual_seed(0)
+    model = get_model()
+    torch.save(model.state_dict(), str(tmp_path / "F01_test.txt"))
+    loaded = get_model(precision="float32")
+    loaded.load_state_dict(torch.load(str(tmp_path / "F01_test.txt"), map_location="cpu"))
+    x = torch.randn(2, 50, 429, dtype=torch.float64)
+    with torch.no_grad():
+        torch.testing.assert_close(loaded(x.float()), model(x).float(), rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("version", [None, 1])
+def test_previous_weights_refused(version):
+    state = get_model().state_dict()
+    if version is None:  # saved before the version
+        del state["weights_version"]
+    else:
+        state["weights_version"] = torch.tensor(version)
+    with pytest.raises(ValueError, match="trained again"):
+        get_model().load_state_dict(state)